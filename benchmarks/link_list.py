@@ -0,0 +1,158 @@
+"""
+Times rendering a page of links the way ``links/link_list.html`` did
+before rows were cached (a ``rating_for`` form and the row rendered
+inline for every link) against the cached rows with the rating forms
+overlaid by ``link_item_rows``. Each page is rendered for an anonymous
+and a logged in user, with a cold cache and then a warm one. Run it
+with the settings of a project that uses drum, against a throwaway
+test database::
+
+    DJANGO_SETTINGS_MODULE=myproject.settings python benchmarks/link_list.py
+"""
+from __future__ import print_function, unicode_literals
+
+from timeit import default_timer
+
+import django
+django.setup()
+
+from django.conf.urls import include, url
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.db import connection
+from django.template import Context, Template
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.test.utils import setup_test_environment
+from mezzanine.accounts.views import profile
+from mezzanine.generic.models import Keyword, Rating
+
+from drum.chambers.models import Chamber
+from drum.links.models import Link
+
+
+urlpatterns = [
+    url("^users/(?P<username>.*)/$", profile, name="profile"),
+    url("^", include("drum.chambers.urls")),
+    url("^", include("drum.links.urls")),
+]
+
+# The loop from ``links/link_list.html`` before rows were cached.
+BEFORE = Template("""
+{% load rating_tags keyword_tags drum_tags %}
+{% for link in object_list %}
+<div class="link-item clearfix">
+    {% if not profile_user %}{% rating_for link %}{% endif %}
+    <div class="link-detail{% if link.rating_sum < 0 %} link-negative{% endif %}">
+        <h2>
+            <a href="{{ link.url }}">{{ link.title }}</a>
+            <span class="domain">({{ link.domain }}) in</span>
+            <span class="chamber"><a href="{{ link.chamber.get_absolute_url }}">{{ link.chamber.chamber }}</a></span>
+        </h2>
+        by <a class="profile" href="{% url 'profile' link.user.username %}">{{ link.user|get_profile }}</a>
+        {{ link.publish_date|short_timesince }} ago |
+        {% keywords_for link as tags %}
+        {% for tag in tags %}
+        <a href="{% url 'link_list_tag' tag.slug %}">{{ tag }}</a> |
+        {% endfor %}
+        <a class="comments" href="{{ link.get_absolute_url }}">{{ link.comments_count }} comment{{ link.comments_count|pluralize }} </a>
+    </div>
+</div>
+{% endfor %}
+""")
+
+# The loop from ``links/link_list.html`` now.
+AFTER = Template("""
+{% load drum_tags %}
+{% link_item_rows object_list as rows %}
+{% for link, rating, row in rows %}
+<div class="link-item clearfix">
+    {% if rating %}{{ rating }}{% endif %}
+    {{ row }}
+</div>
+{% endfor %}
+""")
+
+PAGE_SIZES = (25, 100, 500)
+REPEAT = 3
+
+# Large enough to hold every row of the biggest page.
+CACHES = {"default": {
+    "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    "OPTIONS": {"MAX_ENTRIES": 10000},
+}}
+
+
+def create_links(count):
+    """
+    Creates ``count`` links with two keywords each, and a vote on
+    every other link from the user returned.
+    """
+    user = User.objects.create_user("bench", "bench@example.com", "bench")
+    chamber = Chamber.objects.create(chamber="bench", title="Bench",
+                                     user=user)
+    keywords = [Keyword.objects.create(title="Keyword %s" % i).id
+                for i in range(20)]
+    for i in range(count):
+        link = Link.objects.create(title="Link %s" % i, user=user,
+            link="http://example.com/%s/" % i, chamber=chamber)
+        link.assign_keywords(keywords[i % 19:i % 19 + 2])
+        if i % 2:
+            Rating.objects.create(content_object=link, user=user, value=1)
+    return user
+
+
+def page(size, before):
+    links = Link.objects.select_related("chamber", "user").order_by("id")
+    if before:
+        links = links.prefetch_related("keywords__keyword")
+    return list(links[:size])
+
+
+def timed(template, size, user, before, warm):
+    """
+    Best time in milliseconds and the number of queries for rendering
+    a page of ``size`` links, including loading the page.
+    """
+    best, queries = None, 0
+    for _ in range(REPEAT):
+        if not warm:
+            cache.clear()
+        request = RequestFactory().get("/")
+        request.user = user
+        connection.queries_log.clear()
+        with CaptureQueriesContext(connection) as captured:
+            start = default_timer()
+            template.render(Context({"object_list": page(size, before),
+                                     "request": request}))
+            elapsed = (default_timer() - start) * 1000
+        queries = len(captured)
+        best = elapsed if best is None else min(best, elapsed)
+    return best, queries
+
+
+def main():
+    setup_test_environment()
+    name = connection.creation.create_test_db(verbosity=0)
+    try:
+        with override_settings(ROOT_URLCONF=__name__, CACHES=CACHES):
+            user = create_links(max(PAGE_SIZES))
+            print("%-5s %-9s %-5s %16s %16s" %
+                  ("rows", "user", "cache", "before", "after"))
+            for size in PAGE_SIZES:
+                for who in (AnonymousUser(), user):
+                    for warm in (False, True):
+                        results = [timed(template, size, who, before, warm)
+                                   for template, before in ((BEFORE, True),
+                                                            (AFTER, False))]
+                        print("%-5s %-9s %-5s %s" % (
+                            size, "user" if who.pk else "anonymous",
+                            "warm" if warm else "cold",
+                            " ".join("%7.1fms %3sq" % result
+                                     for result in results)))
+    finally:
+        connection.creation.destroy_test_db(name, verbosity=0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from drum.chambers.models import ChamberStats
+
+
+class Command(BaseCommand):
+    """
+    Recalculates ``ChamberStats`` from links, votes and comments. This
+    brings each chamber's activity rate down as its events age, so it
+    should be run periodically, eg hourly from cron.
+    """
+
+    help = "Rebuild the stats used to rank chambers."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", dest="batch_size", type=int,
+            default=1000)
+
+    def handle(self, **options):
+        ChamberStats.objects.rebuild(batch_size=options["batch_size"])
+        self.stdout.write("Rebuilt stats for %s chambers" %
+                          ChamberStats.objects.count())
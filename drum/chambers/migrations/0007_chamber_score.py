@@ -0,0 +1,18 @@
+# Generated by Django 2.0.13 on 2026-10-17 04:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chambers', '0006_auto_20190320_1527'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chamber',
+            name='score',
+            field=models.FloatField(db_index=True, default=0, editable=False),
+        ),
+    ]
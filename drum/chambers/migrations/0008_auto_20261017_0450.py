@@ -0,0 +1,18 @@
+# Generated by Django 2.0.13 on 2026-10-17 04:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chambers', '0007_chamber_score'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='chamber',
+            name='chamber',
+            field=models.CharField(max_length=200, unique=True),
+        ),
+    ]
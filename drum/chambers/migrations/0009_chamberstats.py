@@ -0,0 +1,37 @@
+# Generated by Django 2.0.13 on 2026-10-17 04:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_stats(apps, schema_editor):
+    """
+    Create empty stats for existing chambers, which are filled in by
+    the ``rebuild_chamber_stats`` command.
+    """
+    Chamber = apps.get_model("chambers", "Chamber")
+    ChamberStats = apps.get_model("chambers", "ChamberStats")
+    ChamberStats.objects.bulk_create([ChamberStats(chamber_id=pk)
+        for pk in Chamber.objects.values_list("id", flat=True)])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chambers', '0008_auto_20261017_0450'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChamberStats',
+            fields=[
+                ('chamber', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='chambers.Chamber')),
+                ('threads', models.IntegerField(default=0)),
+                ('votes', models.IntegerField(default=0)),
+                ('comments', models.IntegerField(default=0)),
+                ('last_activity', models.DateTimeField(null=True)),
+                ('activity', models.FloatField(db_index=True, default=0)),
+            ],
+        ),
+        migrations.RunPython(create_stats, migrations.RunPython.noop),
+    ]
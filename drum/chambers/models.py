@@ -1,13 +1,25 @@
 from urllib.parse import urlparse
+from datetime import timedelta
 from decimal import Decimal
 
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
 from django.db import models
+from django.db.models import Count, F, Max, OuterRef, Subquery, Sum
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
 from django.urls import reverse
+from django.utils.timezone import now
 
+from mezzanine.core.models import CONTENT_STATUS_PUBLISHED
 from mezzanine.core.models import Displayable, Ownable
 from mezzanine.core.request import current_request
 from mezzanine.generic.fields import RatingField, CommentsField
+from mezzanine.generic.models import Rating, ThreadedComment
+
+from drum.chambers.utils import invalidate_automod_config
+from drum.links.models import Link
+from drum.links.utils import iterate_in_batches, score_for, update_in_bulk
 
 USER_MODEL = getattr(settings, 'AUTH_USER_MODEL', 'auth.User')
 
@@ -25,7 +37,7 @@ BALANCE = dict(decimal_places=2,
 
 class Chamber(Displayable, Ownable):
 
-    chamber = models.CharField(max_length=200)
+    chamber = models.CharField(max_length=200, unique=True)
     rating = RatingField()
     comments = CommentsField()
     balance = models.DecimalField(**BALANCE)
@@ -33,6 +45,7 @@ class Chamber(Displayable, Ownable):
     min_comment_balance = models.DecimalField(**BALANCE)
     automod_can_fine = models.BooleanField(default=False)
     max_fine = models.DecimalField(max_digits=4, decimal_places=2, default=Decimal('0'))
+    score = models.FloatField(default=0, db_index=True, editable=False)
 
     # ugly automod stuff...
     automod_a = models.CharField(**AUTOMOD)
@@ -46,6 +59,13 @@ class Chamber(Displayable, Ownable):
     severity_d = models.DecimalField(**SEVERITY)
     severity_e = models.DecimalField(**SEVERITY)
 
+    score_fields = ["rating_sum", "comments_count"]
+
+    def save(self, *args, **kwargs):
+        self.score = score_for(self, self.score_fields, "publish_date")
+        super(Chamber, self).save(*args, **kwargs)
+        invalidate_automod_config(self.chamber)
+
     def _automod_config(self):
         """
         Helper to get/format automod config for this chamber
@@ -71,3 +91,148 @@ class Chamber(Displayable, Ownable):
         if self.slug:
             return self.slug
         return current_request().build_absolute_uri(self.get_absolute_url())
+
+
+# Number of hours that ``ChamberStats.activity`` is averaged over.
+ACTIVITY_HOURS = 24
+
+
+class ChamberStatsManager(models.Manager):
+
+    def record(self, chamber_id, threads=0, votes=0, comments=0,
+               active=True):
+        """
+        Add to the stats for the chamber with the given id, counting
+        one event in its activity if ``active`` is set.
+        """
+        if not chamber_id:
+            return
+        updates = dict(threads=F("threads") + threads,
+                       votes=F("votes") + votes,
+                       comments=F("comments") + comments)
+        if active:
+            updates.update(last_activity=now(),
+                           activity=F("activity") + 1. / ACTIVITY_HOURS)
+        self.filter(chamber_id=chamber_id).update(**updates)
+
+    def rebuild(self, batch_size=1000):
+        """
+        Recalculate the stats for every chamber from their published
+        links, with a ``GROUP BY`` query for the totals, and one each
+        for the new links, votes and comments in the last
+        ``ACTIVITY_HOURS``.
+        """
+        since = now() - timedelta(hours=ACTIVITY_HOURS)
+        content_type = ContentType.objects.get_for_model(Link)
+        links = Link.objects.filter(status=CONTENT_STATUS_PUBLISHED)
+        links = links.order_by()
+        totals = links.values("chamber").annotate(threads=Count("id"),
+            votes=Sum("rating_count"), comments=Sum("comments_count"),
+            last_activity=Max("updated"))
+        totals = {row.pop("chamber"): row for row in totals}
+        events = {}
+        chamber = Link.objects.filter(id=OuterRef("object_pk"))
+        chamber = Subquery(chamber.values("chamber")[:1])
+        ratings = Rating.objects.filter(content_type=content_type,
+                                        rating_date__gte=since)
+        comments = ThreadedComment.objects.filter(content_type=content_type,
+                                                  submit_date__gte=since)
+        for queryset in (links.filter(publish_date__gte=since),
+                         ratings.annotate(chamber=chamber),
+                         comments.annotate(chamber=chamber)):
+            counts = queryset.order_by().values("chamber")
+            for row in counts.annotate(count=Count("id")):
+                events[row["chamber"]] = (events.get(row["chamber"], 0) +
+                                          row["count"])
+        queryset = Chamber.objects.all()
+        existing = set(self.values_list("chamber_id", flat=True))
+        for rows in iterate_in_batches(queryset, [], batch_size):
+            self.bulk_create([self.model(chamber_id=pk)
+                              for pk, in rows if pk not in existing])
+            stats = {}
+            for pk, in rows:
+                row = totals.get(pk, {})
+                stats[pk] = {
+                    "threads": row.get("threads") or 0,
+                    "votes": row.get("votes") or 0,
+                    "comments": row.get("comments") or 0,
+                    "last_activity": row.get("last_activity"),
+                    "activity": events.get(pk, 0) / ACTIVITY_HOURS,
+                }
+            for field in ("threads", "votes", "comments", "last_activity",
+                          "activity"):
+                values = {pk: stats[pk][field] for pk in stats}
+                update_in_bulk(self.all(), field, values, key="chamber_id")
+
+
+class ChamberStats(models.Model):
+    """
+    Activity in a chamber's threads, kept current by signals as links,
+    votes and comments are added, so chambers can be ranked without
+    aggregating their links. ``activity`` is the number of those per
+    hour over the last ``ACTIVITY_HOURS``, and only falls as they age
+    when ``rebuild_chamber_stats`` is run, so that should be run
+    periodically (eg from cron), like ``rescore``.
+    """
+
+    chamber = models.OneToOneField(Chamber, primary_key=True,
+                                   related_name="stats",
+                                   on_delete=models.CASCADE)
+    threads = models.IntegerField(default=0)
+    votes = models.IntegerField(default=0)
+    comments = models.IntegerField(default=0)
+    last_activity = models.DateTimeField(null=True)
+    activity = models.FloatField(default=0, db_index=True)
+
+    objects = ChamberStatsManager()
+
+
+@receiver(post_save, sender=Chamber)
+def create_chamber_stats(sender, **kwargs):
+    if kwargs["created"] and not kwargs.get("raw"):
+        ChamberStats.objects.create(chamber=kwargs["instance"])
+
+
+@receiver(post_save, sender=Link)
+@receiver(post_delete, sender=Link)
+def link_stats(sender, **kwargs):
+    """
+    Count new threads, and take away deleted ones along with their
+    comments. Their votes are taken away as each rating is deleted.
+    Only published links are threads - drafts held for the moderation
+    queue are counted by ``moderate`` when it publishes them.
+    """
+    link = kwargs["instance"]
+    published = int(link.status == CONTENT_STATUS_PUBLISHED)
+    if "created" not in kwargs:
+        ChamberStats.objects.record(link.chamber_id, threads=-published,
+                                    comments=-link.comments_count,
+                                    active=False)
+    elif kwargs["created"] and not kwargs.get("raw") and published:
+        ChamberStats.objects.record(link.chamber_id, threads=1)
+
+
+@receiver(post_save, sender=Rating)
+@receiver(pre_delete, sender=Rating)
+def rating_stats(sender, **kwargs):
+    """
+    Count votes on threads - a changed vote counts as activity, but
+    doesn't change the number of votes.
+    """
+    rating = kwargs["instance"]
+    if rating.content_type.model_class() is not Link:
+        return
+    chamber_id = Link.objects.filter(pk=rating.object_pk)
+    chamber_id = chamber_id.values_list("chamber", flat=True).first()
+    if "created" not in kwargs:
+        ChamberStats.objects.record(chamber_id, votes=-1, active=False)
+    else:
+        ChamberStats.objects.record(chamber_id, votes=int(kwargs["created"]))
+
+
+@receiver(post_save, sender=ThreadedComment)
+def comment_stats(sender, **kwargs):
+    if kwargs["created"] and not kwargs.get("raw"):
+        link = kwargs["instance"].content_object
+        if isinstance(link, Link):
+            ChamberStats.objects.record(link.chamber_id, comments=1)
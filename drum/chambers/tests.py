@@ -0,0 +1,177 @@
+from threading import Event
+from time import sleep
+
+from django.contrib.auth.models import User
+from django.test import override_settings
+from mezzanine.core.models import CONTENT_STATUS_DRAFT
+from mezzanine.generic.models import Rating
+from mezzanine.utils.sites import current_site_id
+from mezzanine.utils.sites import override_current_site_id
+from mezzanine.utils.tests import TestCase
+
+from drum.chambers import utils
+from drum.chambers.models import Chamber, ChamberStats
+from drum.chambers.utils import AutomodUnavailable, automod_config
+from drum.chambers.utils import automod_scores
+from drum.chambers.views import ChamberList
+from drum.links.models import Link, ModerationTask
+from drum.links.moderation import moderate
+
+
+calls = []
+
+
+def shouting(text):
+    calls.append(text)
+    return sum(c.isupper() for c in text) / len(text)
+
+
+def slow(text):
+    sleep(1)
+    return 1
+
+
+released = Event()
+
+
+def hang(text):
+    released.wait()
+    return 1
+
+
+@override_settings(AUTOMOD_EVALUATORS={
+    "shouting": "drum.chambers.tests.shouting",
+    "slow": "drum.chambers.tests.slow",
+    "hang": "drum.chambers.tests.hang",
+}, AUTOMOD_TIME_BUDGET=0.2)
+class AutomodTests(TestCase):
+
+    def setUp(self):
+        super(AutomodTests, self).setUp()
+        del calls[:]
+        self.chamber = Chamber.objects.create(chamber="test", title="Test",
+                                              user=self._user,
+                                              automod_a="shouting",
+                                              severity_a=0.5)
+
+    def test_config_cached_until_saved(self):
+        automod_config("test")
+        with self.assertNumQueries(0):
+            config = automod_config("test")
+        self.assertEqual(config["automods"], {"shouting": 0.5})
+        self.chamber.automod_b = "slow"
+        self.chamber.save()
+        self.assertEqual(automod_config("test")["automods"],
+                         {"shouting": 0.5, "slow": 0})
+
+    def test_scores_memoized(self):
+        for i in range(2):
+            scores, automods = automod_scores(None, "test", "HEY you")
+        self.assertEqual(scores, {"shouting": 3 / 7})
+        self.assertEqual(automods, {"shouting": 0.5})
+        self.assertEqual(calls, ["HEY you"])
+
+    def test_time_budget(self):
+        self.chamber.automod_b = "slow"
+        self.chamber.save()
+        with self.assertRaises(AutomodUnavailable) as cm:
+            automod_scores(None, "test", "hey")
+        self.assertEqual(cm.exception.automods, ["slow"])
+        with self.assertRaises(AutomodUnavailable):
+            automod_scores(None, "test", "hey")
+        self.assertEqual(calls, ["hey", "hey"])
+
+    @override_settings(AUTOMOD_WORKERS=2)
+    def test_saturated_executor_replaced(self):
+        self.chamber.automod_a = "hang"
+        self.chamber.save()
+        executor = utils._executor
+        try:
+            for text in ("one", "two"):
+                with self.assertRaises(AutomodUnavailable):
+                    automod_scores(None, "test", text)
+            self.chamber.automod_a = "shouting"
+            self.chamber.save()
+            scores, automods = automod_scores(None, "test", "HEY")
+            self.assertEqual(scores, {"shouting": 1})
+            self.assertIsNot(utils._executor, executor)
+        finally:
+            released.set()
+
+    def test_unavailable_not_published(self):
+        self.chamber.automod_b = "slow"
+        self.chamber.save()
+        link = Link(title="Test", chamber=self.chamber, user=self._user,
+                    status=CONTENT_STATUS_DRAFT)
+        link.tag_on_save = False
+        link.save()
+        ModerationTask.objects.create(link=link)
+        self.assertEqual(moderate(ModerationTask.objects.claim()), ([], []))
+        task = ModerationTask.objects.get(link=link)
+        self.assertFalse(task.done)
+        self.assertEqual(task.link.status, CONTENT_STATUS_DRAFT)
+
+
+class ChamberStatsTests(TestCase):
+
+    def setUp(self):
+        super(ChamberStatsTests, self).setUp()
+        for name in ("quiet", "busy"):
+            busy = Chamber.objects.create(chamber=name, title=name,
+                                          user=self._user)
+        voter = User.objects.create_user("voter", "voter@example.com", "x")
+        for i in range(3):
+            link = Link.objects.create(title="Test %s" % i, chamber=busy,
+                                       user=self._user)
+        link.rating.add(Rating(value=1, user=voter), bulk=False)
+        Link.objects.create(title="Gone", chamber=busy,
+                            user=self._user).delete()
+
+    def stats(self):
+        return {stats.chamber.chamber: (stats.threads, stats.votes,
+                                        stats.comments,
+                                        round(stats.activity, 6))
+                for stats in ChamberStats.objects.select_related("chamber")}
+
+    def test_kept_current(self):
+        stats = self.stats()
+        self.assertEqual(stats["quiet"], (0, 0, 0, 0))
+        self.assertEqual(stats["busy"][:3], (3, 1, 0))
+        ChamberStats.objects.rebuild()
+        self.assertEqual(self.stats()["busy"][:3], (3, 1, 0))
+        # The deleted link still counts as activity until rebuilt.
+        self.assertGreater(stats["busy"][3], self.stats()["busy"][3])
+
+    def test_drafts_counted_when_published(self):
+        busy = Chamber.objects.get(chamber="busy")
+        rejected = Link.objects.create(title="Rejected", chamber=busy,
+            user=self._user, status=CONTENT_STATUS_DRAFT)
+        link = Link(title="Queued", chamber=busy, user=self._user,
+                    status=CONTENT_STATUS_DRAFT)
+        link.tag_on_save = False
+        link.save()
+        rejected.delete()
+        self.assertEqual(self.stats()["busy"][0], 3)
+        ModerationTask.objects.create(link=link)
+        moderate(ModerationTask.objects.claim())
+        self.assertEqual(self.stats()["busy"][0], 4)
+        ChamberStats.objects.rebuild()
+        self.assertEqual(self.stats()["busy"][0], 4)
+
+    def test_deleting_chamber_keeps_links(self):
+        Chamber.objects.get(chamber="busy").delete()
+        links = Link.objects.filter(title__startswith="Test")
+        self.assertEqual(links.count(), 3)
+        self.assertFalse(links.filter(chamber__isnull=False).exists())
+
+    def test_ranked_by_activity(self):
+        ChamberStats.objects.rebuild()
+        view = ChamberList()
+        # A request left current by an earlier test makes each site
+        # lookup query the database, so pin the site for the count.
+        with override_current_site_id(current_site_id()):
+            with self.assertNumQueries(1):
+                chambers = list(view.order_by_score(view.get_queryset()))
+                self.assertEqual([c.chamber for c in chambers],
+                                 ["busy", "quiet"])
+                self.assertEqual(chambers[0].stats.threads, 3)
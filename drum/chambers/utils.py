@@ -0,0 +1,169 @@
+from __future__ import unicode_literals
+
+from concurrent.futures import ThreadPoolExecutor, wait
+from hashlib import md5
+from threading import Lock
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from mezzanine.utils.automod import get_automod_scores
+from mezzanine.utils.importing import import_dotted_path
+
+
+CACHE_PREFIX = "drum.automod"
+
+_evaluators = {}
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, "AUTOMOD_WORKERS", 5))
+# Evaluators still running past their time budget, which each hold
+# one of the executor's workers.
+_overrun = set()
+_executor_lock = Lock()
+
+
+class AutomodUnavailable(Exception):
+    """
+    Raised when some of a chamber's automods couldn't score a text,
+    because their evaluators failed or ran past the time budget, so
+    that it can't be moderated yet.
+    """
+
+    def __init__(self, automods):
+        self.automods = automods
+        super(AutomodUnavailable, self).__init__(
+            "Automods unavailable: %s" % ", ".join(automods))
+
+
+def _config_key(chamber):
+    digest = md5(chamber.encode("utf-8")).hexdigest()
+    return "%s.config.%s" % (CACHE_PREFIX, digest)
+
+
+def automod_cache_timeout():
+    """
+    Seconds that automod configs and scores are cached for, via the
+    ``AUTOMOD_CACHE_TIMEOUT`` setting.
+    """
+    return getattr(settings, "AUTOMOD_CACHE_TIMEOUT", 60 * 60)
+
+
+def compile_automod_config(chamber):
+    """
+    The parts of a chamber needed to moderate a new thread in it,
+    which are cached until the chamber is saved. ``version`` is part
+    of the key for scores cached with this config, so they're dropped
+    along with it.
+    """
+    return {
+        "id": chamber.id,
+        "automods": chamber._automod_config(),
+        "min_thread_balance": chamber.min_thread_balance,
+        "can_fine": chamber.automod_can_fine,
+        "max_fine": chamber.max_fine,
+        "version": uuid4().hex,
+    }
+
+
+def automod_config(chamber):
+    """
+    The compiled automod config for the chamber with the given name,
+    or ``None`` if there isn't one.
+    """
+    from drum.chambers.models import Chamber
+    key = _config_key(chamber)
+    config = cache.get(key)
+    if config is None:
+        try:
+            obj = Chamber.objects.get(chamber=chamber)
+        except Chamber.DoesNotExist:
+            return None
+        config = compile_automod_config(obj)
+        cache.set(key, config, automod_cache_timeout())
+    return config
+
+
+def invalidate_automod_config(chamber):
+    cache.delete(_config_key(chamber))
+
+
+def _evaluator(name):
+    """
+    The scoring function for an automod, from the dotted paths in the
+    ``AUTOMOD_EVALUATORS`` setting, or ``None`` if it isn't there.
+    """
+    path = getattr(settings, "AUTOMOD_EVALUATORS", {}).get(name)
+    if path is None:
+        return None
+    if path not in _evaluators:
+        _evaluators[path] = import_dotted_path(path)
+    return _evaluators[path]
+
+
+def _submit(func, text):
+    """
+    Submit an evaluator to the shared executor. Running threads can't
+    be stopped, so once every worker is held by an evaluator that ran
+    past its budget, the executor is replaced with a new one rather
+    than queueing behind them, leaving them to finish in the old one.
+    """
+    global _executor
+    with _executor_lock:
+        _overrun.difference_update([f for f in _overrun if f.done()])
+        workers = getattr(settings, "AUTOMOD_WORKERS", 5)
+        if len(_overrun) >= workers:
+            _executor.shutdown(wait=False)
+            _executor = ThreadPoolExecutor(max_workers=workers)
+            _overrun.clear()
+        return _executor.submit(func, text)
+
+
+def _evaluate(automods, text):
+    """
+    Run each automod's evaluator concurrently, raising
+    ``AutomodUnavailable`` if any take longer than the
+    ``AUTOMOD_TIME_BUDGET`` setting in seconds, or fail, since a text
+    that hasn't been checked by every automod mustn't pass.
+    """
+    budget = getattr(settings, "AUTOMOD_TIME_BUDGET", 2)
+    futures = {_submit(_evaluator(name), text): name for name in automods}
+    done, not_done = wait(futures, timeout=budget)
+    for future in not_done:
+        # Only stops evaluators still waiting for a worker.
+        if not future.cancel():
+            with _executor_lock:
+                _overrun.add(future)
+    scores = {}
+    for future in done:
+        if future.exception() is None:
+            scores[futures[future]] = future.result()
+    missing = sorted(set(automods) - set(scores))
+    if missing:
+        raise AutomodUnavailable(missing)
+    return scores, automods
+
+
+def automod_scores(request, chamber, text):
+    """
+    Drop-in for ``get_automod_scores``, returning ``(scores,
+    automods)`` for the text posted to the chamber, memoized by a hash
+    of the text and the chamber's config, so that reposted text isn't
+    scored again. When every one of the chamber's automods has an
+    evaluator in the ``AUTOMOD_EVALUATORS`` setting, they're run here
+    with the compiled config, otherwise ``get_automod_scores`` is used.
+    Raises ``AutomodUnavailable`` if any of them couldn't score it.
+    """
+    config = automod_config(chamber)
+    if config is None:
+        return get_automod_scores(request, chamber, text)
+    digest = md5((text or "").encode("utf-8")).hexdigest()
+    key = "%s.scores.%s.%s" % (CACHE_PREFIX, config["version"], digest)
+    result = cache.get(key)
+    if result is None:
+        automods = config["automods"]
+        if all(_evaluator(name) for name in automods):
+            result = _evaluate(automods, text)
+        else:
+            result = get_automod_scores(request, chamber, text)
+        cache.set(key, result, automod_cache_timeout())
+    return result
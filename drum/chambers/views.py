@@ -1,82 +1,19 @@
-from django.contrib.auth.models import User
+from decimal import Decimal
+
 from django.contrib.messages import info, error
+from django.db import transaction
 
-from django.shortcuts import get_object_or_404, redirect
-from django.views.generic import ListView, CreateView, DetailView, TemplateView
+from django.shortcuts import redirect
+from django.views.generic import CreateView, DetailView, TemplateView
 
-from mezzanine.accounts import get_profile_model
 from mezzanine.conf import settings
 from mezzanine.generic.models import ThreadedComment
-from mezzanine.utils.views import paginate
 
 from drum.chambers.forms import ChamberForm
 from drum.chambers.models import Chamber
-from drum.links.utils import order_by_score
-from drum.links.models import Profile
-
-
-# Returns the name to be used for reverse profile lookups from the user
-# object. That's "profile" for the ``drum.links.Profile``, but otherwise
-# depends on the model specified in ``AUTH_PROFILE_MODULE``.
-USER_PROFILE_RELATED_NAME = get_profile_model().user.field.related_query_name()
-
-
-class UserFilterView(ListView):
-    """
-    List view that puts a ``profile_user`` variable into the context,
-    which is optionally retrieved by a ``username`` urlpattern var.
-    If a user is loaded, ``object_list`` is filtered by the loaded
-    user. Used for showing lists of links and comments.
-    """
-
-    def get_context_data(self, **kwargs):
-        context = super(UserFilterView, self).get_context_data(**kwargs)
-        try:
-            username = self.kwargs["username"]
-        except KeyError:
-            profile_user = None
-        else:
-            users = User.objects.select_related(USER_PROFILE_RELATED_NAME)
-            lookup = {"username__iexact": username, "is_active": True}
-            profile_user = get_object_or_404(users, **lookup)
-            qs = context["object_list"].filter(user=profile_user)
-            context["object_list"] = qs
-            # Update context_object_name variable
-            context_object_name = self.get_context_object_name(context["object_list"])
-            context[context_object_name] = context["object_list"]
-
-        context["profile_user"] = profile_user
-        context["no_data"] = "No posts to display (yet)."
-        return context
-
-
-class ScoreOrderingView(UserFilterView):
-    """
-    List view that optionally orders ``object_list`` by calculated
-    score. Subclasses must defined a ``date_field`` attribute for the
-    related model, that's used to determine time-scaled scoring.
-    Ordering by score is the default behaviour, but can be
-    overridden by passing ``False`` to the ``by_score`` arg in
-    urlpatterns, in which case ``object_list`` is sorted by most
-    recent, using the ``date_field`` attribute. Used for showing lists
-    of links and comments.
-    """
-
-    def get_context_data(self, **kwargs):
-        context = super(ScoreOrderingView, self).get_context_data(**kwargs)
-        qs = context["object_list"]
-        context["by_score"] = self.kwargs.get("by_score", True)
-        if context["by_score"]:
-            qs = order_by_score(qs, self.score_fields, self.date_field)
-        else:
-            qs = qs.order_by("-" + self.date_field)
-        context["object_list"] = paginate(qs, self.request.GET.get("page", 1),
-            settings.ITEMS_PER_PAGE, settings.MAX_PAGING_LINKS)
-        # Update context_object_name variable
-        context_object_name = self.get_context_object_name(context["object_list"])
-        context[context_object_name] = context["object_list"]
-        context["title"] = self.get_title(context)
-        return context
+from drum.links.models import BalanceTransaction, CommentScore
+from drum.links.models import InsufficientBalance
+from drum.links.views import ScoreOrderingView, USER_PROFILE_RELATED_NAME
 
 
 class ChamberView(object):
@@ -106,10 +43,19 @@ class ChamberList(ChamberView, ScoreOrderingView):
     """
 
     date_field = "publish_date"
-    score_fields = ["rating_sum", "comments_count"]
+    score_fields = Chamber.score_fields
+    score_field = "stats__activity"
+    ranked_cache_namespace = "chambers"
     template_name = "links/chamber_list.html"
     queryset = Chamber.objects.all()
 
+    def get_queryset(self):
+        """
+        Chambers are ranked by their activity in ``ChamberStats``, so
+        the stats are shown without another query.
+        """
+        return super(ChamberList, self).get_queryset().select_related("stats")
+
     def get_title(self, context):
         return "Chambers"  # ?
 
@@ -139,17 +85,24 @@ class ChamberCreate(CreateView):
         else:
             error(self.request, "Chamber exists")
             return redirect(chamber)
-        profile = Profile.objects.get(user=self.request.user)
-        user_balance = profile.balance
-        if user_balance < settings.MIN_CHAMBER_BALANCE:
+        form.instance.user = self.request.user
+        form.instance.gen_description = False
+        # The balance check and charge lock the user's profile until
+        # the chamber is saved, so concurrent posts can't overspend.
+        cost = Decimal(str(getattr(settings, "CHAMBER_COST", 0)))
+        try:
+            with transaction.atomic():
+                BalanceTransaction.objects.transfer(cost,
+                    user_id=self.request.user.id, reason="chamber",
+                    minimum=settings.MIN_CHAMBER_BALANCE)
+                response = super(ChamberCreate, self).form_valid(form)
+        except InsufficientBalance as e:
             msg = "Balance ({}) too low to create a chamber. Minimum: {}"
-            form = msg.format(user_balance, cham, settings.MIN_CHAMBER_BALANCE)
+            form = msg.format(e.balance, settings.MIN_CHAMBER_BALANCE)
             error(self.request, form)
             return redirect('/')
-        form.instance.user = self.request.user
-        form.instance.gen_description = False
         info(self.request, "Chamber created")
-        return super(ChamberCreate, self).form_valid(form)
+        return response
 
 
 class ChamberDetail(ChamberView, DetailView):
@@ -170,11 +123,13 @@ class CommentList(ScoreOrderingView):
     """
 
     date_field = "submit_date"
-    score_fields = ["rating_sum"]
+    score_fields = CommentScore.score_fields
+    score_field = "hot_score__score"
 
     def get_queryset(self):
         qs = ThreadedComment.objects.filter(is_removed=False, is_public=True)
-        select = ["user", "user__%s" % (USER_PROFILE_RELATED_NAME)]
+        select = ["user", "user__%s" % (USER_PROFILE_RELATED_NAME),
+                  "hot_score"]
         prefetch = ["content_object"]
         return qs.select_related(*select).prefetch_related(*prefetch)
 
@@ -5,6 +5,7 @@ from django.contrib import admin
 from django.db import connection
 
 from mezzanine.core.admin import DisplayableAdmin
+from drum.links.keywords import invalidate_keyword_index
 from drum.links.models import Link
 
 
@@ -31,6 +32,7 @@ def delete_keywords(modeladmin, request, queryset):
     cursor.execute("DELETE FROM generic_assignedkeyword "
                    "WHERE keyword_id IN (%s);" % ids)
     cursor.execute("DELETE FROM generic_keyword WHERE id IN (%s);" % ids)
+    invalidate_keyword_index()
 
 
 class KeywordAdmin(admin.ModelAdmin):
@@ -0,0 +1,174 @@
+from __future__ import unicode_literals
+
+from hashlib import md5
+from time import time
+
+from django.core.cache import cache
+from django.conf import settings
+
+
+CACHE_PREFIX = "drum.ranked"
+FRAGMENT_PREFIX = "drum.fragments"
+
+
+def ranked_cache_timeout():
+    """
+    Seconds that ranked lists are cached for, via the
+    ``RANKED_CACHE_TIMEOUT`` setting. Zero disables the cache.
+    """
+    return getattr(settings, "RANKED_CACHE_TIMEOUT", 60)
+
+
+def _generation_key(chamber):
+    digest = md5(chamber.encode("utf-8")).hexdigest()
+    return "%s.generation.%s" % (CACHE_PREFIX, digest)
+
+
+def _new_generation(key):
+    """
+    Start a chamber's generation again after it's been evicted (or
+    before it's been set), from the current time in milliseconds
+    rather than a constant, so that it can't go back to the number of
+    an earlier generation whose lists may still be cached.
+    """
+    generation = int(time() * 1000)
+    if not cache.add(key, generation, None):
+        generation = cache.get(key, generation)
+    return generation
+
+
+def _generation(chamber):
+    """
+    Each chamber has a generation number which is part of the cache
+    key for all of its lists, so that bumping it invalidates them all
+    at once without having to know which keys exist.
+    """
+    key = _generation_key(chamber)
+    generation = cache.get(key)
+    if generation is None:
+        generation = _new_generation(key)
+    return generation
+
+
+def ranked_cache_key(namespace, chamber, **params):
+    """
+    Cache key for one page of a ranked list, made up of the list's
+    namespace (eg "links" or "chambers"), its chamber, the chamber's
+    current generation, and any other params that select the list,
+    such as ``by_score``, ``tag`` and ``page``.
+    """
+    chamber = chamber or ""
+    params = ",".join("%s=%s" % item for item in sorted(params.items()))
+    parts = (namespace, chamber, _generation(chamber), params)
+    digest = md5(repr(parts).encode("utf-8")).hexdigest()
+    return "%s.list.%s" % (CACHE_PREFIX, digest)
+
+
+def _count(name):
+    key = "%s.%s" % (CACHE_PREFIX, name)
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted between the add and the incr.
+        cache.add(key, 1, None)
+
+
+def get_ranked(key):
+    """
+    Return the cached data for a ranked list, counting the hit or miss.
+    """
+    data = cache.get(key)
+    _count("hits" if data is not None else "misses")
+    return data
+
+
+def set_ranked(key, data):
+    cache.set(key, data, ranked_cache_timeout())
+
+
+def invalidate_chamber(chamber):
+    """
+    Invalidate the cached lists for a chamber, and the lists that
+    span all chambers, such as the homepage and "newest".
+    """
+    for name in set([chamber or "", ""]):
+        key = _generation_key(name)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Not set, so any lists cached were from an older one.
+            _new_generation(key)
+
+
+def ranked_cache_stats(reset=False):
+    """
+    Return the hit and miss counters for the ranked list cache,
+    optionally resetting them.
+    """
+    keys = ["%s.%s" % (CACHE_PREFIX, name) for name in ("hits", "misses")]
+    values = cache.get_many(keys)
+    stats = {"hits": values.get(keys[0], 0), "misses": values.get(keys[1], 0)}
+    if reset:
+        cache.delete_many(keys)
+    return stats
+
+
+def page_to_cache(page):
+    """
+    The data stored for a page: its ids, and either its number and
+    the total count, or its cursors for cursor pagination.
+    """
+    data = {"ids": [obj.pk for obj in page]}
+    if hasattr(page, "paginator"):
+        data.update(number=page.number, count=page.paginator.count)
+    else:
+        data.update(next=page.next_cursor, previous=page.previous_cursor)
+    return data
+
+
+class CachedPageList(object):
+    """
+    Stands in for a full list of ``count`` objects when passed to
+    ``paginate``, given only the objects for the page at ``offset``,
+    which is all that ``Paginator`` will slice out of it.
+    """
+
+    def __init__(self, objects, count, offset):
+        self.objects = objects
+        self.offset = offset
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self.objects[index - self.offset]
+        start = max((index.start or 0) - self.offset, 0)
+        stop = index.stop
+        if stop is not None:
+            stop = max(stop - self.offset, 0)
+        return self.objects[start:stop]
+
+
+def fragment_cache_timeout():
+    """
+    Seconds that rendered link rows are cached for, via the
+    ``LINK_FRAGMENT_CACHE_TIMEOUT`` setting. Zero disables the cache.
+    """
+    return getattr(settings, "LINK_FRAGMENT_CACHE_TIMEOUT", 60 * 10)
+
+
+def link_fragment_key(link, *versions):
+    """
+    Cache key for a link's rendered row, made up of the link's id,
+    last update, votes, comment count, keywords and chamber, plus any
+    other ``versions`` the row depends on, such as the keyword
+    generation and the time since the link was published.
+    """
+    chamber = link.chamber.chamber if link.chamber_id else ""
+    parts = (link.id, link.updated, link.rating_sum, link.comments_count,
+             link.keywords_string, chamber) + versions
+    digest = md5(repr(parts).encode("utf-8")).hexdigest()
+    return "%s.link.%s" % (FRAGMENT_PREFIX, digest)
@@ -0,0 +1,177 @@
+from __future__ import unicode_literals
+
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from threading import BoundedSemaphore, Lock
+from time import sleep, time
+from urllib.parse import urlparse
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import F
+from django.utils.timezone import now
+import requests
+from requests.adapters import HTTPAdapter
+
+from mezzanine.accounts import get_profile_model
+from mezzanine.generic.models import AssignedKeyword, Rating
+from mezzanine.utils.sites import current_site_id
+
+from drum.links.cache import invalidate_chamber
+from drum.links.keywords import keyword_index
+from drum.links.models import Link, SearchDocument, chamber_for
+from drum.links.utils import filter_in_batches, score_for, unique_slugs
+
+
+class FeedPoller(object):
+    """
+    Runs network requests for the feed polling commands across a
+    pool of worker threads, sharing one pooled HTTP session, with a
+    limit on concurrent requests to any one host, an optional delay
+    between requests to any one host, and a timeout for each request.
+    Only network work happens in the workers - results are handed
+    back to the calling thread, which does the database work.
+    """
+
+    def __init__(self, workers=8, per_host=2, timeout=10, host_delay=0):
+        self.workers = workers
+        self.per_host = per_host
+        self.timeout = timeout
+        self.host_delay = host_delay
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._hosts = defaultdict(lambda: BoundedSemaphore(per_host))
+        self._last_request = defaultdict(float)
+        self._lock = Lock()
+        self._redirects = {}
+
+    @contextmanager
+    def host_limit(self, url):
+        """
+        Block while ``per_host`` requests are already running for the
+        URL's host, or until ``host_delay`` seconds have passed since
+        the last request to it started.
+        """
+        host = urlparse(url).netloc
+        with self._lock:
+            semaphore = self._hosts[host]
+        with semaphore:
+            if self.host_delay:
+                with self._lock:
+                    start = max(time(), self._last_request[host] +
+                                self.host_delay)
+                    self._last_request[host] = start
+                sleep(max(start - time(), 0))
+            yield
+
+    def get(self, url, **kwargs):
+        """
+        GET a URL with the shared session, host limit and timeout.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        with self.host_limit(url):
+            return self.session.get(url, **kwargs)
+
+    def resolve(self, url):
+        """
+        Return the URL that ``url`` finally redirects to, with a HEAD
+        request, falling back to a GET for servers that don't support
+        HEAD, without downloading the body. Each URL in the redirect
+        chain is cached, so shorteners that appear more than once are
+        only requested once.
+        """
+        with self._lock:
+            if url in self._redirects:
+                return self._redirects[url]
+        kwargs = {"allow_redirects": True, "timeout": self.timeout}
+        with self.host_limit(url):
+            response = self.session.head(url, **kwargs)
+        if response.status_code >= 400:
+            with self.host_limit(url):
+                response = self.session.get(url, stream=True, **kwargs)
+            response.close()
+        response.raise_for_status()
+        with self._lock:
+            for hop in [url] + [r.url for r in response.history]:
+                self._redirects[hop] = response.url
+        return response.url
+
+    def map(self, func, items):
+        """
+        Call ``func`` for each item across the worker pool, yielding
+        ``(item, result, error)`` tuples as each call completes.
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(func, item): item for item in items}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    yield futures[future], None, e
+                else:
+                    yield futures[future], result, None
+
+    def close(self):
+        self.session.close()
+
+
+def ingest_links(links, user_id):
+    """
+    Save a batch of link dicts from feeds, skipping any whose URL has
+    already been added, with a fixed number of queries for the whole
+    batch rather than several per link. ``bulk_create`` skips
+    ``Link.save`` and signals, so the fields they'd set - slug, site,
+    keywords, the initial rating from the user, the score and the
+    search index - are set here, and the ranked list cache is
+    invalidated directly. Returns the new links.
+    """
+    unique = OrderedDict()
+    for link in links:
+        unique.setdefault(link["link"], link)
+    existing = Link.objects.values_list("link", flat=True)
+    existing = set(filter_in_batches(existing, "link", unique))
+    new = [Link(user_id=user_id, **link)
+           for url, link in unique.items() if url not in existing]
+    if not new:
+        return []
+    at = now()
+    site_id = current_site_id()
+    keywords = [obj.auto_tag_keyword_ids() for obj in new]
+    titles = keyword_index().titles
+    slugs = unique_slugs(Link.objects.all(),
+                         [obj.get_slug() for obj in new])
+    for obj, slug, obj_keywords in zip(new, slugs, keywords):
+        obj.slug = slug
+        obj.site_id = site_id
+        obj.publish_date = obj.publish_date or at
+        obj.created = obj.updated = at
+        obj.rating_count = obj.rating_sum = obj.rating_average = 1
+        obj.keywords_string = " ".join(titles[k] for k in obj_keywords)
+        obj.score = score_for(obj, obj.score_fields, "publish_date")
+    content_type = ContentType.objects.get_for_model(Link)
+    with transaction.atomic():
+        Link.objects.bulk_create(new)
+        ids = Link.objects.values_list("link", "id")
+        ids = dict(filter_in_batches(ids, "link", [obj.link for obj in new]))
+        ratings, assigned = [], []
+        for obj, obj_keywords in zip(new, keywords):
+            obj.id = ids[obj.link]
+            ratings.append(Rating(value=1, user_id=user_id,
+                                  content_type=content_type,
+                                  object_pk=obj.id))
+            assigned.extend(AssignedKeyword(keyword_id=keyword_id, _order=i,
+                                            content_type=content_type,
+                                            object_pk=obj.id)
+                            for i, keyword_id in enumerate(obj_keywords))
+        Rating.objects.bulk_create(ratings)
+        # bulk_create() skips the vote_counts receiver.
+        profiles = get_profile_model().objects.filter(user_id=user_id)
+        profiles.update(total_uo_given=F("total_uo_given") + len(ratings))
+        AssignedKeyword.objects.bulk_create(assigned)
+        SearchDocument.objects.index_links(new)
+    for chamber in set(chamber_for(obj) for obj in new):
+        invalidate_chamber(chamber)
+    return new
@@ -1,6 +1,7 @@
-from django.forms.models import modelform_factory
-from django.forms import ValidationError
+from django.forms.models import ModelChoiceField, modelform_factory
+from django.forms import TextInput, ValidationError
 
+from drum.chambers.models import Chamber
 from drum.links.models import Link
 
 fields = ["title", "chamber", "link", "description"]
@@ -9,6 +10,10 @@ BaseLinkForm = modelform_factory(Link, fields=fields)
 
 class LinkForm(BaseLinkForm):
 
+    # Entered by name, rather than chosen from every chamber.
+    chamber = ModelChoiceField(Chamber.objects.all(), required=False,
+                               to_field_name="chamber", widget=TextInput)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         # self.fields['chamber'].widget.attrs['disabled'] = True
@@ -0,0 +1,109 @@
+from __future__ import unicode_literals
+
+from collections import defaultdict
+from re import split, sub
+
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from mezzanine.generic.models import Keyword
+from mezzanine.utils.sites import current_site_id
+
+
+GENERATION_KEY = "drum.keywords.generation"
+
+
+def normalise(title):
+    return " ".join(title.lower().split())
+
+
+def title_words(title):
+    """
+    Split a title into words without their surrounding punctuation,
+    for matching keywords made up of more than one word.
+    """
+    words = [sub(r"^\W+|\W+$", "", word) for word in split(r"\s|/", title)]
+    return [word for word in words if word]
+
+
+class KeywordIndex(object):
+    """
+    In-memory map of normalised keyword titles to keyword ids, so
+    that keywords can be matched for a link without any queries.
+    """
+
+    def __init__(self, keywords):
+        self.ids = defaultdict(list)
+        self.titles = {}
+        self.max_words = 1
+        for keyword_id, title in keywords:
+            self.titles[keyword_id] = title
+            title = normalise(title)
+            self.ids[title].append(keyword_id)
+            self.max_words = max(self.max_words, len(title.split()))
+
+    def match(self, candidates, title=""):
+        """
+        Return the sorted ids of keywords whose titles match any of
+        the candidates (as returned by ``AUTO_TAG_FUNCTION``), or any
+        run of consecutive words in the title, when there are keywords
+        made up of more than one word.
+        """
+        found = set()
+        for candidate in candidates:
+            found.update(self.ids.get(normalise(candidate), ()))
+        words = title_words(title.lower())
+        for n in range(2, self.max_words + 1):
+            for i in range(len(words) - n + 1):
+                found.update(self.ids.get(" ".join(words[i:i + n]), ()))
+        return sorted(found)
+
+
+_indexes = {}
+
+
+def _generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        generation = 1
+        cache.add(GENERATION_KEY, generation, None)
+    return generation
+
+
+def keywords_version():
+    """
+    Number that changes whenever a keyword is saved or deleted, for
+    keying anything rendered from keyword titles or slugs.
+    """
+    return _generation()
+
+
+def keyword_index():
+    """
+    The keyword index for the current site, built once per process,
+    and rebuilt when keywords change, which bumps a generation number
+    in the cache so that every process sees the change.
+    """
+    site_id = current_site_id()
+    generation = _generation()
+    built = _indexes.get(site_id)
+    if built is None or built[0] != generation:
+        keywords = Keyword.objects.values_list("id", "title")
+        built = _indexes[site_id] = (generation, KeywordIndex(keywords))
+    return built[1]
+
+
+def invalidate_keyword_index():
+    if cache.add(GENERATION_KEY, 2, None):
+        return
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.add(GENERATION_KEY, 2, None)
+
+
+@receiver(post_save, sender=Keyword)
+@receiver(post_delete, sender=Keyword)
+def keyword_changed(sender, **kwargs):
+    invalidate_keyword_index()
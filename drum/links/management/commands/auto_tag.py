@@ -1,13 +1,23 @@
 from __future__ import unicode_literals
 
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from string import punctuation
 
-from django.db import connection
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
 from django.core.management.base import BaseCommand, CommandError
+from django.db.models.functions import Lower
 from mezzanine.generic.models import AssignedKeyword, Keyword
+from mezzanine.utils.sites import current_site_id
 from mezzanine.utils.urls import slugify
 
-from drum.links.models import Link
+from drum.links.keywords import invalidate_keyword_index, keyword_index
+from drum.links.models import Link, SearchDocument
+from drum.links.tagging import TAG_FIELDS, init_tagger, tag_links
+from drum.links.utils import LOOKUP_BATCH_SIZE, TopCounter, filter_in_batches
+from drum.links.utils import iterate_in_batches, unique_slugs, update_in_bulk
 
 
 class Command(BaseCommand):
@@ -18,22 +28,113 @@ class Command(BaseCommand):
             default=False)
         parser.add_argument("--assign", dest="assign", action="store_true",
             default=False)
+        parser.add_argument("--capacity", dest="capacity", type=int,
+            help="Number of terms to keep counts for with --generate, "
+                 "10 times the number of keywords by default")
+        parser.add_argument("--chamber", dest="chamber",
+            help="Only generate or assign keywords for links in this "
+                 "chamber")
+        parser.add_argument("--from-id", dest="from_id", type=int,
+            help="Only assign keywords to links from this id")
+        parser.add_argument("--to-id", dest="to_id", type=int,
+            help="Only assign keywords to links up to this id")
+        parser.add_argument("--batch-size", dest="batch_size", type=int,
+            default=1000, help="Number of links to tag per transaction")
+        parser.add_argument("--processes", dest="processes", type=int,
+            default=1, help="Number of processes to tag links with")
 
     def handle(self, **options):
         cursor = connection.cursor()
         if options["remove"]:
             cursor.execute("DELETE FROM generic_assignedkeyword;")
             cursor.execute("DELETE FROM generic_keyword;")
+            invalidate_keyword_index()
         if options["generate"]:
-            self.generate(options["generate"])
+            self.generate(options["generate"], options["chamber"],
+                          options["batch_size"], options["capacity"])
         if options["assign"]:
-            cursor.execute("DELETE FROM generic_assignedkeyword;")
-            Link.objects.update(keywords_string="")
-            for link in Link.objects.all():
-                print("Assigning to %s" % link)
-                link.save()
+            links = Link.objects.order_by("id")
+            if options["chamber"]:
+                links = links.filter(chamber__chamber=options["chamber"])
+            if options["from_id"] is not None:
+                links = links.filter(id__gte=options["from_id"])
+            if options["to_id"] is not None:
+                links = links.filter(id__lte=options["to_id"])
+            self.assign(links, options["batch_size"], options["processes"])
+
+    def assign(self, links, batch_size, processes):
+        """
+        Replace the keywords assigned to the links, a chunk at a time,
+        with each chunk's keywords matched in a pool of processes, and
+        written in a single transaction.
+        """
+        func_name = getattr(settings, "AUTO_TAG_FUNCTION",
+                            "drum.links.utils.auto_tag")
+        # Matched ids must be looked up in the same index they came
+        # from, even if the keywords change during the run.
+        self.index = keyword_index()
+        args = (func_name, list(self.index.titles.items()))
+        links = links.values_list(*TAG_FIELDS).iterator(chunk_size=batch_size)
+        chunks = iter(lambda: list(islice(links, batch_size)), [])
+        if processes > 1:
+            with ProcessPoolExecutor(processes, initializer=init_tagger,
+                                     initargs=args) as executor:
+                for tags in self.map_ahead(executor, chunks, processes * 2):
+                    self.save_tags(tags)
+        else:
+            init_tagger(*args)
+            for chunk in chunks:
+                self.save_tags(tag_links(chunk))
+
+    def map_ahead(self, executor, chunks, ahead):
+        """
+        Like ``executor.map``, but only keeps ``ahead`` chunks queued,
+        rather than reading every link up front.
+        """
+        futures = [executor.submit(tag_links, c)
+                   for c in islice(chunks, ahead)]
+        while futures:
+            tags = futures.pop(0).result()
+            futures.extend(executor.submit(tag_links, c)
+                           for c in islice(chunks, 1))
+            yield tags
+
+    def save_tags(self, tags):
+        content_type = ContentType.objects.get_for_model(Link)
+        titles = self.index.titles
+        ids = [link_id for link_id, keyword_ids in tags]
+        with transaction.atomic():
+            # Deleted without signals, since Mezzanine would otherwise
+            # save (and so re-tag) each link as its keywords go.
+            cursor = connection.cursor()
+            for i in range(0, len(ids), LOOKUP_BATCH_SIZE):
+                batch = ids[i:i + LOOKUP_BATCH_SIZE]
+                cursor.execute("DELETE FROM generic_assignedkeyword "
+                               "WHERE content_type_id = %%s "
+                               "AND object_pk IN (%s);"
+                               % ",".join(["%s"] * len(batch)),
+                               [content_type.id] + batch)
+            AssignedKeyword.objects.bulk_create([
+                AssignedKeyword(keyword_id=keyword_id, _order=i,
+                                content_type=content_type, object_pk=link_id)
+                for link_id, keyword_ids in tags
+                for i, keyword_id in enumerate(keyword_ids)])
+            update_in_bulk(Link.objects.all(), "keywords_string", {
+                link_id: " ".join(titles[k] for k in keyword_ids)
+                for link_id, keyword_ids in tags})
+            links = Link.objects.only("title", "description", "link",
+                                      "keywords_string", "chamber")
+            SearchDocument.objects.index_links(
+                filter_in_batches(links, "id", ids))
+        print("Assigned keywords to links %s to %s" % (ids[0], ids[-1]))
 
-    def generate(self, size):
+    def generate(self, size, chamber=None, batch_size=1000, capacity=None):
+        """
+        Create the ``size`` most common terms in link titles and
+        descriptions as keywords. Terms are extracted a chunk of
+        links at a time, and counted with a ``TopCounter``, so memory
+        stays bounded however many links there are.
+        """
 
         try:
             from topia.termextract import extract
@@ -42,15 +143,39 @@ class Command(BaseCommand):
 
         extractor = extract.TermExtractor()
         extractor.filter = extract.permissiveFilter
-        titles = Link.objects.values_list("title", flat=True)
-        tags = extractor(" ".join(titles))
-        tags.sort(key=lambda tag: tag[1], reverse=True)
+        counter = TopCounter(capacity or size * 10)
+        links = Link.objects.all()
+        if chamber:
+            links = links.filter(chamber__chamber=chamber)
+        fields = ["title", "description"]
+        for rows in iterate_in_batches(links, fields, batch_size):
+            text = " ".join(title if description == title else
+                            "%s. %s" % (title, description)
+                            for _, title, description in rows)
+            for term, occurrences, strength in extractor(text):
+                counter.add(term, occurrences)
 
         def valid_tag(tag):
             def valid_char(char):
                 return not (char in punctuation or char.isdigit())
-            return filter(valid_char, slugify(tag[0]))
+            return "".join(filter(valid_char, slugify(tag)))
 
-        for tag in filter(valid_tag, tags)[:size]:
-            print("Creating keyword %s" % tag[0])
-            Keyword.objects.get_or_create(title=tag[0])
+        existing = Keyword.objects.annotate(lower=Lower("title"))
+        existing = existing.values_list("lower", flat=True)
+        tags = [tag for tag, count in counter.most_common() if valid_tag(tag)]
+        existing = set(filter_in_batches(existing, "lower",
+                                         [tag.lower() for tag in tags]))
+        keywords = []
+        for tag in tags:
+            if len(keywords) == size:
+                break
+            if tag.lower() not in existing:
+                existing.add(tag.lower())
+                keywords.append(Keyword(title=tag, site_id=current_site_id()))
+        slugs = unique_slugs(Keyword.objects.all(),
+                             [keyword.get_slug() for keyword in keywords])
+        for keyword, slug in zip(keywords, slugs):
+            keyword.slug = slug
+            print("Creating keyword %s" % keyword)
+        Keyword.objects.bulk_create(keywords)
+        invalidate_keyword_index()
@@ -0,0 +1,39 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from drum.links.models import KarmaDelta
+
+
+class Command(BaseCommand):
+
+    help = ("Apply the karma ledger to profiles and prune it, or rebuild "
+            "karma from ratings.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", dest="batch_size", type=int,
+            default=1000)
+        parser.add_argument("--check", dest="check", action="store_true",
+            default=False,
+            help="Report profiles whose karma doesn't match their ratings")
+        parser.add_argument("--rebuild", dest="rebuild", action="store_true",
+            default=False,
+            help="Recalculate all karma from ratings")
+        parser.add_argument("--keep-days", dest="keep_days", type=int,
+            help="Days to keep flushed karma changes for, "
+                 "KARMA_LEDGER_DAYS by default")
+
+    def handle(self, **options):
+        if options["check"] or options["rebuild"]:
+            wrong = KarmaDelta.objects.rebuild(commit=options["rebuild"],
+                batch_size=options["batch_size"])
+            for user_id, (stored, expected) in sorted(wrong.items()):
+                self.stdout.write("User %s has karma %s, expected %s" %
+                                  (user_id, stored, expected))
+            action = "Fixed" if options["rebuild"] else "Found"
+            self.stdout.write("%s %s incorrect profiles" % (action, len(wrong)))
+            return
+        applied = KarmaDelta.objects.flush(batch_size=options["batch_size"])
+        self.stdout.write("Applied %s karma changes" % applied)
+        pruned = KarmaDelta.objects.prune(options["keep_days"])
+        self.stdout.write("Deleted %s old karma changes" % pruned)
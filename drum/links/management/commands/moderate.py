@@ -0,0 +1,43 @@
+from __future__ import unicode_literals
+
+from time import sleep
+
+from django.core.management.base import BaseCommand
+
+from drum.links.models import ModerationTask
+from drum.links.moderation import moderate
+
+
+class Command(BaseCommand):
+    """
+    Worker for the moderation queue used when ``MODERATION_QUEUE`` is
+    set. Several can be run at once, since each claims its own tasks.
+    """
+
+    help = "Run automoderation for submitted links, and publish them."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", dest="batch_size", type=int,
+            default=50, help="Number of links to moderate at a time")
+        parser.add_argument("--interval", dest="interval", type=float,
+            default=1, help="Seconds to wait when the queue is empty")
+        parser.add_argument("--timeout", dest="timeout", type=int,
+            default=300, help="Seconds after which tasks claimed by "
+                              "another worker are retried")
+        parser.add_argument("--once", dest="once", action="store_true",
+            default=False, help="Exit once the queue is empty")
+
+    def handle(self, **options):
+        while True:
+            tasks = ModerationTask.objects.claim(options["batch_size"],
+                                                 options["timeout"])
+            if not tasks:
+                if options["once"]:
+                    return
+                sleep(options["interval"])
+                continue
+            published, rejected = moderate(tasks)
+            for link in published:
+                self.stdout.write("Published %s" % link)
+            for link in rejected:
+                self.stdout.write("Rejected %s" % link)
@@ -1,17 +1,19 @@
 from __future__ import print_function, unicode_literals
 
 from datetime import datetime
-from time import mktime
+from hashlib import md5
+import os
+from time import mktime, time
 
 from django.contrib.auth.models import User
 from django.core.management.base import BaseCommand
-from django.utils.timezone import get_default_timezone, make_aware
+from django.db import transaction
+from django.utils.timezone import get_default_timezone, make_aware, now
 from feedparser import parse
-import requests
 
-from mezzanine.generic.models import Rating
-
-from drum.links.models import Link
+from drum.links.feeds import FeedPoller, ingest_links
+from drum.links.models import FeedState, Link, SearchDocument
+from drum.links.utils import iterate_in_batches, update_in_bulk
 
 
 class Command(BaseCommand):
@@ -33,32 +35,147 @@ class Command(BaseCommand):
             default=False,
             help="Will go back and run --follow aginst previously added links"
         )
+        parser.add_argument("--workers", dest="workers", type=int, default=8,
+            help="Number of concurrent HTTP requests")
+        parser.add_argument("--per-host", dest="per_host", type=int,
+            default=2, help="Number of concurrent HTTP requests per host")
+        parser.add_argument("--timeout", dest="timeout", type=float,
+            default=10, help="Seconds to wait for each HTTP request")
+        parser.add_argument("--host-delay", dest="host_delay", type=float,
+            default=0, help="Seconds between requests to each host")
+        parser.add_argument("--batch-size", dest="batch_size", type=int,
+            default=100, help="Number of links to save per transaction")
+        parser.add_argument("--checkpoint", dest="checkpoint",
+            help="File to record --follow-old progress in, so that it "
+                 "resumes from there if interrupted")
 
     def handle(self, **options):
+        self.poller = FeedPoller(workers=options["workers"],
+                                 per_host=options["per_host"],
+                                 timeout=options["timeout"],
+                                 host_delay=options["host_delay"])
+        try:
+            self.poll(**options)
+        finally:
+            self.poller.close()
+
+    def poll(self, **options):
         if options["follow_old"]:
-            self.follow_old()
+            self.follow_old(options["batch_size"], options["checkpoint"])
             return
         try:
             user_id = User.objects.filter(is_superuser=1)[0].id
         except IndexError:
             return
-        for url in options["urls"]:
-            for entry in parse(url).entries:
-                link = self.entry_to_link_dict(entry)
-                if options["follow"]:
-                    try:
-                        link["link"] = self.follow_redirects(link["link"])
-                    except Exception as e:
-                        print("%s - skipping %s" % (e, link["link"]))
-                        continue
-                link["user_id"] = user_id
-                try:
-                    obj = Link.objects.get(link=link["link"])
-                except Link.DoesNotExist:
-                    obj = Link.objects.create(**link)
-                    obj.rating.add(Rating(value=1, user_id=user_id),
-                        bulk=False)
-                    print("Added %s" % obj)
+        urls = options["urls"]
+        self.states = FeedState.objects.in_bulk(urls, field_name="url")
+        links, states = [], []
+        for url, response, error in self.poller.map(self.fetch_feed, urls):
+            if error is not None:
+                print("%s - skipping %s" % (error, url))
+                continue
+            state = self.states.get(url) or FeedState(url=url)
+            entries = self.new_entries(state, response)
+            states.append(state)
+            if entries is None:
+                print("Not modified %s" % url)
+                continue
+            new = [self.entry_to_link_dict(entry) for entry in entries]
+            if options["follow"]:
+                followed = self.follow_links(new)
+                self.forget_entries(state, [entry for entry, link
+                                            in zip(entries, new)
+                                            if link not in followed])
+                new = followed
+            links.extend(new)
+            if len(links) >= options["batch_size"]:
+                self.save_links(links, user_id, states)
+                links, states = [], []
+        self.save_links(links, user_id, states)
+
+    def fetch_feed(self, url):
+        """
+        Download a feed - called from the worker threads. If it was
+        seen before, only ask for it if it has changed since.
+        """
+        state = self.states.get(url)
+        headers = state.request_headers() if state else {}
+        response = self.poller.get(url, headers=headers)
+        response.raise_for_status()
+        return response
+
+    def new_entries(self, state, response):
+        """
+        Update the feed's state from its response, and return the
+        entries that weren't in the feed last time, or ``None`` if it
+        hasn't changed.
+        """
+        state.polled = now()
+        if response.status_code == 304:
+            return None
+        digest = md5(response.content).hexdigest()
+        state.etag = response.headers.get("ETag", "")
+        state.last_modified = response.headers.get("Last-Modified", "")
+        if digest == state.digest:
+            return None
+        state.digest = digest
+        feed = parse(response.content,
+                     response_headers=dict(response.headers))
+        seen = state.seen
+        ids = [self.entry_id(entry) for entry in feed.entries]
+        state.entry_ids = "\n".join(ids)
+        return [entry for entry, entry_id in zip(feed.entries, ids)
+                if entry_id not in seen]
+
+    def forget_entries(self, state, entries):
+        """
+        Remove entries that couldn't be imported from the feed's
+        state, along with its validators, so that they're retried the
+        next time the feed is polled, even if it hasn't changed.
+        """
+        if not entries:
+            return
+        failed = set(self.entry_id(entry) for entry in entries)
+        state.entry_ids = "\n".join(entry_id for entry_id in
+                                    state.entry_ids.splitlines()
+                                    if entry_id not in failed)
+        state.etag = state.last_modified = state.digest = ""
+
+    def entry_id(self, entry):
+        return entry.get("id") or self.link_from_entry(entry)
+
+    def follow_links(self, links):
+        """
+        Follow redirects for each of the links concurrently, dropping
+        any that fail.
+        """
+        followed = []
+        follow = lambda link: self.follow_redirects(link["link"])
+        for link, final, error in self.poller.map(follow, links):
+            if error is not None:
+                print("%s - skipping %s" % (error, link["link"]))
+            else:
+                link["link"] = final
+                followed.append(link)
+        return followed
+
+    def save_links(self, links, user_id, states=()):
+        """
+        Save a batch of link dicts in a single transaction, skipping
+        any whose URL has already been added, along with the state of
+        the feeds they came from, so that a failed batch is retried on
+        the next poll.
+        """
+        start = time()
+        with transaction.atomic():
+            for state in states:
+                state.save()
+            added = ingest_links(links, user_id)
+        for obj in added:
+            print("Added %s" % obj)
+        if links:
+            print("Saved %s of %s links in %.3fs" % (len(added), len(links),
+                                                     time() - start))
 
     def link_from_entry(self, entry):
         """
@@ -85,15 +202,38 @@ class Command(BaseCommand):
         return link
 
     def follow_redirects(self, link):
-        final = requests.get(link).url
+        final = self.poller.resolve(link)
         print("followed %s to %s" % (link, final))
         return final
 
-    def follow_old(self):
-        for link in Link.objects.all():
-            try:
-                new_url = self.follow_redirects(link.link)
-            except Exception as e:
-                print("%s - skipping %s" % (e, link.link))
-            else:
-                Link.objects.filter(id=link.id).update(link=new_url)
+    def follow_old(self, batch_size=100, checkpoint=None):
+        """
+        Follow redirects for previously added links, a batch at a
+        time in order of id, updating each batch's changed URLs and
+        their ``updated`` dates with a single query, and reindexing
+        them for search. If a checkpoint file is given, the id of the
+        last link in each batch is written to it, and a run that was
+        interrupted resumes from there.
+        """
+        links = Link.objects.exclude(link=None).exclude(link="")
+        if checkpoint and os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                links = links.filter(id__gt=int(f.read()))
+        follow = lambda row: self.follow_redirects(row[1])
+        for batch in iterate_in_batches(links, ["link"], batch_size):
+            changed = {}
+            for (pk, link), final, error in self.poller.map(follow, batch):
+                if error is not None:
+                    print("%s - skipping %s" % (error, link))
+                elif final != link:
+                    changed[pk] = final
+            with transaction.atomic():
+                update_in_bulk(Link.objects.all(), "link", changed,
+                               extra={"updated": now()})
+                SearchDocument.objects.index_links(
+                    Link.objects.filter(id__in=list(changed)))
+            if checkpoint:
+                with open(checkpoint, "w") as f:
+                    f.write(str(batch[-1][0]))
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
@@ -0,0 +1,21 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from drum.links.cache import ranked_cache_stats
+
+
+class Command(BaseCommand):
+
+    help = "Show the hit and miss counts for the ranked list cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reset", dest="reset", action="store_true",
+            default=False)
+
+    def handle(self, **options):
+        stats = ranked_cache_stats(reset=options["reset"])
+        total = stats["hits"] + stats["misses"]
+        ratio = stats["hits"] / total if total else 0
+        self.stdout.write("Hits: %(hits)s Misses: %(misses)s" % stats)
+        self.stdout.write("Hit ratio: %.1f%%" % (ratio * 100))
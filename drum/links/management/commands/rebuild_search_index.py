@@ -0,0 +1,22 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from drum.links.models import SearchDocument
+
+
+class Command(BaseCommand):
+    """
+    Fills the search index after it's first created. It's kept current
+    from then on as links and comments are saved.
+    """
+
+    help = "Recreate the search index for links and comments."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", dest="batch_size", type=int,
+            default=1000)
+
+    def handle(self, **options):
+        count = SearchDocument.objects.rebuild(options["batch_size"])
+        self.stdout.write("Indexed %s links and comments" % count)
@@ -0,0 +1,26 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from drum.links.models import BalanceTransaction
+
+
+class Command(BaseCommand):
+
+    help = "Check user and chamber balances against the balance ledger."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", dest="batch_size", type=int,
+            default=1000)
+        parser.add_argument("--fix", dest="fix", action="store_true",
+            default=False,
+            help="Set balances that don't match the ledger to its total")
+
+    def handle(self, **options):
+        wrong = BalanceTransaction.objects.reconcile(commit=options["fix"],
+            batch_size=options["batch_size"])
+        for (account, pk), (stored, expected) in sorted(wrong.items()):
+            self.stdout.write("%s %s has balance %s, expected %s" %
+                              (account.title(), pk, stored, expected))
+        action = "Fixed" if options["fix"] else "Found"
+        self.stdout.write("%s %s incorrect balances" % (action, len(wrong)))
@@ -0,0 +1,26 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from drum.links.models import Profile
+
+
+class Command(BaseCommand):
+
+    help = "Recalculate the vote counters on profiles from ratings."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", dest="batch_size", type=int,
+            default=1000)
+        parser.add_argument("--check", dest="check", action="store_true",
+            default=False,
+            help="Only report profiles whose counters don't match")
+
+    def handle(self, **options):
+        wrong = Profile.objects.recount_votes(commit=not options["check"],
+            batch_size=options["batch_size"])
+        for user_id, (stored, expected) in sorted(wrong.items()):
+            self.stdout.write("User %s has votes %s, expected %s" %
+                              (user_id, stored, expected))
+        action = "Found" if options["check"] else "Fixed"
+        self.stdout.write("%s %s incorrect profiles" % (action, len(wrong)))
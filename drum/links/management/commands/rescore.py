@@ -0,0 +1,47 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from mezzanine.generic.models import ThreadedComment
+
+from drum.chambers.models import Chamber
+from drum.links.models import Link, CommentScore
+from drum.links.utils import calculate_scores, iterate_in_batches
+from drum.links.utils import update_in_bulk
+
+
+class Command(BaseCommand):
+    """
+    Stored scores don't depend on when they were calculated, so they
+    only need recalculating after changing ``SCORE_DECAY_SECONDS``, or
+    for rows whose scores were never stored.
+    """
+
+    help = "Recalculate the stored scores for links, chambers and comments."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", dest="batch_size", type=int,
+            default=1000)
+
+    def handle(self, **options):
+        batch_size = options["batch_size"]
+        for model in (Link, Chamber):
+            fields = model.score_fields + ["publish_date"]
+            queryset = model.objects.all()
+            for rows in iterate_in_batches(queryset, fields, batch_size):
+                scores = calculate_scores(rows)
+                update_in_bulk(model.objects.all(), "score", scores)
+            self.stdout.write("Rescored %s" % model._meta.verbose_name_plural)
+        fields = CommentScore.score_fields + ["submit_date"]
+        queryset = ThreadedComment.objects.all()
+        for rows in iterate_in_batches(queryset, fields, batch_size):
+            scores = calculate_scores(rows)
+            with transaction.atomic():
+                existing = CommentScore.objects.filter(pk__in=list(scores))
+                existing = set(existing.values_list("pk", flat=True))
+                CommentScore.objects.bulk_create([
+                    CommentScore(comment_id=pk, score=score)
+                    for pk, score in scores.items() if pk not in existing])
+                scores = {pk: scores[pk] for pk in existing}
+                update_in_bulk(CommentScore.objects.all(), "score", scores)
+        self.stdout.write("Rescored comments")
@@ -0,0 +1,27 @@
+# Generated by Django 2.0.13 on 2026-10-17 04:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('generic', '0003_auto_20170411_0504'),
+        ('links', '0005_auto_20190320_2003'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CommentScore',
+            fields=[
+                ('comment', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='hot_score', serialize=False, to='generic.ThreadedComment')),
+                ('score', models.FloatField(db_index=True, default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='link',
+            name='score',
+            field=models.FloatField(db_index=True, default=0, editable=False),
+        ),
+    ]
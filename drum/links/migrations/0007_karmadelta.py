@@ -0,0 +1,27 @@
+# Generated by Django 2.0.13 on 2026-10-17 04:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('links', '0006_auto_20261017_0427'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KarmaDelta',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rater_id', models.IntegerField(null=True)),
+                ('object_pk', models.IntegerField()),
+                ('value', models.IntegerField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('flushed', models.BooleanField(db_index=True, default=False)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.ContentType')),
+            ],
+        ),
+    ]
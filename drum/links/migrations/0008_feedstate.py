@@ -0,0 +1,25 @@
+# Generated by Django 2.0.13 on 2026-10-17 04:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('links', '0007_karmadelta'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(max_length=500, unique=True)),
+                ('etag', models.CharField(blank=True, max_length=500)),
+                ('last_modified', models.CharField(blank=True, max_length=100)),
+                ('digest', models.CharField(blank=True, max_length=32)),
+                ('entry_ids', models.TextField(blank=True)),
+                ('polled', models.DateTimeField(null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 2.0.13 on 2026-10-17 04:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('links', '0008_feedstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ModerationTask',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('claimed', models.DateTimeField(null=True)),
+                ('attempts', models.IntegerField(default=0)),
+                ('done', models.BooleanField(db_index=True, default=False)),
+                ('reason', models.TextField(blank=True)),
+                ('link', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='moderation', to='links.Link')),
+            ],
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 2.0.13 on 2026-10-17 04:47
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def opening_balances(apps, schema_editor):
+    """
+    Record the existing balances as opening balances in the ledger.
+    """
+    BalanceTransaction = apps.get_model("links", "BalanceTransaction")
+    Chamber = apps.get_model("chambers", "Chamber")
+    Profile = apps.get_model("links", "Profile")
+    rows = [BalanceTransaction(user_id=user_id, amount=balance,
+                               reason="opening")
+            for user_id, balance in Profile.objects.exclude(balance=0)
+                                   .values_list("user_id", "balance")]
+    rows += [BalanceTransaction(chamber_id=chamber_id, amount=balance,
+                                reason="opening")
+             for chamber_id, balance in Chamber.objects.exclude(balance=0)
+                                        .values_list("id", "balance")]
+    BalanceTransaction.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chambers', '0007_chamber_score'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('links', '0009_moderationtask'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceTransaction',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('reason', models.CharField(choices=[('opening', 'Opening balance'), ('thread', 'Thread created'), ('chamber', 'Chamber created'), ('fine', 'Automod fine'), ('adjustment', 'Adjustment')], max_length=20)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('chamber', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='chambers.Chamber')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(opening_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.0.13 on 2026-10-17 04:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('links', '0010_balancetransaction'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='link',
+            index=models.Index(fields=['chamber', 'status', 'publish_date'], name='links_chamber_status_pub_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='link',
+            index=models.Index(fields=['chamber', 'status', 'score'], name='links_chamber_status_score_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='link',
+            index=models.Index(fields=['link', 'chamber', 'publish_date'], name='links_link_chamber_pub_idx'),
+        ),
+    ]
@@ -0,0 +1,76 @@
+from django.db import migrations, models, transaction
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+BATCH_SIZE = 10000
+
+
+def update_in_batches(apps, **updates):
+    """
+    Update links a range of ids at a time, each range in its own
+    transaction, so that large tables aren't locked for the whole
+    migration.
+    """
+    Link = apps.get_model("links", "Link")
+    last = Link.objects.aggregate(last=models.Max("id"))["last"] or 0
+    for start in range(0, last + 1, BATCH_SIZE):
+        links = Link.objects.filter(id__gte=start, id__lt=start + BATCH_SIZE)
+        with transaction.atomic():
+            links.update(**updates)
+
+
+def set_chamber_ids(apps, schema_editor):
+    Chamber = apps.get_model("chambers", "Chamber")
+    chambers = Chamber.objects.filter(chamber=OuterRef("chamber_name"))
+    update_in_batches(apps, chamber=Subquery(chambers.values("id")[:1]))
+
+
+def set_chamber_names(apps, schema_editor):
+    Chamber = apps.get_model("chambers", "Chamber")
+    chambers = Chamber.objects.filter(id=OuterRef("chamber_id"))
+    name = Subquery(chambers.values("chamber")[:1])
+    update_in_batches(apps, chamber_name=Coalesce(name, Value("")))
+
+
+class Migration(migrations.Migration):
+    """
+    Replaces the chamber name on links with a foreign key, keeping the
+    name in ``chamber_name`` until the next migration, so the backfill
+    can be checked before it's dropped. Links whose chamber doesn't
+    exist (such as those imported from feeds) are left without one.
+    """
+
+    atomic = False
+
+    dependencies = [
+        ('chambers', '0009_chamberstats'),
+        ('links', '0011_auto_20261017_0450'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='link',
+            name='links_chamber_status_pub_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='link',
+            name='links_chamber_status_score_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='link',
+            name='links_link_chamber_pub_idx',
+        ),
+        migrations.RenameField(
+            model_name='link',
+            old_name='chamber',
+            new_name='chamber_name',
+        ),
+        migrations.AddField(
+            model_name='link',
+            name='chamber',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='links', to='chambers.Chamber'),
+        ),
+        migrations.RunPython(set_chamber_ids, set_chamber_names),
+    ]
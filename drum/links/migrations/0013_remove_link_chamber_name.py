@@ -0,0 +1,32 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('links', '0012_link_chamber_fk'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='link',
+            name='chamber_name',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+        migrations.RemoveField(
+            model_name='link',
+            name='chamber_name',
+        ),
+        migrations.AddIndex(
+            model_name='link',
+            index=models.Index(fields=['chamber', 'status', 'publish_date'], name='links_chamber_status_pub_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='link',
+            index=models.Index(fields=['chamber', 'status', 'score'], name='links_chamber_status_score_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='link',
+            index=models.Index(fields=['link', 'chamber', 'publish_date'], name='links_link_chamber_pub_idx'),
+        ),
+    ]
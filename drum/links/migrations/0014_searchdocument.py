@@ -0,0 +1,33 @@
+# Generated by Django 2.0.13 on 2026-10-17 05:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+import drum.links.search
+
+
+class Migration(migrations.Migration):
+    """
+    The index is filled in by the ``rebuild_search_index`` command.
+    """
+
+    dependencies = [
+        ('generic', '0003_auto_20170411_0504'),
+        ('chambers', '0009_chamberstats'),
+        ('links', '0013_remove_link_chamber_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.TextField()),
+                ('chamber', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='chambers.Chamber')),
+                ('comment', models.OneToOneField(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='search_document', to='generic.ThreadedComment')),
+                ('link', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_documents', to='links.Link')),
+            ],
+        ),
+        migrations.RunPython(drum.links.search.create_index,
+                             drum.links.search.drop_index),
+    ]
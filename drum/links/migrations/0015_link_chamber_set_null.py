@@ -0,0 +1,34 @@
+# Generated by Django 2.0.13 on 2026-10-17 05:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+import drum.links.search
+
+
+class Migration(migrations.Migration):
+    """
+    Deleting a chamber leaves its links, and their search documents,
+    without a chamber rather than deleting them.
+    """
+
+    dependencies = [
+        ('links', '0014_searchdocument'),
+    ]
+
+    operations = [
+        migrations.RunPython(drum.links.search.drop_triggers,
+                             drum.links.search.create_triggers),
+        migrations.AlterField(
+            model_name='link',
+            name='chamber',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='links', to='chambers.Chamber'),
+        ),
+        migrations.AlterField(
+            model_name='searchdocument',
+            name='chamber',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chambers.Chamber'),
+        ),
+        migrations.RunPython(drum.links.search.create_triggers,
+                             drum.links.search.drop_triggers),
+    ]
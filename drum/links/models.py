@@ -1,24 +1,36 @@
-from operator import ior
-from functools import reduce
+from collections import defaultdict
+from datetime import timedelta
 from decimal import Decimal
+from time import time
 
 from urllib.parse import urlparse
 
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
 from django.urls import reverse
-from django.db import models
-from django.db.models import Q
-from django.db.models.signals import post_save, pre_delete
+from django.db import connection, models, transaction
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Sum
+from django.db.models import When
+from django.db.models.functions import Cast
+from django.db.models.signals import post_save, post_delete, pre_delete
 from django.dispatch import receiver
 from django.utils.encoding import python_2_unicode_compatible
+from django.utils.timezone import now
 
 from mezzanine.accounts import get_profile_model
 from mezzanine.core.models import Displayable, Ownable
 from mezzanine.core.request import current_request
-from mezzanine.generic.models import Rating, Keyword, AssignedKeyword
+from mezzanine.generic.models import Rating, AssignedKeyword
+from mezzanine.generic.models import ThreadedComment
 from mezzanine.generic.fields import RatingField, CommentsField
 from mezzanine.utils.importing import import_dotted_path
 
+from drum.links.cache import invalidate_chamber
+from drum.links.keywords import keyword_index
+from drum.links.search import match
+from drum.links.utils import filter_in_batches, iterate_in_batches
+from drum.links.utils import score_for, update_in_bulk
+
 
 USER_MODEL = getattr(settings, 'AUTH_USER_MODEL', 'auth.User')
 
@@ -28,10 +40,32 @@ class Link(Displayable, Ownable):
     link = models.URLField(null=True, blank=(not getattr(settings, "LINK_REQUIRED", False)))
     rating = RatingField()
     comments = CommentsField()
-    chamber = models.CharField(max_length=200, null=False)
+    # Links imported from feeds don't belong to a chamber. Not indexed
+    # on its own, since it leads each of the indexes below.
+    chamber = models.ForeignKey("chambers.Chamber", null=True,
+                                db_index=False, related_name="links",
+                                on_delete=models.SET_NULL)
+    score = models.FloatField(default=0, db_index=True, editable=False)
+
+    score_fields = ["rating_sum", "comments_count"]
+
+    # Set to False to leave auto-tagging to the moderation queue.
+    tag_on_save = True
+
+    class Meta:
+        indexes = [
+            # Chamber lists.
+            models.Index(fields=["chamber", "status", "publish_date"],
+                         name="links_chamber_status_pub_idx"),
+            models.Index(fields=["chamber", "status", "score"],
+                         name="links_chamber_status_score_idx"),
+            # Duplicate link checks, and feed imports.
+            models.Index(fields=["link", "chamber", "publish_date"],
+                         name="links_link_chamber_pub_idx"),
+        ]
 
     def get_absolute_url(self):
-        kwa = {"slug": self.slug, "chamber": self.chamber}
+        kwa = {"slug": self.slug, "chamber": chamber_for(self) or ""}
         return reverse("link_detail", kwargs=kwa)
 
     @property
@@ -45,16 +79,97 @@ class Link(Displayable, Ownable):
         return current_request().build_absolute_uri(self.get_absolute_url())
 
     def save(self, *args, **kwargs):
-        keywords = []
-        if not self.keywords_string and getattr(settings, "AUTO_TAG", False):
-            func_name = getattr(settings, "AUTO_TAG_FUNCTION",
-                                "drum.links.utils.auto_tag")
-            keywords = import_dotted_path(func_name)(self)
+        keyword_ids = []
+        if self.tag_on_save and not self.keywords_string:
+            keyword_ids = self.auto_tag_keyword_ids()
+        # Mezzanine saves the link whenever its ratings or comments
+        # change, so this keeps the stored score current.
+        self.score = score_for(self, self.score_fields, "publish_date")
         super(Link, self).save(*args, **kwargs)
-        if keywords:
-            lookup = reduce(ior, [Q(title__iexact=k) for k in keywords])
-            for keyword in Keyword.objects.filter(lookup):
-                self.keywords.add(AssignedKeyword(keyword=keyword), bulk=False)
+        if keyword_ids:
+            self.assign_keywords(keyword_ids)
+
+    def auto_tag_keyword_ids(self):
+        """
+        Ids of the keywords to assign to the link if ``AUTO_TAG`` is
+        set, matched from ``AUTO_TAG_FUNCTION``.
+        """
+        if not getattr(settings, "AUTO_TAG", False):
+            return []
+        func_name = getattr(settings, "AUTO_TAG_FUNCTION",
+                            "drum.links.utils.auto_tag")
+        candidates = import_dotted_path(func_name)(self)
+        return keyword_index().match(candidates, self.title)
+
+    def assign_keywords(self, keyword_ids):
+        """
+        Assign keywords with a single insert, rather than adding them
+        one at a time, which would save the link again for each.
+        """
+        content_type = ContentType.objects.get_for_model(self)
+        AssignedKeyword.objects.bulk_create([
+            AssignedKeyword(keyword_id=keyword_id, _order=i,
+                            content_type=content_type, object_pk=self.id)
+            for i, keyword_id in enumerate(keyword_ids)])
+        titles = keyword_index().titles
+        self.keywords_string = " ".join(titles[k] for k in keyword_ids)
+        Link.objects.filter(id=self.id).update(
+            keywords_string=self.keywords_string)
+        SearchDocument.objects.index(self)
+
+
+class CommentScore(models.Model):
+    """
+    Stored score for a ``ThreadedComment``, which lives in Mezzanine
+    so we can't add a field to it directly.
+    """
+
+    comment = models.OneToOneField(ThreadedComment, primary_key=True,
+                                   related_name="hot_score",
+                                   on_delete=models.CASCADE)
+    score = models.FloatField(default=0, db_index=True)
+
+    score_fields = ["rating_sum"]
+
+
+class ProfileManager(models.Manager):
+
+    def recount_votes(self, commit=True, batch_size=1000):
+        """
+        Recalculate the vote counters for every profile from ``Rating``
+        rows - up and down votes given with a single ``GROUP BY``
+        query, and the number of other users whose links or comments
+        were upvoted with a query per rated model. Returns a dict of
+        user ids mapped to ``(stored, expected)`` tuples of the three
+        counters for profiles that were wrong, which are only fixed if
+        ``commit`` is ``True``.
+        """
+        ratings = Rating.objects.filter(user__isnull=False).order_by()
+        votes = ratings.values("user_id").annotate(
+            up=Count(Case(When(value__gt=0, then=1))),
+            down=Count(Case(When(value__lt=0, then=1))))
+        expected = defaultdict(lambda: [0, 0, 0])
+        for row in votes:
+            expected[row["user_id"]][:2] = [row["up"], row["down"]]
+        for user_id, paid in users_paid().items():
+            expected[user_id][2] = paid
+        fields = ["total_uo_given", "total_down_given", "total_users_paid"]
+        wrong = {}
+        with transaction.atomic():
+            for rows in iterate_in_batches(self.all(), ["user_id"] + fields,
+                                           batch_size):
+                fixes = {}
+                for row in rows:
+                    stored = tuple(row[2:])
+                    counts = tuple(expected.get(row[1], (0, 0, 0)))
+                    if stored != counts:
+                        wrong[row[1]] = fixes[row[1]] = (stored, counts)
+                if commit:
+                    for i, field in enumerate(fields):
+                        values = {k: v[1][i] for k, v in fixes.items()}
+                        update_in_bulk(self.all(), field, values,
+                                       key="user_id")
+        return wrong
 
 
 @python_2_unicode_compatible
@@ -72,6 +187,8 @@ class Profile(models.Model):
     total_down_given = models.IntegerField(default=0, editable=False)
     total_users_paid = models.IntegerField(default=0, editable=False)
 
+    objects = ProfileManager()
+
     def __str__(self):
         return "%s (%s)" % (self.user, self.karma)
 
@@ -79,32 +196,567 @@ class Profile(models.Model):
         """
         Each user has a trust rating, based on potentially all kinds of factors
 
+        For now that's their karma, which is kept current by the karma
+        ledger, scaled by ``TRUST_KARMA_SCALE`` (the karma at which
+        trust is 0.75), so it's available without any queries.
+
         Return: Decimal between 0 (breivik) and 1 (marx)
         """
-        return Decimal('0.5')
+        scale = Decimal(getattr(settings, "TRUST_KARMA_SCALE", 100))
+        karma = Decimal(self.karma)
+        return Decimal('0.5') + karma / (2 * (abs(karma) + scale))
 
     def _normalise_vote(self, amount):
         """
         Normalise an up/downvote based on user history
 
+        The counters are kept current by the ``vote_counts`` receiver.
+        One is added to each so that users who haven't voted both ways
+        yet don't divide by zero, and new users' votes are unchanged.
+
         DISCUSS: should trust/being a mod influence vote amount
         """
+        up, down = self.total_uo_given + 1, self.total_down_given + 1
         if amount > 0:
-            return amount / (self.total_uo_given / self.total_down_given)
-        return amount / (self.total_down_given / self.total_uo_given)
+            return amount / (up / down)
+        return amount / (down / up)
+
+
+# Models that can be rated, and whose users get karma for it.
+OWNED_MODELS = (Ownable, ThreadedComment)
+
+
+def owners(model, pks):
+    """
+    Map primary keys of rated objects to their users' ids.
+    """
+    if model is None or not issubclass(model, OWNED_MODELS):
+        return {}
+    return dict(model.objects.filter(pk__in=pks).values_list("pk", "user_id"))
+
+
+def users_paid(user_ids=None):
+    """
+    Map the ids of users who have upvoted other users' links or
+    comments (only those in ``user_ids`` if given) to the number of
+    other users they've upvoted, with a query per rated model.
+    """
+    ratings = Rating.objects.filter(user__isnull=False, value__gt=0)
+    if user_ids is not None:
+        ratings = ratings.filter(user_id__in=list(user_ids))
+    ratings = ratings.order_by()
+    paid = defaultdict(set)
+    content_type_ids = ratings.values_list("content_type_id", flat=True)
+    for content_type_id in content_type_ids.distinct():
+        model = ContentType.objects.get_for_id(content_type_id)
+        model = model.model_class()
+        if model is None or not issubclass(model, OWNED_MODELS):
+            continue
+        owner = model.objects.filter(pk=OuterRef("object_pk"))
+        owner = Subquery(owner.values("user_id")[:1])
+        pairs = ratings.filter(content_type_id=content_type_id)
+        pairs = pairs.annotate(owner=owner).filter(owner__isnull=False)
+        pairs = pairs.exclude(owner=F("user_id"))
+        for user_id, owner_id in pairs.values_list(
+                "user_id", "owner").distinct().iterator():
+            paid[user_id].add(owner_id)
+    return {user_id: len(owner_ids) for user_id, owner_ids in paid.items()}
+
+
+class KarmaDeltaManager(models.Manager):
+
+    def flush(self, batch_size=1000, max_batches=None):
+        """
+        Apply unflushed deltas to the karma of the users who own the
+        rated objects, in batches, stopping after ``max_batches`` if
+        given. Each batch loads the owners with a query per rated
+        model, and updates all of their profiles with a single
+        ``UPDATE ... CASE`` query. The number of users paid by each of
+        the batch's raters is recounted with ``users_paid`` too, so
+        that votes don't need to look up owners. Returns the number of
+        deltas applied.
+        """
+        profiles = get_profile_model().objects.all()
+        applied = batches = 0
+        while max_batches is None or batches < max_batches:
+            batches += 1
+            with transaction.atomic():
+                deltas = self.select_for_update().filter(flushed=False)
+                deltas = list(deltas.order_by("id").values_list(
+                    "id", "rater_id", "content_type_id", "object_pk",
+                    "value")[:batch_size])
+                if not deltas:
+                    return applied
+                pks = defaultdict(set)
+                for _, _, content_type_id, object_pk, _ in deltas:
+                    pks[content_type_id].add(object_pk)
+                users = {}
+                for content_type_id, object_pks in pks.items():
+                    model = ContentType.objects.get_for_id(content_type_id)
+                    model = model.model_class()
+                    for pk, user_id in owners(model, object_pks).items():
+                        users[content_type_id, pk] = user_id
+                karma = defaultdict(int)
+                for _, rater_id, content_type_id, object_pk, value in deltas:
+                    user_id = users.get((content_type_id, object_pk))
+                    if user_id is not None and user_id != rater_id:
+                        karma[user_id] += value
+                karma = {k: v for k, v in karma.items() if v}
+                update_in_bulk(profiles, "karma", karma, key="user_id",
+                               increment=True)
+                raters = {delta[1] for delta in deltas} - {None}
+                paid = users_paid(raters)
+                paid = {user_id: paid.get(user_id, 0) for user_id in raters}
+                update_in_bulk(profiles, "total_users_paid", paid,
+                               key="user_id")
+                ids = [delta[0] for delta in deltas]
+                self.filter(id__in=ids).update(flushed=True)
+                applied += len(deltas)
+        return applied
+
+    def prune(self, days=None):
+        """
+        Delete deltas that were flushed, and created more than
+        ``days`` ago (the ``KARMA_LEDGER_DAYS`` setting by default),
+        so that the ledger only keeps recent history. Returns the
+        number of deltas deleted.
+        """
+        if days is None:
+            days = getattr(settings, "KARMA_LEDGER_DAYS", 7)
+        cutoff = now() - timedelta(days=days)
+        return self.filter(flushed=True, created__lt=cutoff).delete()[0]
+
+    def rebuild(self, commit=True, batch_size=1000):
+        """
+        Recalculate every profile's karma from ``Rating`` rows, with a
+        ``GROUP BY`` query per rated model, marking the ledger as
+        flushed since it's superseded. Returns a dict of user ids
+        mapped to ``(stored, expected)`` karma for profiles that were
+        wrong, which are only fixed if ``commit`` is ``True``.
+        """
+        with transaction.atomic():
+            pending = self.filter(flushed=False)
+            last_id = pending.order_by("-id").values_list("id", flat=True)
+            last_id = last_id.first()
+            expected = defaultdict(int)
+            content_type_ids = Rating.objects.order_by().values_list(
+                "content_type_id", flat=True).distinct()
+            for content_type_id in content_type_ids:
+                model = ContentType.objects.get_for_id(content_type_id)
+                model = model.model_class()
+                if model is None or not issubclass(model, OWNED_MODELS):
+                    continue
+                owner = model.objects.filter(pk=OuterRef("object_pk"))
+                owner = Subquery(owner.values("user_id")[:1])
+                totals = Rating.objects.filter(content_type_id=content_type_id)
+                totals = totals.annotate(owner=owner)
+                totals = totals.filter(owner__isnull=False)
+                totals = totals.exclude(owner=F("user_id")).order_by()
+                totals = totals.values("owner").annotate(total=Sum("value"))
+                for row in totals:
+                    expected[row["owner"]] += row["total"]
+            profiles = get_profile_model().objects.all()
+            wrong = {}
+            for user_id, karma in profiles.values_list("user_id", "karma"):
+                if karma != expected[user_id]:
+                    wrong[user_id] = (karma, expected[user_id])
+            if commit:
+                if last_id is not None:
+                    pending.filter(id__lte=last_id).update(flushed=True)
+                fixes = [(k, v[1]) for k, v in wrong.items()]
+                for i in range(0, len(fixes), batch_size):
+                    update_in_bulk(profiles, "karma",
+                                   dict(fixes[i:i + batch_size]),
+                                   key="user_id")
+            return wrong
+
+
+class KarmaDelta(models.Model):
+    """
+    Append-only ledger of karma changes, written by the ``karma``
+    receiver for each rating, and applied to profiles in batches.
+    """
+
+    # Not a foreign key, since ratings (and so deltas) are created
+    # while their users are being deleted.
+    rater_id = models.IntegerField(null=True)
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_pk = models.IntegerField()
+    value = models.IntegerField()
+    created = models.DateTimeField(auto_now_add=True)
+    flushed = models.BooleanField(default=False, db_index=True)
+
+    objects = KarmaDeltaManager()
+
+
+class InsufficientBalance(Exception):
+    """
+    Raised by ``BalanceTransaction.objects.transfer`` when a user's
+    balance is below the minimum required.
+    """
+
+    def __init__(self, balance, minimum):
+        super(InsufficientBalance, self).__init__(balance, minimum)
+        self.balance = balance
+        self.minimum = minimum
+
+
+class BalanceTransactionManager(models.Manager):
+
+    def transfer(self, amount, user_id=None, chamber_id=None, reason="",
+                 minimum=None):
+        """
+        Debit ``amount`` from a user's balance and credit it to a
+        chamber's, either of which may be left out, recording each
+        side in the ledger, and updating the stored balances (which
+        act as a snapshot of the ledger) with ``F()`` expressions in
+        the same transaction. The user's profile is locked while this
+        happens, and if ``minimum`` is given, ``InsufficientBalance``
+        is raised unless their balance covers both it and the amount.
+        """
+        rows = []
+        with transaction.atomic():
+            if user_id is not None:
+                profiles = get_profile_model().objects.filter(user_id=user_id)
+                balance = profiles.select_for_update()
+                balance = balance.values_list("balance", flat=True).get()
+                if minimum is not None and balance < max(minimum, amount):
+                    raise InsufficientBalance(balance, minimum)
+                if amount:
+                    profiles.update(balance=F("balance") - amount)
+                    rows.append(self.model(user_id=user_id, amount=-amount,
+                                           reason=reason))
+            if chamber_id is not None and amount:
+                chambers = self.model._meta.get_field("chamber").related_model
+                chambers = chambers.objects.filter(id=chamber_id)
+                chambers.update(balance=F("balance") + amount)
+                rows.append(self.model(chamber_id=chamber_id, amount=amount,
+                                       reason=reason))
+            self.bulk_create(rows)
+
+    def reconcile(self, commit=True, batch_size=1000):
+        """
+        Compare every stored balance with the sum of its ledger, with
+        a ``GROUP BY`` query for users and one for chambers. Returns a
+        dict of ``("user", id)`` or ``("chamber", id)`` keys mapped to
+        ``(stored, expected)`` balances for those that were wrong,
+        which are only fixed if ``commit`` is ``True``.
+        """
+        chambers = self.model._meta.get_field("chamber").related_model
+        accounts = (("user", get_profile_model(), "user_id"),
+                    ("chamber", chambers, "id"))
+        wrong = {}
+        with transaction.atomic():
+            for name, model, key in accounts:
+                totals = self.filter(**{"%s__isnull" % name: False})
+                totals = totals.order_by().values_list(name)
+                totals = dict(totals.annotate(total=Sum("amount")))
+                queryset = model.objects.all()
+                for rows in iterate_in_batches(queryset, [key, "balance"],
+                                               batch_size):
+                    fixes = {}
+                    for _, pk, balance in rows:
+                        expected = totals.get(pk, 0)
+                        if balance != expected:
+                            wrong[name, pk] = (balance, expected)
+                            fixes[pk] = expected
+                    if commit:
+                        update_in_bulk(queryset, "balance", fixes, key=key)
+        return wrong
+
+
+class BalanceTransaction(models.Model):
+    """
+    Ledger of changes to user and chamber balances - each row is for
+    one or the other. Opening balances are recorded when profiles and
+    chambers are created.
+    """
+
+    REASONS = (
+        ("opening", "Opening balance"),
+        ("thread", "Thread created"),
+        ("chamber", "Chamber created"),
+        ("fine", "Automod fine"),
+        ("adjustment", "Adjustment"),
+    )
+
+    user = models.ForeignKey(USER_MODEL, null=True, on_delete=models.CASCADE)
+    chamber = models.ForeignKey("chambers.Chamber", null=True,
+                                on_delete=models.CASCADE)
+    amount = models.DecimalField(decimal_places=2, max_digits=8)
+    reason = models.CharField(max_length=20, choices=REASONS)
+    created = models.DateTimeField(auto_now_add=True)
+
+    objects = BalanceTransactionManager()
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_save, sender="chambers.Chamber")
+def opening_balance(sender, **kwargs):
+    """
+    Record the opening balance of new profiles and chambers.
+    """
+    instance = kwargs["instance"]
+    if not kwargs["created"] or kwargs.get("raw") or not instance.balance:
+        return
+    if sender is Profile:
+        account = {"user_id": instance.user_id}
+    else:
+        account = {"chamber_id": instance.id}
+    BalanceTransaction.objects.create(amount=instance.balance,
+                                      reason="opening", **account)
+
+
+class ModerationTaskManager(models.Manager):
+
+    def claim(self, batch_size=50, timeout=300):
+        """
+        Claim up to ``batch_size`` unfinished tasks for a worker,
+        including those claimed more than ``timeout`` seconds ago by
+        a worker that didn't finish them. Rows locked by other workers
+        are skipped where the database supports it.
+        """
+        skip_locked = connection.features.has_select_for_update_skip_locked
+        stale = now() - timedelta(seconds=timeout)
+        with transaction.atomic():
+            tasks = self.select_for_update(skip_locked=skip_locked)
+            tasks = tasks.filter(Q(claimed=None) | Q(claimed__lt=stale),
+                                 done=False).order_by("id")
+            ids = list(tasks.values_list("id", flat=True)[:batch_size])
+            self.filter(id__in=ids).update(claimed=now(),
+                                           attempts=F("attempts") + 1)
+        tasks = self.filter(id__in=ids)
+        return list(tasks.select_related("link", "link__chamber"))
+
+
+class ModerationTask(models.Model):
+    """
+    A link submitted while ``MODERATION_QUEUE`` is set, which is
+    saved as a draft, and published or rejected by the ``moderate``
+    command once automoderation has run.
+    """
+
+    link = models.OneToOneField(Link, related_name="moderation",
+                                on_delete=models.CASCADE)
+    created = models.DateTimeField(auto_now_add=True)
+    claimed = models.DateTimeField(null=True)
+    attempts = models.IntegerField(default=0)
+    done = models.BooleanField(default=False, db_index=True)
+    reason = models.TextField(blank=True)
+
+    objects = ModerationTaskManager()
+
+
+@python_2_unicode_compatible
+class FeedState(models.Model):
+    """
+    What ``poll_rss`` saw of a feed the last time it changed: the
+    validators to send in conditional requests, a digest of the body
+    for servers that ignore them, and the ids of its entries, so that
+    only new entries are processed.
+    """
+
+    url = models.URLField(max_length=500, unique=True)
+    etag = models.CharField(max_length=500, blank=True)
+    last_modified = models.CharField(max_length=100, blank=True)
+    digest = models.CharField(max_length=32, blank=True)
+    entry_ids = models.TextField(blank=True)
+    polled = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return self.url
+
+    @property
+    def seen(self):
+        return set(self.entry_ids.splitlines())
+
+    def request_headers(self):
+        """
+        Headers for a conditional GET of the feed.
+        """
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class SearchDocumentManager(models.Manager):
+
+    def document_for(self, obj):
+        """
+        Unsaved document for a link, or for a public comment on a
+        link, or ``None`` for anything else.
+        """
+        if isinstance(obj, Link):
+            domain = urlparse(obj.link).netloc if obj.link else ""
+            text = [obj.title, obj.description, domain, obj.keywords_string]
+            return self.model(link_id=obj.id, chamber_id=obj.chamber_id,
+                              text="\n".join(text))
+        link = obj.content_object
+        if isinstance(link, Link) and obj.is_public and not obj.is_removed:
+            return self.model(link_id=link.id, comment_id=obj.id,
+                              chamber_id=link.chamber_id, text=obj.comment)
+        return None
+
+    def index(self, obj):
+        """
+        Add or update the document for a link or comment, or remove
+        it for a comment that's no longer public. Links are saved each
+        time they're voted on, so the index is only written to when
+        the text has changed.
+        """
+        document = self.document_for(obj)
+        if isinstance(obj, Link):
+            existing = self.filter(link_id=obj.id, comment=None)
+        else:
+            existing = self.filter(comment_id=obj.id)
+        current = existing.values_list("chamber_id", "text").first()
+        if document is None:
+            if current is not None:
+                existing.delete()
+        elif current is None:
+            document.save()
+        elif current != (document.chamber_id, document.text):
+            existing.update(chamber_id=document.chamber_id,
+                            text=document.text)
+
+    def index_links(self, links):
+        """
+        Add or update the documents for many links at once, for links
+        saved without signals, via ``bulk_create`` or ``update``.
+        """
+        documents = {obj.id: self.document_for(obj) for obj in links}
+        links = self.filter(comment=None)
+        existing = links.values_list("link_id", flat=True)
+        existing = set(filter_in_batches(existing, "link_id", documents))
+        self.bulk_create([document for pk, document in documents.items()
+                          if pk not in existing])
+        for field in ("chamber_id", "text"):
+            update_in_bulk(links, field, {
+                pk: getattr(document, field)
+                for pk, document in documents.items() if pk in existing
+            }, key="link_id")
+
+    def rebuild(self, batch_size=1000):
+        """
+        Recreate every document, a batch of links or comments at a
+        time. Returns the number of documents.
+        """
+        self.all().delete()
+        fields = ["title", "description", "link", "keywords_string",
+                  "chamber_id"]
+        for rows in iterate_in_batches(Link.objects.all(), fields,
+                                       batch_size):
+            self.index_links([Link(**dict(zip(["id"] + fields, row)))
+                              for row in rows])
+        content_type = ContentType.objects.get_for_model(Link)
+        chamber = Link.objects.filter(id=OuterRef("link_id"))
+        comments = ThreadedComment.objects.filter(content_type=content_type,
+            is_public=True, is_removed=False).annotate(
+            link_id=Cast("object_pk", models.IntegerField()),
+            chamber_id=Subquery(chamber.values("chamber_id")[:1]))
+        fields = ["link_id", "chamber_id", "comment"]
+        for rows in iterate_in_batches(comments, fields, batch_size):
+            self.bulk_create([self.model(comment_id=pk, link_id=link_id,
+                                         chamber_id=chamber_id, text=text)
+                              for pk, link_id, chamber_id, text in rows])
+        return self.count()
+
+    def search(self, query, chamber=None):
+        """
+        Documents matching the query, optionally in the chamber with
+        the given name, ranked by their relevance blended with the hot
+        score of their link or comment. Relevance is normalised against
+        the best of the results and hot scores between the lowest and
+        highest, and the ``SEARCH_HOT_WEIGHT`` setting, between 0 and 1,
+        weights the hot score. Only the
+        ``SEARCH_MAX_RESULTS`` most relevant matches are ranked, and
+        those for unpublished links are left out.
+        """
+        limit = getattr(settings, "SEARCH_MAX_RESULTS", 500)
+        weight = getattr(settings, "SEARCH_HOT_WEIGHT", .3)
+        relevance = dict(match(self.all(), query, chamber, limit))
+        published = Link.objects.published().values("id")
+        documents = self.filter(link__in=published).select_related(
+            "link", "link__user", "link__chamber", "comment",
+            "comment__user", "comment__hot_score")
+        documents = list(filter_in_batches(documents, "id", relevance))
+        for document in documents:
+            document.relevance = relevance[document.id]
+            document.hot = document.link.score
+            if document.comment_id:
+                try:
+                    document.hot = document.comment.hot_score.score
+                except CommentScore.DoesNotExist:
+                    document.hot = None
+        top_relevance = max([d.relevance for d in documents] or [0]) or 1
+        hots = [d.hot for d in documents if d.hot is not None]
+        low_hot = min(hots or [0])
+        hot_range = (max(hots or [0]) - low_hot) or 1
+        for document in documents:
+            hot = 0
+            if document.hot is not None:
+                hot = (document.hot - low_hot) / hot_range
+            document.rank = ((1 - weight) * document.relevance / top_relevance
+                             + weight * hot)
+        return sorted(documents, key=lambda d: d.rank, reverse=True)
+
+
+class SearchDocument(models.Model):
+    """
+    Text of a link, or of a comment on one, in the full-text index
+    that ``drum.links.search`` adds to this table - an FTS5 table on
+    SQLite, or a ``tsvector`` column on Postgres. Kept current as
+    links and comments are saved, and recreated by the
+    ``rebuild_search_index`` command.
+    """
+
+    link = models.ForeignKey(Link, related_name="search_documents",
+                             on_delete=models.CASCADE)
+    comment = models.OneToOneField(ThreadedComment, null=True,
+                                   related_name="search_document",
+                                   on_delete=models.CASCADE)
+    chamber = models.ForeignKey("chambers.Chamber", null=True,
+                                related_name="+", on_delete=models.SET_NULL)
+    text = models.TextField()
+
+    objects = SearchDocumentManager()
+
+
+_last_karma_flush = [0]
+
+
+def schedule_karma_flush():
+    """
+    In-process flushing of the karma ledger, which happens once the
+    current transaction commits, and at most once every
+    ``KARMA_FLUSH_INTERVAL`` seconds per process. Only a single batch
+    is applied, so that a backlog doesn't land on one request, and
+    draining the rest is left to the ``flush_karma`` command, as is
+    all flushing if the setting is ``None``.
+    """
+    interval = getattr(settings, "KARMA_FLUSH_INTERVAL", 60)
+    if interval is None or time() - _last_karma_flush[0] < interval:
+        return
+    _last_karma_flush[0] = time()
+    transaction.on_commit(lambda: KarmaDelta.objects.flush(max_batches=1))
 
 
 @receiver(post_save, sender=Rating)
 @receiver(pre_delete, sender=Rating)
 def karma(sender, **kwargs):
     """
-    Each time a rating is saved, check its value and modify the
-    profile karma for the related object's user accordingly.
+    Each time a rating is saved, check its value and record the
+    change to the karma of the related object's user in the ledger.
     Since ratings are either +1/-1, if a rating is being edited,
     we can assume that the existing rating is in the other direction,
     so we multiply the karma modifier by 2. We also run this when
     a rating is deleted (undone), in which case we just negate the
-    rating value from the karma.
+    rating value from the karma. The related object and its user are
+    only looked up when the ledger is flushed, so that votes don't
+    wait on queries or lock the owner's profile row.
     """
     rating = kwargs["instance"]
     value = int(rating.value)
@@ -112,7 +764,111 @@ def karma(sender, **kwargs):
         value *= -1  #  Rating deleted
     elif not kwargs["created"]:
         value *= 2  #  Rating changed
-    content_object = rating.content_object
-    if rating.user != content_object.user:
-        queryset = get_profile_model().objects.filter(user=content_object.user)
-        queryset.update(karma=models.F("karma") + value)
+    KarmaDelta.objects.create(rater_id=rating.user_id, value=value,
+                              content_type_id=rating.content_type_id,
+                              object_pk=rating.object_pk)
+    schedule_karma_flush()
+
+
+@receiver(post_save, sender=Rating)
+@receiver(pre_delete, sender=Rating)
+def vote_counts(sender, **kwargs):
+    """
+    Keep the rater's counts of up and down votes given current, with
+    the same assumption as ``karma`` that a changed rating was
+    previously in the other direction, without any queries besides
+    the update. The number of users paid depends on who owns the
+    rated objects, so it's recounted when the karma ledger is flushed
+    instead, and ``recount_votes`` corrects any of them.
+    """
+    rating = kwargs["instance"]
+    if rating.user_id is None:
+        return
+    up = 1 if int(rating.value) > 0 else 0
+    down = 1 - up
+    if "created" not in kwargs:
+        up, down = -up, -down  # Rating deleted
+    elif not kwargs["created"]:
+        up, down = up - down, down - up  # Rating changed
+    profiles = get_profile_model().objects.filter(user_id=rating.user_id)
+    profiles.update(total_uo_given=F("total_uo_given") + up,
+                    total_down_given=F("total_down_given") + down)
+
+
+@receiver(post_save, sender=ThreadedComment)
+def comment_score(sender, **kwargs):
+    """
+    Store the comment's score each time it's saved, which happens
+    when it's posted, and again each time one of its ratings is
+    saved or deleted. Links and chambers do the same in their
+    ``save`` methods.
+    """
+    comment = kwargs["instance"]
+    score = score_for(comment, CommentScore.score_fields, "submit_date")
+    scores = CommentScore.objects.filter(comment_id=comment.id)
+    if not scores.update(score=score):
+        CommentScore.objects.create(comment_id=comment.id, score=score)
+
+
+@receiver(post_save, sender=Link)
+@receiver(post_delete, sender=Link)
+@receiver(post_save, sender=ThreadedComment)
+def index_for_search(sender, **kwargs):
+    """
+    Keep the search index current. A deleted link's documents are
+    removed once it's gone, since deleting its ratings saves it (and
+    so indexes it) again after its documents have been deleted.
+    """
+    instance = kwargs["instance"]
+    if "created" not in kwargs:
+        SearchDocument.objects.filter(link_id=instance.id).delete()
+    elif not kwargs.get("raw"):
+        SearchDocument.objects.index(instance)
+
+
+def chamber_for(obj):
+    """
+    Name of the chamber a link, chamber or comment belongs to, or
+    ``None`` if it doesn't belong to one.
+    """
+    if isinstance(obj, ThreadedComment):
+        obj = obj.content_object
+    if isinstance(obj, Link):
+        return obj.chamber.chamber if obj.chamber_id else None
+    return getattr(obj, "chamber", None)
+
+
+@receiver(post_save, sender=Link)
+@receiver(post_delete, sender=Link)
+@receiver(post_save, sender=ThreadedComment)
+@receiver(post_save, sender="chambers.Chamber")
+def invalidate_ranked_lists(sender, **kwargs):
+    """
+    Invalidate the cached ranked lists for the chamber of a link,
+    comment or chamber that has changed.
+    """
+    invalidate_chamber(chamber_for(kwargs["instance"]))
+
+
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+def invalidate_ranked_lists_for_rating(sender, **kwargs):
+    """
+    Invalidate the cached ranked lists for the chamber of the rated
+    object. Only the chamber is loaded rather than the whole object.
+    """
+    rating = kwargs["instance"]
+    model = rating.content_type.model_class()
+    if model is ThreadedComment:
+        comment = model.objects.filter(pk=rating.object_pk)
+        comment = comment.values_list("content_type", "object_pk").first()
+        if comment is None:
+            return
+        model = ContentType.objects.get_for_id(comment[0]).model_class()
+        pk = comment[1]
+    else:
+        pk = rating.object_pk
+    if model is not None and hasattr(model, "chamber"):
+        field = "chamber__chamber" if model is Link else "chamber"
+        chambers = model.objects.filter(pk=pk).values_list(field, flat=True)
+        invalidate_chamber(chambers.first())
@@ -0,0 +1,75 @@
+from __future__ import unicode_literals
+
+from django.db import transaction
+from django.utils.timezone import now
+
+from mezzanine.core.models import CONTENT_STATUS_PUBLISHED
+from mezzanine.utils.automod import score_below_threshold
+
+from drum.chambers.models import ChamberStats
+from drum.chambers.utils import AutomodUnavailable, automod_config
+from drum.chambers.utils import automod_scores
+from drum.links.cache import invalidate_chamber
+from drum.links.models import (BalanceTransaction, Link, ModerationTask,
+                               chamber_for)
+from drum.links.utils import score_for, update_in_bulk
+
+
+def moderate(tasks):
+    """
+    Run automoderation for a batch of claimed ``ModerationTask``
+    instances. Links that pass are auto-tagged and published, and
+    links that fail stay as drafts, with the reason stored on their
+    task, and their users fined (paid to the chamber) if the chamber's
+    automods can fine. Published links are dated and scored as of
+    publishing. Links that some automod couldn't score are left
+    unfinished, and retried once their claim times out. Returns the
+    lists of published and rejected links.
+    """
+    published, rejected, finished = [], [], []
+    for task in tasks:
+        link = task.link
+        chamber = chamber_for(link)
+        config = automod_config(chamber) if chamber else None
+        if config is None:
+            task.reason = "Chamber '%s' doesn't exist" % chamber
+        else:
+            try:
+                scores, automods = automod_scores(None, chamber,
+                                                  link.description)
+            except AutomodUnavailable:
+                continue
+            task.reason = score_below_threshold(scores, automods) or ""
+        finished.append(task)
+        (rejected if task.reason else published).append((task, config))
+    with transaction.atomic():
+        for task, config in published:
+            keyword_ids = task.link.auto_tag_keyword_ids()
+            if keyword_ids:
+                task.link.assign_keywords(keyword_ids)
+        # Published as of now, with the score recalculated for that.
+        at = now()
+        scores = {}
+        for task, config in published:
+            task.link.publish_date = at
+            task.link.status = CONTENT_STATUS_PUBLISHED
+            scores[task.link.id] = score_for(task.link, Link.score_fields,
+                                             "publish_date")
+        update_in_bulk(Link.objects.all(), "score", scores, extra={
+            "status": CONTENT_STATUS_PUBLISHED, "publish_date": at})
+        for task, config in published:
+            ChamberStats.objects.record(task.link.chamber_id, threads=1)
+        for task, config in rejected:
+            if config and config["can_fine"] and config["max_fine"]:
+                BalanceTransaction.objects.transfer(config["max_fine"],
+                    user_id=task.link.user_id, chamber_id=config["id"],
+                    reason="fine")
+            ModerationTask.objects.filter(id=task.id).update(
+                reason=task.reason)
+        ids = [task.id for task in finished]
+        ModerationTask.objects.filter(id__in=ids).update(done=True)
+    chambers = set(chamber_for(task.link) for task, config in published)
+    for chamber in chambers:
+        invalidate_chamber(chamber)
+    return ([task.link for task, config in published],
+            [task.link for task, config in rejected])
@@ -0,0 +1,143 @@
+from __future__ import unicode_literals
+
+from re import findall
+
+from django.db import connections
+
+
+DOCUMENT_TABLE = "links_searchdocument"
+FTS_TABLE = "links_searchdocument_fts"
+
+# Keep the SQLite full-text index in step with the rows of its table.
+SQLITE_TRIGGERS_SQL = [
+    "CREATE TRIGGER {fts}_insert AFTER INSERT ON {table} BEGIN "
+    "INSERT INTO {fts} (rowid, text) VALUES (new.id, new.text); END",
+    "CREATE TRIGGER {fts}_delete AFTER DELETE ON {table} BEGIN "
+    "INSERT INTO {fts} ({fts}, rowid, text) "
+    "VALUES ('delete', old.id, old.text); END",
+    "CREATE TRIGGER {fts}_update AFTER UPDATE ON {table} BEGIN "
+    "INSERT INTO {fts} ({fts}, rowid, text) "
+    "VALUES ('delete', old.id, old.text); "
+    "INSERT INTO {fts} (rowid, text) VALUES (new.id, new.text); END",
+]
+
+SQLITE_DROP_TRIGGERS_SQL = [
+    "DROP TRIGGER IF EXISTS {fts}_insert",
+    "DROP TRIGGER IF EXISTS {fts}_delete",
+    "DROP TRIGGER IF EXISTS {fts}_update",
+]
+
+# Run by the migration creating ``SearchDocument``, to add the full-text
+# index, which triggers keep in step with the rows of its table.
+INDEX_SQL = {
+    "sqlite": [
+        "CREATE VIRTUAL TABLE {fts} USING fts5(text, "
+        "content='{table}', content_rowid='id')",
+    ] + SQLITE_TRIGGERS_SQL,
+    "postgresql": [
+        "ALTER TABLE {table} ADD COLUMN vector tsvector",
+        "CREATE INDEX {table}_vector_idx ON {table} USING gin(vector)",
+        "CREATE TRIGGER {table}_vector BEFORE INSERT OR UPDATE ON {table} "
+        "FOR EACH ROW EXECUTE PROCEDURE "
+        "tsvector_update_trigger(vector, 'pg_catalog.english', text)",
+    ],
+}
+
+DROP_INDEX_SQL = {
+    "sqlite": SQLITE_DROP_TRIGGERS_SQL + [
+        "DROP TABLE IF EXISTS {fts}",
+    ],
+    "postgresql": [
+        "DROP TRIGGER IF EXISTS {table}_vector ON {table}",
+        "ALTER TABLE {table} DROP COLUMN IF EXISTS vector",
+    ],
+}
+
+# Candidate matches, best first, as (document id, relevance) rows.
+MATCH_SQL = {
+    "sqlite": """
+        SELECT d.id, -bm25({fts}) FROM {fts}
+        JOIN {table} d ON d.id = {fts}.rowid
+        {chamber_join}
+        WHERE {fts} MATCH %s {chamber_where}
+        ORDER BY bm25({fts}) LIMIT %s
+    """,
+    "postgresql": """
+        SELECT d.id, ts_rank(d.vector, q) FROM {table} d
+        CROSS JOIN plainto_tsquery('pg_catalog.english', %s) q
+        {chamber_join}
+        WHERE d.vector @@ q {chamber_where}
+        ORDER BY 2 DESC LIMIT %s
+    """,
+}
+
+CHAMBER_JOIN = "JOIN chambers_chamber c ON c.id = d.chamber_id"
+CHAMBER_WHERE = "AND c.chamber = %s"
+
+
+def _execute(schema_editor, statements):
+    for sql in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql.format(fts=FTS_TABLE, table=DOCUMENT_TABLE))
+
+
+def create_index(apps, schema_editor):
+    _execute(schema_editor, INDEX_SQL)
+
+
+def drop_index(apps, schema_editor):
+    _execute(schema_editor, DROP_INDEX_SQL)
+
+
+def create_triggers(apps, schema_editor):
+    """
+    SQLite drops a table's triggers when migrations rebuild it to alter
+    a field, so those altering ``SearchDocument`` fields drop the
+    index's triggers beforehand with ``drop_triggers``, and recreate
+    them afterwards with this. The index itself is left as it is.
+    """
+    _execute(schema_editor, {"sqlite": SQLITE_TRIGGERS_SQL})
+
+
+def drop_triggers(apps, schema_editor):
+    _execute(schema_editor, {"sqlite": SQLITE_DROP_TRIGGERS_SQL})
+
+
+def terms(query):
+    """
+    The words in a search query, without any operators or punctuation,
+    which would otherwise be parsed as FTS5 syntax.
+    """
+    return findall(r"\w+", query.lower())
+
+
+def match(queryset, query, chamber=None, limit=500):
+    """
+    Return ``(id, relevance)`` pairs for up to ``limit`` of the search
+    documents matching every word of the query, best first, optionally
+    only those in the chamber with the given name. Databases without a
+    full-text index scan the documents with ``LIKE``, and treat every
+    match as equally relevant.
+    """
+    words = terms(query)
+    if not words:
+        return []
+    using = queryset.db
+    sql = MATCH_SQL.get(connections[using].vendor)
+    if sql is None:
+        for word in words:
+            queryset = queryset.filter(text__icontains=word)
+        if chamber:
+            queryset = queryset.filter(chamber__chamber=chamber)
+        ids = queryset.order_by("-id").values_list("id", flat=True)
+        return [(pk, 1) for pk in ids[:limit]]
+    if connections[using].vendor == "sqlite":
+        query = " ".join('"%s"' % word for word in words)
+    else:
+        query = " ".join(words)
+    params = [query] + ([chamber] if chamber else []) + [limit]
+    sql = sql.format(fts=FTS_TABLE, table=DOCUMENT_TABLE,
+                     chamber_join=CHAMBER_JOIN if chamber else "",
+                     chamber_where=CHAMBER_WHERE if chamber else "")
+    with connections[using].cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
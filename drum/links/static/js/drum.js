@@ -1,11 +1,3 @@
-
-var contents = function(html, tag) {
-    if (html.indexOf('<' + tag + '>') >= 0) {
-        return html.split('<' + tag + '>')[1].split('</' + tag + '>')[0];
-    }
-    return '';
-};
-
 var setRatingClick = function() {
     // Drum hides the radio buttons for +1 -1 ratings, and uses
     // up/down arrow anchors. Attach click handlers to the arrow
@@ -13,7 +5,8 @@ var setRatingClick = function() {
     // button, and submits the form via AJAX. If the user is not
     // authenticated, the JSON response will include a ``location``
     // value to redirect to, otherwise it will contain the new
-    // rating score, which we update the page with.
+    // rating score and the user's vote, which we update the rated
+    // item with, leaving the rest of the page alone.
     $('.arrows a').click(function() {
 
         var arrow = $(this);
@@ -27,14 +20,13 @@ var setRatingClick = function() {
             if (data.location) {
                 location = data.location;
             } else {
-                //container.find('.score').text(data.rating_sum);
-                $('.main').fadeTo(0, .5);
-                $.get(location.href, {pjax: 1}, function(html) {
-                    $('.main').fadeTo(0, 1);
-                    var body = contents(html, 'body');
-                    document.getElementsByTagName('body')[0].innerHTML = body;
-                    setRatingClick();
-                });
+                container.find('.score').text(data.rating_sum);
+                container.find('.icon-arrow-up').parent()
+                    .toggleClass('voted', data.rating_user > 0);
+                container.find('.icon-arrow-down').parent()
+                    .toggleClass('voted', data.rating_user < 0);
+                container.closest('.link-item').find('.link-detail')
+                    .toggleClass('link-negative', data.rating_sum < 0);
             }
         }, 'json');
 
@@ -0,0 +1,56 @@
+from __future__ import unicode_literals
+
+from io import StringIO
+
+from django.utils.feedgenerator import Atom1Feed, Rss201rev2Feed
+from django.utils.xmlutils import SimplerXMLGenerator
+
+
+FEED_TYPES = {"rss": Rss201rev2Feed, "atom": Atom1Feed}
+
+
+def feed_item(feed, **kwargs):
+    """
+    Item dict for the feed, from the same arguments as ``add_item``,
+    without keeping it in the feed's list of items.
+    """
+    feed.add_item(**kwargs)
+    return feed.items.pop()
+
+
+def stream_feed(feed, items, latest):
+    """
+    Yield a feed's XML in chunks - the channel, then each item as it's
+    produced by the ``items`` iterable, then the closing elements - so
+    that the whole document is never held in memory. ``latest`` is
+    used as the feed's updated date, since the items aren't known up
+    front.
+    """
+    out = StringIO()
+    handler = SimplerXMLGenerator(out, "utf-8")
+
+    def flush():
+        chunk = out.getvalue()
+        out.seek(0)
+        out.truncate()
+        return chunk
+
+    feed.latest_post_date = lambda: latest
+    handler.startDocument()
+    if isinstance(feed, Atom1Feed):
+        handler.startElement("feed", feed.root_attributes())
+        closing, element = ["feed"], "entry"
+    else:
+        handler.startElement("rss", feed.rss_attributes())
+        handler.startElement("channel", feed.root_attributes())
+        closing, element = ["channel", "rss"], "item"
+    feed.add_root_elements(handler)
+    yield flush()
+    for item in items:
+        handler.startElement(element, feed.item_attributes(item))
+        feed.add_item_elements(handler, item)
+        handler.endElement(element)
+        yield flush()
+    for name in closing:
+        handler.endElement(name)
+    yield flush()
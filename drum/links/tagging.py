@@ -0,0 +1,40 @@
+from __future__ import unicode_literals
+
+import django
+from django.apps import apps
+
+
+# Fields of the links sent to ``tag_links``, as plain tuples rather
+# than pickled model instances.
+TAG_FIELDS = ("id", "title", "description", "link", "chamber_id")
+
+_tagger = {}
+
+
+def init_tagger(func_name, keywords):
+    """
+    Set up ``tag_links`` with the ``AUTO_TAG_FUNCTION`` and the
+    ``(id, title)`` pairs of the keywords to match, once per worker
+    process. Nothing here imports models until Django is set up, so
+    that it works in workers that are spawned rather than forked.
+    """
+    if not apps.ready:
+        django.setup()
+    from mezzanine.utils.importing import import_dotted_path
+    from drum.links.keywords import KeywordIndex
+    _tagger.update(func=import_dotted_path(func_name),
+                   index=KeywordIndex(keywords),
+                   model=apps.get_model("links", "Link"))
+
+
+def tag_links(rows):
+    """
+    Return ``(link id, keyword ids)`` pairs for rows of the link
+    fields in ``TAG_FIELDS``. Run in worker processes by the
+    ``auto_tag`` command, so it doesn't touch the database, and the
+    ``AUTO_TAG_FUNCTION`` is given unsaved links with only those
+    fields.
+    """
+    func, index = _tagger["func"], _tagger["index"]
+    links = [_tagger["model"](**dict(zip(TAG_FIELDS, row))) for row in rows]
+    return [(link.id, index.match(func(link), link.title)) for link in links]
@@ -1,10 +1,22 @@
 from __future__ import unicode_literals
 
-from collections import defaultdict
+from time import time
+
 from django import template
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db.models import prefetch_related_objects
 from django.template.defaultfilters import timesince
+from django.template.loader import get_template
+from django.urls import reverse
+from django.utils.safestring import mark_safe
+from mezzanine.generic.forms import RatingForm
+from mezzanine.generic.models import Rating
 
-from drum.links.utils import order_by_score
+from drum.links.cache import fragment_cache_timeout, link_fragment_key
+from drum.links.keywords import keywords_version
+from drum.links.utils import comment_tree
 from drum.links.views import CommentList, USER_PROFILE_RELATED_NAME
 
 
@@ -23,19 +35,122 @@ def get_profile(user):
 def order_comments_by_score_for(context, link):
     """
     Preloads threaded comments in the same way Mezzanine initially does,
-    but here we order them by score.
+    but here we order them by score, in a single query that leaves out
+    columns the templates don't use. Long threads can be truncated with
+    the ``COMMENTS_MAX_DEPTH`` and ``COMMENTS_MAX_CHILDREN`` settings,
+    in which case a comment's hidden replies are shown by passing its
+    id (or "top" for top level comments) in the ``replies`` querystring
+    param.
     """
-    comments = defaultdict(list)
     qs = link.comments.visible().select_related(
         "user",
         "user__%s" % (USER_PROFILE_RELATED_NAME)
-    )
-    for comment in order_by_score(qs, CommentList.score_fields, "submit_date"):
-        comments[comment.replied_to_id].append(comment)
+    ).defer("user_name", "user_email", "user_url", "ip_address")
+    expand = set()
+    request = context.get("request")
+    for parent_id in request.GET.getlist("replies") if request else []:
+        if parent_id == "top":
+            expand.add(None)
+        elif parent_id.isdigit():
+            expand.add(int(parent_id))
+    comments, more = comment_tree(
+        qs, CommentList.score_fields, CommentList.date_field,
+        max_depth=getattr(settings, "COMMENTS_MAX_DEPTH", None),
+        max_children=getattr(settings, "COMMENTS_MAX_CHILDREN", None),
+        expand=expand)
     context["all_comments"] = comments
+    context["more_comments"] = more
     return ""
 
 
+@register.simple_tag(takes_context=True)
+def more_replies_for(context, comment=None):
+    """
+    Number of replies to the given comment (or top level comments if
+    no comment is given) left out by ``order_comments_by_score_for``.
+    """
+    more = context.get("more_comments") or {}
+    return more.get(getattr(comment, "id", None), 0)
+
+
 @register.filter
 def short_timesince(date):
     return timesince(date).split(",")[0]
+
+
+def link_ratings(context, links):
+    """
+    Renders the rating form for each of a page of links with
+    ``links/includes/link_rating.html``, overlaid on the cached rows by
+    ``link_item_rows``. The form's fields are filled in directly rather
+    than rendering a ``RatingForm`` per link, with a single query for
+    the current user's votes, so the rows can be shared between users.
+    """
+    if not links:
+        return []
+    request = context.get("request")
+    user = getattr(request, "user", None)
+    content_type = ContentType.objects.get_for_model(links[0])
+    votes = {}
+    if user is not None and user.is_authenticated:
+        votes = dict(Rating.objects.filter(user=user,
+            content_type=content_type,
+            object_pk__in=[link.pk for link in links],
+        ).values_list("object_pk", "value"))
+    form = RatingForm(None, links[0])
+    values = [value for value, label in form.fields["value"].choices]
+    timestamp = str(int(time()))
+    content_type = str(links[0]._meta)
+    template = get_template("links/includes/link_rating.html")
+    action = reverse("vote")
+    ratings = []
+    for link in links:
+        security_hash = form.generate_security_hash(
+            content_type, str(link.pk), timestamp)
+        ratings.append(template.render({
+            "link": link, "action": action, "values": values,
+            "vote": votes.get(link.pk, 0), "content_type": content_type,
+            "timestamp": timestamp, "security_hash": security_hash}))
+    return ratings
+
+
+@register.simple_tag(takes_context=True)
+def link_item_rows(context, links):
+    """
+    Returns ``(link, rating, row)`` tuples for a page of links, where
+    ``row`` is the link's ``links/includes/link_item.html`` fragment.
+    The rows are rendered without the request, so they're the same for
+    every user and are cached for ``LINK_FRAGMENT_CACHE_TIMEOUT``
+    seconds, fetched with a single ``get_many`` per page. Keywords are
+    only loaded for the links missing from the cache. The per-user
+    ``rating`` is rendered separately by ``link_ratings``, and is
+    ``None`` on profile pages, which don't show ratings.
+    """
+    links = list(links)
+    request = context.get("request")
+    host = request.build_absolute_uri("/") if request else ""
+    version = keywords_version()
+    since = [short_timesince(link.publish_date) for link in links]
+    keys = [link_fragment_key(link, version, host, ago)
+            for link, ago in zip(links, since)]
+    timeout = fragment_cache_timeout()
+    rows = cache.get_many(keys) if timeout else {}
+    missing = [i for i, key in enumerate(keys) if key not in rows]
+    if missing:
+        prefetch_related_objects([links[i] for i in missing],
+                                 "keywords__keyword")
+        template = get_template("links/includes/link_item.html")
+        rendered = {}
+        for i in missing:
+            rendered[keys[i]] = template.render(
+                {"link": links[i], "timesince": since[i]})
+        if timeout:
+            cache.set_many(rendered, timeout)
+        rows.update(rendered)
+    if context.get("profile_user"):
+        ratings = [None] * len(links)
+    else:
+        ratings = [mark_safe(rating)
+                   for rating in link_ratings(context, links)]
+    return [(link, rating, mark_safe(rows[key]))
+            for link, rating, key in zip(links, ratings, keys)]
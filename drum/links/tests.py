@@ -1,7 +1,55 @@
+from base64 import urlsafe_b64encode
+from contextlib import redirect_stdout
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import StringIO
+from json import dumps, loads
+import os
+from tempfile import mkdtemp
+from threading import Thread
+from time import sleep
+from types import SimpleNamespace
+from xml.etree import ElementTree
+from unittest import skipIf
+
+from django.conf.urls import include, url
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.test import RequestFactory, override_settings
+from django.utils.timezone import now
+from mezzanine.accounts.views import profile
+from mezzanine.core.models import CONTENT_STATUS_DRAFT
+from mezzanine.core.models import CONTENT_STATUS_PUBLISHED
+from mezzanine.generic.forms import RatingForm
+from mezzanine.generic.models import Keyword, Rating, ThreadedComment
+from mezzanine.utils.sites import current_site_id
 from mezzanine.utils.tests import TestCase
+
+from drum.links.cache import get_ranked, invalidate_chamber, ranked_cache_key
+from drum.links.cache import _generation_key, ranked_cache_stats, set_ranked
+from drum.links.feeds import ingest_links
 from drum.links.forms import LinkForm
-from django.contrib.auth.models import User
-from drum.links.models import Link, Profile
+from drum.links.keywords import keyword_index
+from drum.chambers.models import Chamber
+from drum.links.models import BalanceTransaction, InsufficientBalance
+from drum.links.models import KarmaDelta, Link, ModerationTask, Profile
+from drum.links.models import SearchDocument, vote_counts
+from drum.links.templatetags.drum_tags import link_item_rows
+from drum.links.utils import calculate_score, order_by_score, top_scores
+from drum.links.utils import comment_tree, cursor_paginate, numpy, score_for
+from drum.links.utils import TopCounter, unique_slugs, update_in_bulk
+from drum.links.views import LinkFeed, SearchList
+
+
+urlpatterns = [
+    url("^users/(?P<username>.*)/$", profile, name="profile"),
+    url("^", include("drum.chambers.urls")),
+    url("^", include("drum.links.urls")),
+]
 
 
 class LinkFormsTests(TestCase):
@@ -38,6 +86,15 @@ class LinkFormsTests(TestCase):
         })
         self.assertTrue(form.is_valid())
 
+    def test_chamber_entered_by_name(self):
+        chamber = Chamber.objects.create(chamber="test", title="Test",
+                                         user=self._user)
+        data = {"title": "Test title", "link": "http://test.com/"}
+        form = LinkForm(dict(data, chamber="test"))
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data["chamber"], chamber)
+        self.assertFalse(LinkForm(dict(data, chamber="missing")).is_valid())
+
 
 class LinkModelsTests(TestCase):
 
@@ -75,3 +132,888 @@ class ProfileModelsTests(TestCase):
     def test_has_bio_field(self):
         p = Profile.objects.get(user__username="test")
         self.assertEqual(777, self.profile.karma)
+
+
+class ScoreTests(TestCase):
+
+    def test_score_decays_with_age(self):
+        at = now()
+        new = calculate_score(10, at - timedelta(hours=1), at)
+        old = calculate_score(10, at - timedelta(days=1), at)
+        self.assertGreater(new, old)
+
+    def test_score_stored_on_save(self):
+        link = Link.objects.create(title="Test", user=self._user)
+        score = link.score
+        link.rating_sum = 5
+        link.save()
+        self.assertGreater(Link.objects.get(id=link.id).score, score)
+
+    def test_stored_scores_comparable(self):
+        at = now()
+        new = Link.objects.create(title="New", user=self._user,
+                                  publish_date=at - timedelta(seconds=1))
+        new.rating_sum = 10
+        new.save()
+        old = Link.objects.create(title="Old", user=self._user,
+                                  publish_date=at - timedelta(minutes=30))
+        old.rating_sum = 100
+        old.save()
+        ordered = Link.objects.order_by("-score")
+        self.assertEqual([l.title for l in ordered], ["Old", "New"])
+        with override_settings(SCORE_DECAY_SECONDS=60):
+            call_command("rescore", stdout=StringIO())
+        self.assertEqual([l.title for l in ordered.all()], ["New", "Old"])
+
+    def test_rescore_decays_stored_scores(self):
+        link = Link.objects.create(title="Test", user=self._user)
+        link.rating_sum = 5
+        link.save()
+        score = Link.objects.get(id=link.id).score
+        Link.objects.filter(id=link.id).update(
+            publish_date=now() - timedelta(days=1))
+        call_command("rescore", stdout=StringIO())
+        self.assertLess(Link.objects.get(id=link.id).score, score)
+
+    def test_order_by_score_slices(self):
+        for rating_sum in (1, 3, 2):
+            link = Link.objects.create(title="Test", user=self._user)
+            Link.objects.filter(id=link.id).update(rating_sum=rating_sum)
+        ordered = order_by_score(Link.objects.all(), Link.score_fields,
+                                 "publish_date")
+        self.assertEqual(len(ordered), 3)
+        self.assertEqual([l.rating_sum for l in ordered[:2]], [3, 2])
+        self.assertEqual([l.rating_sum for l in ordered[2:]], [1])
+
+    @skipIf(numpy is None, "NumPy not installed")
+    def test_numpy_backend_matches_python(self):
+        at = now()
+        rows = [(pk, pk % 7, at - timedelta(minutes=pk)) for pk in range(50)]
+        expected = top_scores(rows, 10, at=at)
+        with override_settings(SCORE_BACKEND="numpy"):
+            result = top_scores(rows, 10, at=at)
+        self.assertEqual([pk for _, pk in result], [pk for _, pk in expected])
+
+
+class CursorPaginationTests(TestCase):
+
+    def setUp(self):
+        super(CursorPaginationTests, self).setUp()
+        for i in range(5):
+            Link.objects.create(title="Test %s" % i, user=self._user,
+                                publish_date=now() - timedelta(hours=i))
+        self.ordering = ["-publish_date", "-id"]
+
+    def test_pages_forwards_and_backwards(self):
+        links = Link.objects.all()
+        expected = list(links.order_by(*self.ordering))
+        pages = [cursor_paginate(links, self.ordering, None, 2)]
+        self.assertFalse(pages[0].has_previous())
+        while pages[-1].has_next():
+            cursor = pages[-1].next_cursor
+            with self.assertNumQueries(1):
+                pages.append(cursor_paginate(links, self.ordering, cursor, 2))
+        self.assertEqual([l for page in pages for l in page], expected)
+        cursor = pages[-1].previous_cursor
+        previous = cursor_paginate(links, self.ordering, cursor, 2)
+        self.assertEqual(list(previous), list(pages[-2]))
+
+    def test_invalid_cursor_is_first_page(self):
+        links = Link.objects.all()
+        first = list(cursor_paginate(links, self.ordering, None, 2))
+        tampered = [[{"x": 1}, 1], [{"dt": 5}, 1], [[1], 2], ["abc", "zz"]]
+        cursors = ["nonsense"] + [
+            urlsafe_b64encode(dumps(["next", values]).encode("utf-8"))
+            .decode("ascii") for values in tampered]
+        for cursor in cursors:
+            page = cursor_paginate(links, self.ordering, cursor, 2)
+            self.assertEqual(list(page), first)
+            self.assertFalse(page.has_previous())
+
+    def test_nulls(self):
+        Link.objects.filter(title__in=["Test 1", "Test 3"]).update(
+            expiry_date=now())
+        links = Link.objects.all()
+        ordering = ["-expiry_date", "-id"]
+        expected = list(links.order_by(*ordering))
+        self.assertIsNone(expected[-1].expiry_date)
+        pages = [cursor_paginate(links, ordering, None, 1)]
+        while pages[-1].has_next() and len(pages) <= len(expected):
+            cursor = pages[-1].next_cursor
+            pages.append(cursor_paginate(links, ordering, cursor, 1))
+        self.assertEqual([l for page in pages for l in page], expected)
+        cursor = pages[-1].previous_cursor
+        previous = cursor_paginate(links, ordering, cursor, 1)
+        self.assertEqual(list(previous), list(pages[-2]))
+        ascending = ["expiry_date", "id"]
+        page = cursor_paginate(links, ascending, None, 2)
+        page = cursor_paginate(links, ascending, page.next_cursor, 2)
+        self.assertEqual(list(page), list(links.order_by(
+            F("expiry_date").asc(nulls_first=True), "id"))[2:4])
+
+
+@override_settings(ROOT_URLCONF="drum.links.urls", SITE_TITLE="Drum")
+class LinkFeedTests(TestCase):
+
+    def setUp(self):
+        super(LinkFeedTests, self).setUp()
+        self.chamber = Chamber.objects.create(chamber="python",
+                                              title="Python", user=self._user)
+        for i in range(2):
+            Link.objects.create(title="Link %s" % i, chamber=self.chamber,
+                                user=self._user,
+                                publish_date=now() - timedelta(hours=i))
+
+    def get(self, format="rss", **headers):
+        path = "/c/python/feed/%s/" % format
+        request = RequestFactory().get(path, **headers)
+        return LinkFeed.as_view()(request, chamber="python", format=format)
+
+    def test_streamed(self):
+        response = self.get()
+        self.assertTrue(response.streaming)
+        rss = ElementTree.fromstring(b"".join(response.streaming_content))
+        self.assertEqual([e.text for e in rss.findall("channel/item/title")],
+                         ["Link 0", "Link 1"])
+        atom = b"".join(self.get("atom").streaming_content)
+        entries = ElementTree.fromstring(atom).findall(
+            "{http://www.w3.org/2005/Atom}entry")
+        self.assertEqual(len(entries), 2)
+
+    def test_not_modified(self):
+        etag = self.get()["ETag"]
+        with self.assertNumQueries(0):
+            response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        Link.objects.create(title="Newer", chamber=self.chamber,
+                            user=self._user)
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+
+class RankedCacheTests(TestCase):
+
+    def test_hits_and_misses(self):
+        ranked_cache_stats(reset=True)
+        key = ranked_cache_key("links", "test", page=1)
+        self.assertIsNone(get_ranked(key))
+        set_ranked(key, {"ids": [1, 2]})
+        self.assertEqual(get_ranked(key), {"ids": [1, 2]})
+        self.assertEqual(ranked_cache_stats(), {"hits": 1, "misses": 1})
+
+    def test_invalidated_by_chamber(self):
+        key = ranked_cache_key("links", "test", page=1)
+        other = ranked_cache_key("links", "other", page=1)
+        invalidate_chamber("other")
+        self.assertEqual(key, ranked_cache_key("links", "test", page=1))
+        self.assertNotEqual(other, ranked_cache_key("links", "other", page=1))
+
+    def test_generation_not_reused_after_eviction(self):
+        keys = [ranked_cache_key("links", "test", page=1)]
+        invalidate_chamber("test")
+        keys.append(ranked_cache_key("links", "test", page=1))
+        sleep(.01)
+        cache.delete(_generation_key("test"))
+        invalidate_chamber("test")
+        self.assertNotIn(ranked_cache_key("links", "test", page=1), keys)
+
+    def test_invalidated_by_link_save(self):
+        key = ranked_cache_key("links", "test", page=1)
+        everything = ranked_cache_key("links", "", page=1)
+        chamber = Chamber.objects.create(chamber="test", title="Test",
+                                         user=self._user)
+        Link.objects.create(title="Test", user=self._user, chamber=chamber)
+        self.assertNotEqual(key, ranked_cache_key("links", "test", page=1))
+        self.assertNotEqual(everything, ranked_cache_key("links", "", page=1))
+
+
+class CommentTreeTests(TestCase):
+
+    def setUp(self):
+        super(CommentTreeTests, self).setUp()
+        date = now() - timedelta(hours=1)
+        self.comments = [SimpleNamespace(id=i, replied_to_id=parent,
+                                         rating_sum=rating, submit_date=date)
+                         for i, parent, rating in [(1, None, 1), (2, None, 5),
+                                                   (3, 1, 1), (4, 1, 3),
+                                                   (5, 1, 2), (6, 3, 1)]]
+
+    def tree(self, **kwargs):
+        return comment_tree(self.comments, ["rating_sum"], "submit_date",
+                            **kwargs)
+
+    def ids(self, comments):
+        return [comment.id for comment in comments]
+
+    def test_siblings_ordered_by_score(self):
+        tree, more = self.tree()
+        self.assertEqual(self.ids(tree[None]), [2, 1])
+        self.assertEqual(self.ids(tree[1]), [4, 5, 3])
+        self.assertEqual(more, {})
+
+    def test_truncated_by_depth_and_children(self):
+        tree, more = self.tree(max_depth=2, max_children=2)
+        self.assertEqual(self.ids(tree[1]), [4, 5])
+        self.assertNotIn(3, tree)
+        self.assertEqual(more, {1: 1})
+        tree, more = self.tree(max_depth=1)
+        self.assertNotIn(1, tree)
+        self.assertEqual(more, {1: 3})
+
+    def test_expanded(self):
+        tree, more = self.tree(max_children=1, expand={1})
+        self.assertEqual(self.ids(tree[None]), [2])
+        self.assertNotIn(1, tree)
+        tree, more = self.tree(max_children=1, expand={None, 1})
+        self.assertEqual(self.ids(tree[1]), [4, 5, 3])
+
+
+@override_settings(ROOT_URLCONF=__name__, RATINGS_RANGE=[-1, 1],
+                   RATINGS_ACCOUNT_REQUIRED=False)
+class RatingViewTests(TestCase):
+
+    def setUp(self):
+        super(RatingViewTests, self).setUp()
+        self.link = Link.objects.create(title="Test", user=self._user)
+        self.client.login(username=self._username, password=self._password)
+
+    def vote(self, value, **headers):
+        data = RatingForm(None, self.link).initial
+        data["value"] = value
+        return self.client.post("/vote/", data, **headers)
+
+    def test_ajax_vote(self):
+        response = self.vote(1, HTTP_X_REQUESTED_WITH="XMLHttpRequest")
+        data = loads(response.content.decode("utf-8"))
+        self.assertEqual(data["rating_user"], 1)
+        self.assertEqual(data["rating_sum"], 1)
+        self.assertEqual(data["object_pk"], str(self.link.id))
+        self.assertIn("mezzanine-rating", response.cookies)
+
+    def test_ajax_missing(self):
+        self.link.delete()
+        response = self.vote(1, HTTP_X_REQUESTED_WITH="XMLHttpRequest")
+        data = loads(response.content.decode("utf-8"))
+        self.assertEqual(data, {"location": "/"})
+
+    def test_redirect(self):
+        response = self.vote(1)
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(self.link.get_absolute_url(), response["Location"])
+        self.assertEqual(Link.objects.get(id=self.link.id).rating_sum, 1)
+
+
+@override_settings(KARMA_FLUSH_INTERVAL=None, RATINGS_RANGE=[-1, 1])
+class KarmaTests(TestCase):
+
+    def setUp(self):
+        super(KarmaTests, self).setUp()
+        self.author = User.objects.create(username="author")
+        self.link = Link.objects.create(title="Test", user=self.author)
+
+    def karma(self):
+        return Profile.objects.get(user=self.author).karma
+
+    def test_votes_applied_when_flushed(self):
+        voter = User.objects.create(username="voter")
+        self.link.rating.add(Rating(value=1, user=voter), bulk=False)
+        self.link.rating.add(Rating(value=1, user=self._user), bulk=False)
+        self.link.rating.add(Rating(value=1, user=self.author), bulk=False)
+        self.assertEqual(self.karma(), 0)
+        self.assertEqual(KarmaDelta.objects.flush(batch_size=1,
+                                                  max_batches=2), 2)
+        self.assertEqual(KarmaDelta.objects.flush(batch_size=2), 1)
+        self.assertEqual(self.karma(), 2)
+        self.assertEqual(KarmaDelta.objects.flush(), 0)
+
+    def test_flushed_deltas_pruned(self):
+        self.link.rating.add(Rating(value=1, user=self._user), bulk=False)
+        KarmaDelta.objects.flush()
+        self.link.rating.add(Rating(value=1, user=self.author), bulk=False)
+        self.assertEqual(KarmaDelta.objects.prune(), 0)
+        with redirect_stdout(StringIO()):
+            call_command("flush_karma", keep_days=-1)
+        self.assertEqual(KarmaDelta.objects.count(), 0)
+        self.assertEqual(self.karma(), 1)
+
+    def test_rebuild_from_ratings(self):
+        self.link.rating.add(Rating(value=-1, user=self._user), bulk=False)
+        Profile.objects.filter(user=self.author).update(karma=10)
+        wrong = KarmaDelta.objects.rebuild()
+        self.assertEqual(wrong, {self.author.id: (10, -1)})
+        self.assertEqual(self.karma(), -1)
+        self.assertEqual(KarmaDelta.objects.flush(), 0)
+        self.assertEqual(KarmaDelta.objects.rebuild(), {})
+
+    def test_vote_counts(self):
+        voter = User.objects.create(username="voter")
+        self.link.rating.add(Rating(value=1, user=voter), bulk=False)
+        rating = Rating.objects.get(user=voter)
+        rating.value = -1
+        rating.save()
+        other = Link.objects.create(title="Other", user=self.author)
+        other.rating.add(Rating(value=1, user=voter), bulk=False)
+        KarmaDelta.objects.flush()
+        profile = Profile.objects.get(user=voter)
+        self.assertEqual((profile.total_uo_given, profile.total_down_given,
+                          profile.total_users_paid), (1, 1, 1))
+        self.assertEqual(Profile.objects.recount_votes(), {})
+        Profile.objects.filter(user=voter).update(total_users_paid=5)
+        wrong = Profile.objects.recount_votes()
+        self.assertEqual(wrong, {voter.id: ((1, 1, 5), (1, 1, 1))})
+        rating.delete()
+        KarmaDelta.objects.flush()
+        profile = Profile.objects.get(user=voter)
+        self.assertEqual((profile.total_uo_given, profile.total_down_given,
+                          profile.total_users_paid), (1, 0, 1))
+        self.assertEqual(profile._normalise_vote(1), 0.5)
+        other.rating.all().delete()
+        KarmaDelta.objects.flush()
+        self.assertEqual(Profile.objects.get(user=voter).total_users_paid, 0)
+
+    def test_vote_counts_single_query(self):
+        voter = User.objects.create(username="voter")
+        rating = Rating(value=1, user=voter, content_object=self.link)
+        with self.assertNumQueries(1):
+            vote_counts(Rating, instance=rating, created=True)
+        self.assertEqual(Profile.objects.get(user=voter).total_uo_given, 1)
+
+    def test_users_paid_once_per_owner(self):
+        voter = User.objects.create(username="voter")
+        other = Link.objects.create(title="Other", user=self.author)
+        for link in (self.link, other):
+            link.rating.add(Rating(value=1, user=voter), bulk=False)
+        KarmaDelta.objects.flush()
+        self.assertEqual(Profile.objects.get(user=voter).total_users_paid, 1)
+        rating = Rating.objects.get(user=voter, object_pk=self.link.id)
+        rating.value = -1
+        rating.save()
+        KarmaDelta.objects.flush()
+        self.assertEqual(Profile.objects.get(user=voter).total_users_paid, 1)
+        self.assertEqual(Profile.objects.recount_votes(), {})
+
+    def test_trust(self):
+        profile = Profile.objects.get(user=self.author)
+        self.assertEqual(profile._normalise_vote(-1), -1)
+        self.assertEqual(profile._get_trust(), Decimal("0.5"))
+        profile.karma = 100
+        self.assertEqual(profile._get_trust(), Decimal("0.75"))
+
+
+@override_settings(AUTO_TAG=True)
+class KeywordIndexTests(TestCase):
+
+    def test_match_without_queries(self):
+        python = Keyword.objects.create(title="Python")
+        learning = Keyword.objects.create(title="Machine learning")
+        index = keyword_index()
+        with self.assertNumQueries(0):
+            ids = index.match(["python", "machine"],
+                              "Python, for machine learning.")
+        self.assertEqual(ids, [python.id, learning.id])
+
+    def test_refreshed_when_keywords_change(self):
+        self.assertEqual(keyword_index().match(["django"]), [])
+        django = Keyword.objects.create(title="Django")
+        self.assertEqual(keyword_index().match(["django"]), [django.id])
+        django.delete()
+        self.assertEqual(keyword_index().match(["django"]), [])
+
+    def test_assigned_on_save(self):
+        Keyword.objects.create(title="Python")
+        Keyword.objects.create(title="Machine learning")
+        link = Link.objects.create(title="Machine learning in Python",
+                                   link="http://example.com/",
+                                   user=self._user)
+        self.assertEqual(link.keywords_string, "Python Machine learning")
+        link = Link.objects.get(id=link.id)
+        self.assertEqual(link.keywords_string, "Python Machine learning")
+        self.assertEqual([str(a) for a in link.keywords.all()],
+                         ["Python", "Machine learning"])
+
+    def test_assign_command(self):
+        chambers = [Chamber.objects.create(chamber=name, title=name,
+                                           user=self._user)
+                    for name in ("other", "python")]
+        links = [Link.objects.create(title="Python %s" % i, user=self._user,
+                                     chamber=chambers[i % 2])
+                 for i in range(6)]
+        python = Keyword.objects.create(title="Python")
+        for processes in (1, 2):
+            with redirect_stdout(StringIO()):
+                call_command("auto_tag", assign=True, chamber="python",
+                             from_id=links[2].id, batch_size=1,
+                             processes=processes)
+            tagged = Link.objects.filter(keywords__keyword=python)
+            tagged = tagged.order_by("id").values_list("id", flat=True)
+            self.assertEqual(list(tagged), [links[3].id, links[5].id])
+            self.assertEqual(Link.objects.get(id=links[3].id).keywords_string,
+                             "Python")
+
+
+class BalanceTests(TestCase):
+
+    def setUp(self):
+        super(BalanceTests, self).setUp()
+        self.user = User.objects.create(username="spender")
+        self.chamber = Chamber.objects.create(chamber="test", title="Test",
+                                              user=self._user)
+
+    def balances(self):
+        profile = Profile.objects.get(user=self.user)
+        return profile.balance, Chamber.objects.get(id=self.chamber.id).balance
+
+    def test_transfer(self):
+        self.assertEqual(self.balances(), (Decimal("5"), 0))
+        BalanceTransaction.objects.transfer(Decimal("2"), self.user.id,
+                                            self.chamber.id, "thread",
+                                            minimum=Decimal("4"))
+        self.assertEqual(self.balances(), (Decimal("3"), Decimal("2")))
+        with self.assertRaises(InsufficientBalance) as raised:
+            BalanceTransaction.objects.transfer(Decimal("1"), self.user.id,
+                                                minimum=Decimal("4"))
+        self.assertEqual(raised.exception.balance, Decimal("3"))
+        self.assertEqual(self.balances(), (Decimal("3"), Decimal("2")))
+        self.assertEqual(BalanceTransaction.objects.reconcile(), {})
+
+    def test_reconcile(self):
+        Profile.objects.filter(user=self.user).update(balance=100)
+        wrong = BalanceTransaction.objects.reconcile(commit=False)
+        self.assertEqual(wrong, {("user", self.user.id): (100, 5)})
+        with redirect_stdout(StringIO()):
+            call_command("reconcile_balances", fix=True)
+        self.assertEqual(self.balances(), (Decimal("5"), 0))
+
+
+@override_settings(AUTO_TAG=True)
+class ModerationTests(TestCase):
+
+    def setUp(self):
+        super(ModerationTests, self).setUp()
+        self.chamber = Chamber.objects.create(chamber="python",
+                                              title="Python", user=self._user)
+
+    def submit(self, chamber):
+        link = Link(title="Python", chamber=chamber, user=self._user,
+                    status=CONTENT_STATUS_DRAFT)
+        link.tag_on_save = False
+        link.save()
+        return ModerationTask.objects.create(link=link)
+
+    def test_moderate(self):
+        Keyword.objects.create(title="Python")
+        passed, failed = self.submit(self.chamber), self.submit(None)
+        self.assertEqual(passed.link.keywords_string, "")
+        submitted = now() - timedelta(hours=1)
+        Link.objects.filter(id=passed.link.id).update(
+            publish_date=submitted)
+        with redirect_stdout(StringIO()):
+            call_command("moderate", once=True)
+        passed = ModerationTask.objects.get(id=passed.id)
+        self.assertTrue(passed.done)
+        self.assertEqual(passed.link.status, CONTENT_STATUS_PUBLISHED)
+        self.assertGreater(passed.link.publish_date, submitted)
+        self.assertEqual(passed.link.score, score_for(
+            passed.link, Link.score_fields, "publish_date"))
+        self.assertEqual(passed.link.keywords_string, "Python")
+        failed = ModerationTask.objects.get(id=failed.id)
+        self.assertTrue(failed.done)
+        self.assertEqual(failed.link.status, CONTENT_STATUS_DRAFT)
+        self.assertIn("doesn't exist", failed.reason)
+
+    def test_claimed_once(self):
+        tasks = [self.submit(self.chamber) for i in range(3)]
+        self.assertEqual(len(ModerationTask.objects.claim(2)), 2)
+        self.assertEqual(ModerationTask.objects.claim(2)[0].id, tasks[2].id)
+        self.assertEqual(ModerationTask.objects.claim(2), [])
+        self.assertEqual(len(ModerationTask.objects.claim(5, timeout=-1)), 3)
+
+
+@skipIf(connection.vendor != "sqlite", "Query plans are checked on SQLite")
+class QueryPlanTests(TestCase):
+    """
+    Fails if the hottest queries stop using an index, and fall back
+    to scanning the whole table.
+    """
+
+    def assertUsesIndex(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN %s" % sql, params)
+            plan = [row[-1] for row in cursor.fetchall()]
+        scans = [step for step in plan if step.startswith("SCAN")
+                 and "USING" not in step]
+        self.assertEqual(scans, [], plan)
+        self.assertTrue(any("INDEX" in step for step in plan), plan)
+
+    def test_chamber_lists(self):
+        links = Link.objects.published().filter(chamber__chamber="test")
+        self.assertUsesIndex(links.order_by("-publish_date"))
+        self.assertUsesIndex(links.order_by("-score"))
+
+    def test_duplicate_link(self):
+        self.assertUsesIndex(Link.objects.filter(link="http://example.com/",
+            chamber=1, publish_date__gt=now() - timedelta(hours=1)))
+
+    def test_chamber_lookup(self):
+        self.assertUsesIndex(Chamber.objects.filter(chamber="test"))
+
+
+class TopCounterTests(TestCase):
+
+    def test_exact_within_capacity(self):
+        counter = TopCounter(10)
+        for word in "a b a c a b".split():
+            counter.add(word)
+        self.assertEqual(counter.most_common(2), [("a", 3), ("b", 2)])
+
+    def test_frequent_items_kept(self):
+        counter = TopCounter(5)
+        for i in range(1000):
+            counter.add("common", 2)
+            counter.add("rare%s" % i)
+        self.assertEqual(len(counter), 5)
+        self.assertEqual(counter.most_common(1)[0][0], "common")
+        self.assertGreaterEqual(counter.counts["common"], 2000)
+
+    def test_unique_slugs(self):
+        Link.objects.create(title="Taken", user=self._user)
+        slugs = unique_slugs(Link.objects.all(), ["taken", "free", "free"])
+        self.assertEqual(slugs, ["taken-1", "free", "free-1"])
+
+    def test_update_in_bulk_batched(self):
+        link = Link.objects.create(title="Test", user=self._user)
+        values = {pk: 1 for pk in range(link.id + 1, link.id + 1200)}
+        values[link.id] = 2
+        params = []
+
+        def record(execute, sql, sql_params, many, context):
+            params.append(len(sql_params or ()))
+            return execute(sql, sql_params, many, context)
+
+        with connection.execute_wrapper(record):
+            update_in_bulk(Link.objects.all(), "comments_count", values,
+                           extra={"updated": now()})
+        self.assertGreater(len(params), 1)
+        self.assertLess(max(params), 999)
+        self.assertEqual(Link.objects.get(id=link.id).comments_count, 2)
+
+
+RSS = """<?xml version="1.0"?>
+<rss version="2.0"><channel><title>Feed</title>
+<item><title>First</title><link>http://example.com/1</link></item>
+<item><title>Second</title><link>http://example.com/2</link></item>
+</channel></rss>"""
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+
+    rss = RSS
+    requests = []
+    redirects = {"/short": "/target", "/nohead": "/target"}
+    down = set()
+
+    def do_HEAD(self):
+        self.requests.append((self.command, self.path))
+        if self.path in self.down:
+            self.send_error(503)
+        elif self.command == "HEAD" and self.path == "/nohead":
+            self.send_error(405)
+        elif self.path in self.redirects:
+            self.send_response(301)
+            self.send_header("Location", self.redirects[self.path])
+            self.end_headers()
+        else:
+            self.send_response(200)
+            self.end_headers()
+
+    def do_GET(self):
+        if self.path in self.redirects or self.path in self.down:
+            return self.do_HEAD()
+        self.requests.append(self.headers.get("If-None-Match"))
+        if self.path == "/target":
+            self.send_response(200)
+            self.end_headers()
+            return
+        if self.path != "/rss":
+            self.send_error(404)
+            return
+        etag = '"%s"' % len(self.rss)
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/rss+xml")
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(self.rss.encode("utf-8"))
+
+    def log_message(self, *args):
+        pass
+
+
+class PollRSSTests(TestCase):
+
+    def setUp(self):
+        super(PollRSSTests, self).setUp()
+        FeedHandler.rss = RSS
+        FeedHandler.requests = []
+        FeedHandler.down = set()
+        self.server = HTTPServer(("127.0.0.1", 0), FeedHandler)
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:%s/" % self.server.server_port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        super(PollRSSTests, self).tearDown()
+
+    def poll(self, *urls):
+        with redirect_stdout(StringIO()) as out:
+            call_command("poll_rss", *urls, batch_size=1)
+        return out.getvalue()
+
+    def test_feeds_polled(self):
+        out = self.poll(self.url + "rss", self.url + "missing")
+        self.assertIn("skipping %smissing" % self.url, out)
+        links = Link.objects.order_by("link").values_list("link", flat=True)
+        self.assertEqual(list(links),
+                         ["http://example.com/1", "http://example.com/2"])
+        link = Link.objects.get(link="http://example.com/1")
+        self.assertEqual(link.rating_sum, 1)
+        self.assertEqual(Profile.objects.get(user_id=link.user_id)
+                         .total_uo_given, 2)
+
+    def test_conditional_get(self):
+        self.poll(self.url + "rss")
+        out = self.poll(self.url + "rss")
+        self.assertIn("Not modified", out)
+        self.assertEqual(FeedHandler.requests, [None, '"%s"' % len(RSS)])
+        # Only the new entry is processed once the feed changes.
+        FeedHandler.rss = RSS.replace("<item>", "<item><title>Third"
+            "</title><link>http://example.com/3</link></item><item>", 1)
+        Link.objects.filter(link="http://example.com/1").delete()
+        self.poll(self.url + "rss")
+        links = Link.objects.order_by("link").values_list("link", flat=True)
+        self.assertEqual(list(links),
+                         ["http://example.com/2", "http://example.com/3"])
+
+    def test_failed_follow_retried(self):
+        FeedHandler.rss = RSS.replace("http://example.com/1",
+                                      self.url + "short")
+        FeedHandler.rss = FeedHandler.rss.replace("http://example.com/2",
+                                                  self.url + "flaky")
+        FeedHandler.down = {"/flaky"}
+        with redirect_stdout(StringIO()):
+            call_command("poll_rss", self.url + "rss", follow=True)
+        links = set(Link.objects.values_list("link", flat=True))
+        self.assertEqual(links, {self.url + "target"})
+        FeedHandler.down = set()
+        with redirect_stdout(StringIO()):
+            call_command("poll_rss", self.url + "rss", follow=True)
+        links = set(Link.objects.values_list("link", flat=True))
+        self.assertEqual(links, {self.url + "target", self.url + "flaky"})
+
+    def test_follow_old(self):
+        for path in ("short", "nohead", "target", "short"):
+            Link.objects.create(title=path, link=self.url + path,
+                                user=self._user)
+        target = Link.objects.get(title="target")
+        SearchDocument.objects.update(text="stale")
+        started = now()
+        checkpoint = os.path.join(mkdtemp(), "checkpoint")
+        with redirect_stdout(StringIO()):
+            call_command("poll_rss", follow_old=True, batch_size=2,
+                         checkpoint=checkpoint)
+        links = set(Link.objects.values_list("link", flat=True))
+        self.assertEqual(links, {self.url + "target"})
+        for link in Link.objects.exclude(id=target.id):
+            self.assertGreaterEqual(link.updated, started)
+            self.assertIn("127.0.0.1", SearchDocument.objects.get(
+                link=link).text)
+        self.assertEqual(SearchDocument.objects.get(link=target).text,
+                         "stale")
+        self.assertEqual(FeedHandler.requests.count(("HEAD", "/short")), 1)
+        self.assertIn(("GET", "/nohead"), FeedHandler.requests)
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def test_follow_old_resumes(self):
+        links = [Link.objects.create(title=path, link=self.url + path,
+                                     user=self._user)
+                 for path in ("short", "nohead")]
+        checkpoint = os.path.join(mkdtemp(), "checkpoint")
+        with open(checkpoint, "w") as f:
+            f.write(str(links[0].id))
+        with redirect_stdout(StringIO()):
+            call_command("poll_rss", follow_old=True, checkpoint=checkpoint)
+        links = Link.objects.order_by("id").values_list("link", flat=True)
+        self.assertEqual(list(links),
+                         [self.url + "short", self.url + "target"])
+
+    @override_settings(AUTO_TAG=True)
+    def test_ingest_links(self):
+        python = Keyword.objects.create(title="Python")
+        Link.objects.create(title="New python", link="http://example.com/1",
+                            user=self._user)
+        links = [{"title": "New python", "link": "http://example.com/%s" % i}
+                 for i in (1, 2, 3, 2)]
+        added = ingest_links(links, self._user.id)
+        self.assertEqual([obj.link for obj in added],
+                         ["http://example.com/2", "http://example.com/3"])
+        for obj in added:
+            obj = Link.objects.get(id=obj.id)
+            self.assertEqual((obj.rating_count, obj.rating_sum), (1, 1))
+            self.assertEqual(obj.rating.get().user, self._user)
+            self.assertEqual([a.keyword for a in obj.keywords.all()], [python])
+            self.assertEqual(obj.keywords_string, "Python")
+        slugs = Link.objects.order_by("id").values_list("slug", flat=True)
+        self.assertEqual(list(slugs),
+                         ["new-python", "new-python-1", "new-python-2"])
+
+
+class SearchTests(TestCase):
+
+    def setUp(self):
+        super(SearchTests, self).setUp()
+        self.python, other = [
+            Chamber.objects.create(chamber=name, title=name, user=self._user)
+            for name in ("python", "other")]
+        self.packaging = Link.objects.create(title="Python packaging",
+            link="http://example.com/", chamber=self.python,
+            user=self._user)
+        self.frameworks = Link.objects.create(title="Web frameworks",
+            description="Flask versus Django, in Python", chamber=other,
+            user=self._user, gen_description=False)
+        self.rust = Link.objects.create(title="Rust ownership",
+                                        chamber=other, user=self._user)
+        self.comment = ThreadedComment.objects.create(
+            content_object=self.rust, comment="Easier than python's GC",
+            user=self._user, site_id=current_site_id())
+
+    def search(self, query, chamber=None):
+        return [(d.link.title, d.comment_id is not None)
+                for d in SearchDocument.objects.search(query, chamber)]
+
+    def test_kept_current(self):
+        self.assertEqual(sorted(self.search("python")), [
+            ("Python packaging", False), ("Rust ownership", True),
+            ("Web frameworks", False)])
+        self.assertEqual(self.search("example.com"),
+                         [("Python packaging", False)])
+        self.rust.title = "Rust borrowing"
+        self.rust.save()
+        self.assertEqual(self.search("borrowing"),
+                         [("Rust borrowing", False)])
+        self.comment.is_removed = True
+        self.comment.save()
+        self.frameworks.delete()
+        self.assertEqual(self.search("python"), [("Python packaging", False)])
+
+    def test_chamber_and_published(self):
+        self.assertEqual(self.search("python", "python"),
+                         [("Python packaging", False)])
+        Link.objects.filter(id=self.packaging.id).update(
+            status=CONTENT_STATUS_DRAFT)
+        self.assertEqual(self.search("python", "python"), [])
+
+    def test_blended_with_hot_score(self):
+        Link.objects.filter(id=self.frameworks.id).update(
+            score=F("score") + 10)
+        with override_settings(SEARCH_HOT_WEIGHT=0):
+            self.assertEqual(self.search("python")[0][0], "Python packaging")
+        with override_settings(SEARCH_HOT_WEIGHT=.9):
+            self.assertEqual(self.search("python")[0][0], "Web frameworks")
+
+    def test_query_syntax_ignored(self):
+        self.assertEqual(self.search('"rust" -(ownership*'),
+                         [("Rust ownership", False)])
+        self.assertEqual(self.search("  "), [])
+
+    def test_rebuild(self):
+        expected = sorted(self.search("python"))
+        SearchDocument.objects.all().delete()
+        self.assertEqual(self.search("python"), [])
+        with redirect_stdout(StringIO()):
+            call_command("rebuild_search_index", batch_size=2)
+        self.assertEqual(sorted(self.search("python")), expected)
+        self.assertEqual(SearchDocument.objects.count(), 4)
+
+    @override_settings(ITEMS_PER_PAGE=10, MAX_PAGING_LINKS=10)
+    def test_view_scoped_to_chamber(self):
+        request = RequestFactory().get("/c/python/search/", {"q": "python"})
+        view = SearchList(request=request, kwargs={"chamber": "python"})
+        view.object_list = view.get_queryset()
+        context = view.get_context_data()
+        self.assertEqual([d.link for d in context["object_list"]],
+                         [self.packaging])
+        self.assertEqual(context["chamber"], "python")
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class LinkItemRowsTests(TestCase):
+
+    def setUp(self):
+        super(LinkItemRowsTests, self).setUp()
+        chamber = Chamber.objects.create(chamber="python", title="Python",
+                                         user=self._user)
+        self.link = Link.objects.create(title="Python packaging",
+            link="http://example.com/", chamber=chamber, user=self._user)
+        keyword = Keyword.objects.create(title="Packaging")
+        self.link.assign_keywords([keyword.id])
+        self.context = {"request": RequestFactory().get("/")}
+
+    def rows(self):
+        links = Link.objects.select_related("chamber", "user")
+        rows = link_item_rows(self.context, links)
+        return [row for link, rating, row in rows]
+
+    def test_cached(self):
+        rows = self.rows()
+        self.assertIn("Python packaging", rows[0])
+        self.assertIn("(example.com)", rows[0])
+        self.assertIn("Packaging</a>", rows[0])
+        links = list(Link.objects.select_related("chamber", "user"))
+        with self.assertNumQueries(0):
+            cached = link_item_rows(self.context, links)
+        self.assertEqual([row for link, rating, row in cached], rows)
+
+    def test_invalidated(self):
+        self.rows()
+        Link.objects.filter(id=self.link.id).update(comments_count=3)
+        self.assertIn("3 comments", self.rows()[0])
+        keyword = Keyword.objects.get(title="Packaging")
+        keyword.title = "Packages"
+        keyword.save()
+        self.assertIn("Packages</a>", self.rows()[0])
+
+    @override_settings(ROOT_URLCONF=__name__, RATINGS_RANGE=[-1, 1])
+    def test_ratings(self):
+        other = Link.objects.create(title="Python typing",
+            link="http://example.org/", chamber=self.link.chamber,
+            user=self._user)
+        Rating.objects.create(content_object=self.link, user=self._user,
+                              value=1)
+        links = list(Link.objects.select_related("chamber", "user")
+                     .order_by("id"))
+        anonymous = [rating for link, rating, row in
+                     link_item_rows(self.context, links)]
+        self.assertNotIn("voted", anonymous[0])
+        self.context["request"].user = self._user
+        with self.assertNumQueries(1):
+            rows = link_item_rows(self.context, links)
+        voted, other_rating = [rating for link, rating, row in rows]
+        self.assertIn('value="1" checked', voted)
+        self.assertIn('class="updown voted"', voted)
+        self.assertNotIn("voted", other_rating)
+        data = {"content_type": "links.link", "object_pk": str(other.pk),
+                "value": "1"}
+        for field in ("timestamp", "security_hash"):
+            start = other_rating.index('name="%s" value="' % field)
+            data[field] = other_rating[start:].split('"')[3]
+        form = RatingForm(self.context["request"], other, data)
+        self.assertTrue(form.is_valid())
+        self.context["profile_user"] = self._user
+        rows = link_item_rows(self.context, links)
+        self.assertEqual([rating for link, rating, row in rows], [None] * 2)
@@ -4,6 +4,8 @@ from django.conf.urls import url
 from django.contrib.auth.decorators import login_required
 
 from drum.links.views import LinkList, LinkCreate, LinkDetail, CommentList, TagList
+from drum.links.views import LinkFeed
+from drum.links.views import SearchList, rating
 from drum.chambers.views import ChamberList
 
 urlpatterns = [
@@ -11,6 +13,9 @@ urlpatterns = [
         # change this to LinkList in order to show top links
         ChamberList.as_view(), {"by_score": False},
         name="home"),
+    url("^chambers/$",
+        ChamberList.as_view(),
+        name="chamber_list_active"),
     url("^newest/$",
         LinkList.as_view(), {"by_score": False},
         name="link_list_latest"),
@@ -20,21 +25,42 @@ urlpatterns = [
     url("^best/$",
         CommentList.as_view(),
         name="comment_list_best"),
+    url("^search/$",
+        SearchList.as_view(),
+        name="link_search"),
+    url("^c/(?P<chamber>.*)/search/$",
+        SearchList.as_view(),
+        name="chamber_search"),
+    url("^newest/feed/(?P<format>rss|atom)/$",
+        LinkFeed.as_view(),
+        name="link_feed"),
+    url("^c/(?P<chamber>.*)/feed/(?P<format>rss|atom)/$",
+        LinkFeed.as_view(),
+        name="chamber_feed"),
     url("^c/(?P<chamber>.*)/create/?$",
         login_required(LinkCreate.as_view()),
         name="link_create"),
     url("^c/(?P<chamber>.*)/(?P<slug>.*)/?$",
         LinkDetail.as_view(),
         name="link_detail"),
+    url("^users/(?P<username>.*)/links/feed/(?P<format>rss|atom)/$",
+        LinkFeed.as_view(),
+        name="link_feed_user"),
     url("^users/(?P<username>.*)/links/$",
         LinkList.as_view(), {"by_score": False},
         name="link_list_user"),
     url("^users/(?P<username>.*)/comments/$",
         CommentList.as_view(), {"by_score": False},
         name="comment_list_user"),
+    url("^vote/$",
+        rating,
+        name="vote"),
     url("^tags/$",
         TagList.as_view(),
         name="tag_list"),
+    url("^tags/(?P<tag>.*)/feed/(?P<format>rss|atom)/$",
+        LinkFeed.as_view(),
+        name="link_feed_tag"),
     url("^tags/(?P<tag>.*)/$",
         LinkList.as_view(),
         name="link_list_tag"),
@@ -1,10 +1,26 @@
 from __future__ import division, unicode_literals
 
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from collections import defaultdict
+from datetime import datetime
+from heapq import heapify, heappop, heappush, nlargest, nsmallest
+from json import dumps, loads
+from math import log10
 from re import sub, split
 
 from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Case, F, Q, When, Value
+from django.utils.dateparse import parse_datetime
 from django.utils.timezone import now
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 def order_by_score(queryset, score_fields, date_field, reverse=True):
     """
@@ -14,7 +30,7 @@ def order_by_score(queryset, score_fields, date_field, reverse=True):
     reduce over time. To perform this in the database, it needs to
     support a POW function, which Postgres and MySQL do. For databases
     that don't such as SQLite, we perform the scoring/sorting in
-    memory, which will suffice for development.
+    memory - see ``ScoreOrderedList``.
     """
 
     scale = getattr(settings, "SCORE_SCALE_FACTOR", 2)
@@ -44,12 +60,534 @@ def order_by_score(queryset, score_fields, date_field, reverse=True):
         order_by = "-score" if reverse else "score"
         return queryset.extra(select={"score": score_sql}).order_by(order_by)
     else:
-        for obj in queryset:
-            age = (now() - getattr(obj, date_field)).total_seconds()
-            score_fields_sum = sum([getattr(obj, f) for f in score_fields])
-            score = score_fields_sum / pow(age, scale)
-            setattr(obj, "score", score)
-        return sorted(queryset, key=lambda obj: obj.score, reverse=reverse)
+        return ScoreOrderedList(queryset, score_fields, date_field, reverse)
+
+
+class ScoreOrderedList(object):
+    """
+    Sequence of objects ordered by score in memory, for databases
+    without a POW function. Only ``(pk, date_field, *score_fields)``
+    rows are read from the database, and slicing keeps a heap of just
+    the top ``stop`` scores, before loading the model instances for the
+    slice itself. Memory use is then bounded by the page being viewed
+    rather than by the size of the table, and it can be passed straight
+    to ``paginate``. The scoring itself is done by ``top_scores``,
+    which can be vectorized with NumPy via the ``SCORE_BACKEND``
+    setting.
+    """
+
+    def __init__(self, queryset, score_fields, date_field, reverse=True):
+        self.queryset = queryset
+        self.score_fields = score_fields
+        self.date_field = date_field
+        self.reverse = reverse
+        self._count = None
+
+    def __len__(self):
+        if self._count is None:
+            self._count = self.queryset.count()
+        return self._count
+
+    def __iter__(self):
+        return iter(self._slice(0, None))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if index.step not in (None, 1):
+                raise ValueError("Slicing with a step isn't supported")
+            start, stop, _ = index.indices(len(self))
+            return self._slice(start, stop)
+        if index < 0:
+            index += len(self)
+        try:
+            return self._slice(index, index + 1)[0]
+        except IndexError:
+            raise IndexError("ScoreOrderedList index out of range")
+
+    def top(self, limit=None):
+        """
+        Return ``(score, pk)`` pairs for the top ``limit`` objects,
+        or for every object if no limit is given.
+        """
+        fields = ["pk"] + list(self.score_fields) + [self.date_field]
+        rows = self.queryset.order_by().prefetch_related(None)
+        rows = rows.values_list(*fields).iterator()
+        return top_scores(rows, limit, self.reverse)
+
+    def _slice(self, start, stop):
+        top = self.top(stop)[start:stop]
+        objects = self.queryset.in_bulk([pk for _, pk in top])
+        page = []
+        for score, pk in top:
+            obj = objects.get(pk)
+            if obj is not None:
+                setattr(obj, "score", score)
+                page.append(obj)
+        return page
+
+
+def calculate_score(score_fields_sum, date, at=None):
+    """
+    The in-memory version of the score formula used by
+    ``order_by_score``. Ages are clamped to a second so that brand
+    new objects (or ones without a date yet) don't divide by zero.
+    """
+    scale = getattr(settings, "SCORE_SCALE_FACTOR", 2)
+    at = at or now()
+    age = max((at - (date or at)).total_seconds(), 1)
+    return score_fields_sum / pow(age, scale)
+
+
+def use_numpy():
+    """
+    Whether batches of scores should be calculated with NumPy, which
+    is used when the ``SCORE_BACKEND`` setting is ``"numpy"`` and
+    NumPy is installed, otherwise falling back to pure Python.
+    """
+    backend = getattr(settings, "SCORE_BACKEND", "python")
+    return backend == "numpy" and numpy is not None
+
+
+def _numpy_scores(rows, at):
+    """
+    Load ``(pk, *score_fields, date)`` rows into arrays and calculate
+    all of their scores in one vectorized pass, returning arrays of
+    primary keys and scores.
+    """
+    rows = list(rows)
+    if not rows:
+        return numpy.array([], dtype=int), numpy.array([], dtype=float)
+    scale = getattr(settings, "SCORE_SCALE_FACTOR", 2)
+    pks = numpy.array([row[0] for row in rows])
+    sums = numpy.array([row[1:-1] for row in rows], dtype=float).sum(axis=1)
+    now_ts = at.timestamp()
+    dates = numpy.array([row[-1].timestamp() if row[-1] else now_ts
+                         for row in rows], dtype=float)
+    ages = numpy.maximum(now_ts - dates, 1)
+    return pks, sums / numpy.power(ages, scale)
+
+
+def hot_score(score_fields_sum, date):
+    """
+    The score stored against links, chambers and comments. Rather than
+    dividing by the object's age like ``calculate_score``, which would
+    only compare scores calculated at the same moment, it adds the
+    object's timestamp over ``SCORE_DECAY_SECONDS`` to the log of its
+    score fields, so being that much newer is worth ten times the
+    votes. Scores stored whenever each object was last saved are then
+    still comparable, and ``rescore`` only needs to be run after
+    changing the setting.
+    """
+    decay = getattr(settings, "SCORE_DECAY_SECONDS", 45000)
+    sign = (score_fields_sum > 0) - (score_fields_sum < 0)
+    magnitude = log10(max(abs(score_fields_sum), 1))
+    return sign * magnitude + (date or now()).timestamp() / decay
+
+
+def calculate_scores(rows):
+    """
+    Calculate the stored scores for many ``(pk, *score_fields, date)``
+    rows at once, returning a dict mapping primary keys to scores.
+    Used by offline jobs such as the ``rescore`` command.
+    """
+    if use_numpy():
+        rows = list(rows)
+        if not rows:
+            return {}
+        decay = getattr(settings, "SCORE_DECAY_SECONDS", 45000)
+        now_ts = now().timestamp()
+        pks = [row[0] for row in rows]
+        sums = numpy.array([row[1:-1] for row in rows],
+                           dtype=float).sum(axis=1)
+        dates = numpy.array([row[-1].timestamp() if row[-1] else now_ts
+                             for row in rows], dtype=float)
+        magnitudes = numpy.log10(numpy.maximum(numpy.abs(sums), 1))
+        scores = numpy.sign(sums) * magnitudes + dates / decay
+        return dict(zip(pks, scores.tolist()))
+    return {row[0]: hot_score(sum(row[1:-1]), row[-1]) for row in rows}
+
+
+def top_scores(rows, limit=None, reverse=True, at=None):
+    """
+    Given ``(pk, *score_fields, date)`` rows, return ``(score, pk)``
+    pairs for the ``limit`` highest scores (or lowest when ``reverse``
+    is ``False``), in order. With NumPy, ``argpartition`` selects the
+    top scores before only those are sorted; otherwise a heap of size
+    ``limit`` is used so memory stays bounded while streaming rows.
+    """
+    at = at or now()
+    if use_numpy():
+        pks, scores = _numpy_scores(rows, at)
+        keys = -scores if reverse else scores
+        if limit is not None and limit < len(keys):
+            if limit <= 0:
+                return []
+            index = numpy.argpartition(keys, limit - 1)[:limit]
+        else:
+            index = numpy.arange(len(keys))
+        # Sort the selection by score, then by primary key for ties,
+        # matching the ordering of the tuples in the pure Python path.
+        order = numpy.lexsort((pks[index], scores[index]))
+        if reverse:
+            order = order[::-1]
+        index = index[order]
+        return list(zip(scores[index].tolist(), pks[index].tolist()))
+    scores = ((calculate_score(sum(row[1:-1]), row[-1], at), row[0])
+              for row in rows)
+    if limit is None:
+        return sorted(scores, reverse=reverse)
+    return (nlargest if reverse else nsmallest)(limit, scores)
+
+
+def score_for(obj, score_fields, date_field):
+    """
+    Calculate the ``hot_score`` for a single object, which is what gets
+    stored against links, chambers and comments so that lists can
+    be ordered by an indexed column rather than by calculating
+    scores for every row on every request.
+    """
+    score_fields_sum = sum([getattr(obj, f) for f in score_fields])
+    return hot_score(score_fields_sum, getattr(obj, date_field))
+
+
+def update_in_bulk(queryset, field, values, key="pk", increment=False,
+                   extra=None):
+    """
+    Given a dict mapping primary keys (or values of the ``key``
+    field) to values, set ``field`` for each row with an
+    ``UPDATE ... CASE`` query, or add to it if ``increment`` is set.
+    Any other fields to set to the same value for every row can be
+    given in the ``extra`` dict. Each row takes three params (its
+    ``WHEN``, ``THEN`` and ``IN`` values), so there's a query per a
+    third of ``LOOKUP_BATCH_SIZE`` rows, all in one transaction.
+    """
+    if not values:
+        return 0
+    output_field = queryset.model._meta.get_field(field)
+
+    def update_batch(batch):
+        whens = [When(**{key: k, "then": Value(v)}) for k, v in batch]
+        update = Case(*whens, output_field=output_field)
+        if increment:
+            update = F(field) + update
+        lookup = {key + "__in": [k for k, v in batch]}
+        updates = dict(extra or {}, **{field: update})
+        return queryset.filter(**lookup).update(**updates)
+
+    items = list(values.items())
+    size = LOOKUP_BATCH_SIZE // 3
+    if len(items) <= size:
+        return update_batch(items)
+    with transaction.atomic(using=queryset.db):
+        return sum(update_batch(items[i:i + size])
+                   for i in range(0, len(items), size))
+
+
+def iterate_in_batches(queryset, fields, batch_size=1000):
+    """
+    Yield lists of ``values_list`` rows for the given fields, paging
+    through the queryset by primary key rather than with OFFSET, so
+    that large tables can be walked (and written to) in constant time
+    per batch. The primary key is always the first value in each row.
+    """
+    queryset = queryset.order_by("pk").values_list("pk", *fields)
+    last_pk = None
+    while True:
+        batch = queryset
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        batch = list(batch[:batch_size])
+        if not batch:
+            return
+        yield batch
+        last_pk = batch[-1][0]
+
+
+# Keeps the number of params per query under SQLite's limit.
+LOOKUP_BATCH_SIZE = 500
+
+
+def filter_in_batches(queryset, field, values):
+    """
+    Yield the results of filtering the queryset by ``field__in`` for
+    the values, with a query per ``LOOKUP_BATCH_SIZE`` values.
+    """
+    values = list(values)
+    for i in range(0, len(values), LOOKUP_BATCH_SIZE):
+        lookup = {"%s__in" % field: values[i:i + LOOKUP_BATCH_SIZE]}
+        for obj in queryset.filter(**lookup):
+            yield obj
+
+
+def unique_slugs(queryset, slugs):
+    """
+    Make each of the slugs unique within the queryset and each other,
+    the same way Mezzanine does when a ``Slugged`` object is saved,
+    but checking them all with one query rather than one each.
+    """
+    taken = queryset.values_list("slug", flat=True)
+    taken = set(filter_in_batches(taken, "slug", set(slugs)))
+    unique = []
+    for slug in slugs:
+        candidate, i = slug, 0
+        while candidate in taken or (
+                i and queryset.filter(slug=candidate).exists()):
+            i += 1
+            candidate = "%s-%s" % (slug, i)
+        taken.add(candidate)
+        unique.append(candidate)
+    return unique
+
+
+class TopCounter(object):
+    """
+    Approximate counts of the most frequent items in a stream, using
+    the Space-Saving algorithm, so that memory stays bounded by
+    ``capacity`` however many distinct items there are. When a new
+    item arrives and the counter is full, the item with the lowest
+    count is replaced, and the new item inherits its count, so counts
+    are overestimated by at most the count that was inherited.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        # Heap of (count, item), with stale entries skipped lazily.
+        self._heap = []
+
+    def __len__(self):
+        return len(self.counts)
+
+    def add(self, item, count=1):
+        if item not in self.counts and len(self.counts) >= self.capacity:
+            while True:
+                lowest, evicted = heappop(self._heap)
+                if self.counts.get(evicted) == lowest:
+                    break
+            del self.counts[evicted]
+            count += lowest
+        self.counts[item] = self.counts.get(item, 0) + count
+        heappush(self._heap, (self.counts[item], item))
+        if len(self._heap) > self.capacity * 4:
+            self._heap = [(c, i) for i, c in self.counts.items()]
+            heapify(self._heap)
+
+    def most_common(self, n=None):
+        items = self.counts.items()
+        if n is None:
+            return sorted(items, key=lambda item: item[1], reverse=True)
+        return nlargest(n, items, key=lambda item: item[1])
+
+
+class CursorPage(object):
+    """
+    A page of objects returned by ``cursor_paginate``, with opaque
+    ``next_cursor`` and ``previous_cursor`` tokens in place of page
+    numbers, and without a ``paginator``, since there's no count.
+    """
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+def encode_cursor(direction, values):
+    """
+    Encode the ordering values of the object a page starts or ends
+    at, into an opaque token for use in querystrings.
+    """
+    values = [{"dt": v.isoformat()} if isinstance(v, datetime) else v
+              for v in values]
+    data = dumps([direction, values]).encode("utf-8")
+    return urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if list(value) != ["dt"] or not isinstance(value["dt"], str):
+            raise ValueError("Invalid cursor")
+        value = parse_datetime(value["dt"])
+        if value is None:
+            raise ValueError("Invalid cursor")
+    elif value is not None and not isinstance(value, (int, float, str)):
+        raise ValueError("Invalid cursor")
+    return value
+
+
+def decode_cursor(cursor):
+    """
+    Reverse of ``encode_cursor``, raising ``ValueError`` for a
+    token that wasn't created by it.
+    """
+    try:
+        data = urlsafe_b64decode(str(cursor) + "=" * (-len(cursor) % 4))
+        direction, values = loads(data.decode("utf-8"))
+    except (BinasciiError, TypeError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+    if direction not in ("next", "prev") or not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return direction, [_decode_value(value) for value in values]
+
+
+def _nullable(model, field):
+    """
+    Whether a ``field__name`` style ordering field can be null,
+    either itself or because a relationship on the way to it is.
+    """
+    for name in field.split("__"):
+        field = model._meta.get_field(name)
+        if field.null:
+            return True
+        model = field.related_model
+    return False
+
+
+def _keyset_filter(queryset, keys, values):
+    """
+    Filter the queryset down to the objects after the given ordering
+    values, where nulls sort before every value, as they're ordered
+    by ``cursor_paginate``.
+    """
+    lookup = Q()
+    for i, (field, descending) in enumerate(keys):
+        prefix = Q()
+        for (other, _), value in zip(keys[:i], values):
+            if value is None:
+                prefix &= Q(**{other + "__isnull": True})
+            else:
+                prefix &= Q(**{other: value})
+        value = values[i]
+        if value is None:
+            if descending:
+                continue  # Nothing sorts after a null.
+            after = Q(**{field + "__isnull": False})
+        elif descending:
+            after = Q(**{field + "__lt": value})
+            if _nullable(queryset.model, field):
+                after |= Q(**{field + "__isnull": True})
+        else:
+            after = Q(**{field + "__gt": value})
+        lookup |= prefix & after
+    if not lookup:
+        return queryset.none()
+    return queryset.filter(lookup)
+
+
+def cursor_paginate(queryset, ordering, cursor, per_page):
+    """
+    Keyset pagination - rather than an OFFSET and a COUNT, each page
+    is selected by filtering on the ordering values of the last (or
+    first) object of the adjacent page, which is carried in the
+    ``cursor`` token. ``ordering`` should be a list of field names,
+    with a leading "-" for descending order, that ends with a unique
+    field such as "id". Each page costs the same as the first. Nulls
+    are ordered before any value, and an invalid cursor gives the
+    first page.
+    """
+    direction, values = "next", None
+    if cursor:
+        try:
+            direction, values = decode_cursor(cursor)
+        except ValueError:
+            pass
+        else:
+            if len(values) != len(ordering):
+                direction, values = "next", None
+    backwards = direction == "prev"
+    keys = [(f.lstrip("-"), f.startswith("-") != backwards) for f in ordering]
+    if values is not None:
+        try:
+            queryset = _keyset_filter(queryset, keys, values)
+        except (TypeError, ValueError, ValidationError):
+            return cursor_paginate(queryset, ordering, None, per_page)
+    order_by = [F(field).desc(nulls_last=True) if descending else
+                F(field).asc(nulls_first=True) for field, descending in keys]
+    object_list = list(queryset.order_by(*order_by)[:per_page + 1])
+    more = len(object_list) > per_page
+    object_list = object_list[:per_page]
+    if backwards:
+        object_list.reverse()
+    has_next = True if backwards else more
+    has_previous = more if backwards else values is not None
+    fields = [field for field, _ in keys]
+    next_cursor = previous_cursor = None
+    if object_list and has_next:
+        values = _cursor_values(object_list[-1], fields)
+        next_cursor = encode_cursor("next", values)
+    if object_list and has_previous:
+        values = _cursor_values(object_list[0], fields)
+        previous_cursor = encode_cursor("prev", values)
+    return CursorPage(object_list, next_cursor, previous_cursor)
+
+
+def _cursor_values(obj, fields):
+    """
+    Values for the given fields from an object, following any
+    relationships in ``field__name`` style names.
+    """
+    values = []
+    for field in fields:
+        value = obj
+        for attr in field.split("__"):
+            value = getattr(value, attr, None)
+        values.append(value)
+    return values
+
+
+def comment_tree(comments, score_fields, date_field, max_depth=None,
+                 max_children=None, expand=()):
+    """
+    Build the ``{replied_to_id: [comments]}`` dict that comment
+    templates recurse through, in a single pass over ``comments``,
+    with siblings ordered by score. Only the ``max_children`` highest
+    scoring replies to each comment are kept, and replies below
+    ``max_depth`` levels are dropped, except under any comment ids
+    (or ``None`` for top level comments) given in ``expand``. Also
+    returns a dict of the number of replies that were left out under
+    each comment id, for rendering "load more" links.
+    """
+    at = now()
+    children = defaultdict(list)
+    for comment in comments:
+        score_fields_sum = sum([getattr(comment, f) for f in score_fields])
+        score = calculate_score(score_fields_sum,
+                                getattr(comment, date_field), at)
+        setattr(comment, "score", score)
+        children[comment.replied_to_id].append(comment)
+    tree, more = {}, {}
+    parents = [(None, 0)]
+    while parents:
+        parent_id, depth = parents.pop()
+        replies = children.get(parent_id)
+        if not replies:
+            continue
+        replies.sort(key=lambda comment: comment.score, reverse=True)
+        if parent_id not in expand:
+            if max_depth is not None and depth >= max_depth:
+                more[parent_id] = len(replies)
+                continue
+            if max_children is not None and len(replies) > max_children:
+                more[parent_id] = len(replies) - max_children
+                replies = replies[:max_children]
+        tree[parent_id] = replies
+        parents.extend((comment.id, depth + 1) for comment in replies)
+    return tree, more
 
 
 def auto_tag(link_obj):
@@ -2,24 +2,40 @@ from __future__ import unicode_literals
 from future.builtins import super
 
 from datetime import timedelta
+from decimal import Decimal
+from json import dumps, loads
 
+from django.apps import apps
 from django.contrib.auth.models import User
 from django.contrib.messages import info, error
+from django.core.exceptions import ObjectDoesNotExist
 
+from django.db import transaction
+from django.db.models import F, Max
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect
 from django.utils.timezone import now
+from django.views.decorators.http import condition
 from django.views.generic import ListView, CreateView, DetailView, TemplateView
 
 from mezzanine.accounts import get_profile_model
 from mezzanine.conf import settings
-from mezzanine.generic.models import ThreadedComment, Keyword
+from mezzanine.core.models import CONTENT_STATUS_DRAFT
+from mezzanine.generic.models import ThreadedComment, Keyword, Rating
+from mezzanine.generic.views import rating as mezzanine_rating
 from mezzanine.utils.views import paginate
-from mezzanine.utils.automod import get_automod_scores, score_below_threshold
+from mezzanine.utils.automod import score_below_threshold
 
+from drum.links.cache import CachedPageList, get_ranked, page_to_cache
+from drum.links.cache import ranked_cache_key, ranked_cache_timeout, set_ranked
 from drum.links.forms import LinkForm
-from drum.links.models import Link, Profile
-from drum.links.utils import order_by_score
-from drum.chambers.models import Chamber
+from drum.links.models import BalanceTransaction, CommentScore
+from drum.links.models import InsufficientBalance, Link, ModerationTask
+from drum.links.models import SearchDocument
+from drum.links.syndication import FEED_TYPES, feed_item, stream_feed
+from drum.links.utils import CursorPage, order_by_score, cursor_paginate
+from drum.chambers.utils import AutomodUnavailable, automod_config
+from drum.chambers.utils import automod_scores
 
 
 # Returns the name to be used for reverse profile lookups from the user
@@ -61,26 +77,102 @@ class ScoreOrderingView(UserFilterView):
     """
     List view that optionally orders ``object_list`` by calculated
     score. Subclasses must defined a ``date_field`` attribute for the
-    related model, that's used to determine time-scaled scoring.
-    Ordering by score is the default behaviour, but can be
+    related model, that's used to determine time-scaled scoring, and
+    a ``score_field`` attribute naming the field the score is stored
+    in. Ordering by score is the default behaviour, but can be
     overridden by passing ``False`` to the ``by_score`` arg in
     urlpatterns, in which case ``object_list`` is sorted by most
     recent, using the ``date_field`` attribute. Used for showing lists
-    of links and comments.
+    of links and comments. Setting ``CURSOR_PAGINATION`` to ``True``
+    pages with cursor tokens rather than page numbers.
     """
 
+    def order_by_score(self, queryset):
+        """
+        Order by the stored score, which the database can page through
+        with an index. Stored scores decay by being compared against
+        newer ones (see ``hot_score``), and setting ``STORED_SCORES``
+        to ``False`` goes back to calculating scores by age on every
+        request.
+        """
+        if getattr(settings, "STORED_SCORES", True):
+            score = F(self.score_field).desc(nulls_last=True)
+            return queryset.order_by(score, "-" + self.date_field)
+        return order_by_score(queryset, self.score_fields, self.date_field)
+
+    def use_cursor(self, by_score):
+        """
+        Cursor pagination needs the ordering to be on stored fields,
+        so isn't available when scores are calculated per request.
+        """
+        if not getattr(settings, "CURSOR_PAGINATION", False):
+            return False
+        return not by_score or getattr(settings, "STORED_SCORES", True)
+
+    def get_ranked_cache_key(self, by_score):
+        """
+        Cache key for the ids on the current page, if the view has a
+        ``ranked_cache_namespace`` and caching isn't disabled via the
+        ``RANKED_CACHE_TIMEOUT`` setting.
+        """
+        namespace = getattr(self, "ranked_cache_namespace", None)
+        if not namespace or not ranked_cache_timeout():
+            return None
+        return ranked_cache_key(namespace, self.kwargs.get("chamber"),
+                                by_score=by_score,
+                                tag=self.kwargs.get("tag"),
+                                username=self.kwargs.get("username"),
+                                page=self.request.GET.get("page", 1),
+                                cursor=self.request.GET.get("cursor"),
+                                items=settings.ITEMS_PER_PAGE)
+
+    def get_page(self, queryset, by_score):
+        """
+        Order and paginate the queryset, by page number or by cursor.
+        """
+        items = settings.ITEMS_PER_PAGE
+        if self.use_cursor(by_score):
+            field = self.score_field if by_score else self.date_field
+            cursor = self.request.GET.get("cursor")
+            ordering = ["-" + field, "-id"]
+            return cursor_paginate(queryset, ordering, cursor, items)
+        if by_score:
+            queryset = self.order_by_score(queryset)
+        else:
+            queryset = queryset.order_by("-" + self.date_field)
+        page = self.request.GET.get("page", 1)
+        max_page = settings.MAX_PAGING_LINKS
+        return paginate(queryset, page, items, max_page)
+
+    def get_cached_page(self, queryset, by_score):
+        """
+        Wraps ``get_page`` with the ranked list cache, which stores
+        just the ids for the page, so that a hit costs a single query
+        loading those objects rather than ranking the whole table.
+        """
+        key = self.get_ranked_cache_key(by_score)
+        if key is None:
+            return self.get_page(queryset, by_score)
+        data = get_ranked(key)
+        if data is None:
+            page = self.get_page(queryset, by_score)
+            set_ranked(key, page_to_cache(page))
+            return page
+        objects = queryset.in_bulk(data["ids"])
+        objects = [objects[pk] for pk in data["ids"] if pk in objects]
+        if "count" not in data:
+            return CursorPage(objects, data["next"], data["previous"])
+        items = settings.ITEMS_PER_PAGE
+        offset = (data["number"] - 1) * items
+        objects = CachedPageList(objects, data["count"], offset)
+        return paginate(objects, data["number"], items,
+                        settings.MAX_PAGING_LINKS)
+
     def get_context_data(self, **kwargs):
         context = super(ScoreOrderingView, self).get_context_data(**kwargs)
         qs = context["object_list"]
         context["by_score"] = self.kwargs.get("by_score", True)
-        if context["by_score"]:
-            qs = order_by_score(qs, self.score_fields, self.date_field)
-        else:
-            qs = qs.order_by("-" + self.date_field)
-        page = self.request.GET.get("page", 1)
-        items = settings.ITEMS_PER_PAGE
-        max_page = settings.MAX_PAGING_LINKS
-        context["object_list"] = paginate(qs, page, items, max_page)
+        context["object_list"] = self.get_cached_page(qs, context["by_score"])
         # Update context_object_name variable
         context_object_name = self.get_context_object_name(context["object_list"])
         context[context_object_name] = context["object_list"]
@@ -99,9 +191,16 @@ class LinkView(object):
         return context
 
     def get_queryset(self, chamber=None):
+        """
+        The chamber in the URL is looked up by name as part of the
+        query, joining on the chamber's unique index.
+        """
         user_rel = "user__%s" % USER_PROFILE_RELATED_NAME
-        links = Link.objects.published().select_related("user", user_rel)
-        return links if not chamber else links.filter(chamber=chamber)
+        links = Link.objects.published().select_related("user", user_rel,
+                                                        "chamber")
+        if not chamber:
+            return links
+        return links.filter(chamber__chamber=chamber)
 
 
 class LinkList(LinkView, ScoreOrderingView):
@@ -113,7 +212,9 @@ class LinkList(LinkView, ScoreOrderingView):
     """
 
     date_field = "publish_date"
-    score_fields = ["rating_sum", "comments_count"]
+    score_fields = Link.score_fields
+    score_field = "score"
+    ranked_cache_namespace = "links"
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -128,7 +229,7 @@ class LinkList(LinkView, ScoreOrderingView):
         tag = self.kwargs.get("tag")
         if tag:
             queryset = queryset.filter(keywords__keyword__slug=tag)
-        return queryset.prefetch_related("keywords__keyword")
+        return queryset
 
     def get_title(self, context):
         tag = self.kwargs.get("tag")
@@ -145,6 +246,83 @@ class LinkList(LinkView, ScoreOrderingView):
             return "Newest"
 
 
+class LinkFeed(LinkList):
+    """
+    RSS or Atom feed of the newest links in a ``LinkList`` - all of
+    them, or those in a chamber, with a tag or by a user - streamed
+    as it's generated. The newest ``publish_date`` is cached along
+    with the ranked lists, and gives the ETag and Last-Modified
+    headers, so that an unchanged feed gets a 304 without any queries.
+    """
+
+    def get_queryset(self):
+        queryset = super(LinkFeed, self).get_queryset()
+        username = self.kwargs.get("username")
+        if username:
+            queryset = queryset.filter(user__username__iexact=username,
+                                       user__is_active=True)
+        queryset = queryset.prefetch_related("keywords__keyword")
+        return queryset.order_by("-publish_date")
+
+    def latest_publish_date(self):
+        key = None
+        if ranked_cache_timeout():
+            key = ranked_cache_key("feeds", self.kwargs.get("chamber"),
+                                   tag=self.kwargs.get("tag"),
+                                   username=self.kwargs.get("username"))
+            data = get_ranked(key)
+            if data is not None:
+                return data["latest"]
+        latest = self.get_queryset().aggregate(latest=Max("publish_date"))
+        if key is not None:
+            set_ranked(key, latest)
+        return latest["latest"]
+
+    def get_feed_title(self):
+        for name in ("chamber", "tag"):
+            if self.kwargs.get(name):
+                return "%s: %s" % (settings.SITE_TITLE, self.kwargs[name])
+        if self.kwargs.get("username"):
+            return "Links by %s" % self.kwargs["username"]
+        return "%s: Newest" % settings.SITE_TITLE
+
+    def stream(self, latest):
+        request = self.request
+        # Feeds live at "feed/<format>/" under the list they're for.
+        list_url = request.path.rsplit("feed/", 1)[0]
+        feed = FEED_TYPES[self.kwargs["format"]](
+            title=self.get_feed_title(), description="",
+            link=request.build_absolute_uri(list_url),
+            feed_url=request.build_absolute_uri())
+        limit = getattr(settings, "FEED_ITEMS", 30)
+
+        def items():
+            for link in self.get_queryset()[:limit]:
+                url = request.build_absolute_uri(link.get_absolute_url())
+                keywords = [assigned.keyword.title
+                            for assigned in link.keywords.all()]
+                yield feed_item(feed, title=link.title, link=url,
+                                unique_id=url, description=link.description,
+                                pubdate=link.publish_date,
+                                updateddate=link.updated,
+                                author_name=link.user.username,
+                                categories=keywords)
+        return stream_feed(feed, items(), latest or now())
+
+    def get(self, request, *args, **kwargs):
+        latest = self.latest_publish_date()
+        etag = "%s-%s" % (kwargs["format"],
+                          latest.timestamp() if latest else "empty")
+
+        @condition(etag_func=lambda request: etag,
+                   last_modified_func=lambda request: latest)
+        def feed(request):
+            content_type = FEED_TYPES[kwargs["format"]].content_type
+            return StreamingHttpResponse(self.stream(latest),
+                                         content_type=content_type)
+        return feed(request)
+
+
 class LinkCreate(CreateView):
     """
     Link creation view - assigns the user to the new link, as well
@@ -172,29 +350,36 @@ class LinkCreate(CreateView):
 
     def form_valid(self, form):
         hours = getattr(settings, "ALLOWED_DUPLICATE_LINK_HOURS", None)
-        chamber = form.instance.chamber
+        chamber_obj = form.instance.chamber
+        chamber = chamber_obj.chamber
         text = form.instance.description
-        profile = Profile.objects.get(user=self.request.user)
-        chamber_min = Chamber.objects.get(chamber=chamber).min_thread_balance
+        config = automod_config(chamber)
+        if config is None:
+            raise Http404
+        chamber_min = config["min_thread_balance"]
+        queue = getattr(settings, "MODERATION_QUEUE", False)
         # automod
-        scores, automods = get_automod_scores(self.request, chamber, text)
-        fail_info = score_below_threshold(scores, automods)
-        if fail_info:
-            msg = "Failed automoderation:<br><br>{}".format(fail_info)
-            error(self.request, msg)
-            # todo: fix this url
-            return redirect('chamber_view', chamber=chamber)
-        user_balance = profile.balance
-        if user_balance < chamber_min:
-            msg = "Balance ({}) too low to create a thread in '{}'. Minimum: {}"
-            formed = msg.format(user_balance, chamber, chamber_min)
-            error(self.request, formed)
-            # todo: fix this url
-            return redirect('chamber_view', chamber=chamber)
+        if not queue:
+            try:
+                scores, automods = automod_scores(self.request, chamber,
+                                                  text)
+            except AutomodUnavailable:
+                # Without the queue, nothing would retry a held draft.
+                error(self.request, "Automoderation is unavailable right "
+                                    "now, please try again shortly.")
+                return self.form_invalid(form)
+            else:
+                fail_info = score_below_threshold(scores, automods)
+                if fail_info:
+                    msg = "Failed automoderation:<br><br>{}".format(
+                        fail_info)
+                    error(self.request, msg)
+                    # todo: fix this url
+                    return redirect('chamber_view', chamber=chamber)
 
         if hours and form.instance.link:
             lookup = dict(link=form.instance.link,
-                          chamber=chamber,
+                          chamber=chamber_obj,
                           publish_date__gt=now()-timedelta(hours=hours))
             try:
                 link = Link.objects.get(**lookup)
@@ -205,8 +390,32 @@ class LinkCreate(CreateView):
                 return redirect(link)
         form.instance.user = self.request.user
         form.instance.gen_description = False
+        if queue:
+            # Saved as a draft, and published by the moderate command.
+            form.instance.status = CONTENT_STATUS_DRAFT
+            form.instance.tag_on_save = False
+        # The balance check and charge lock the user's profile until
+        # the link is saved, so concurrent posts can't overspend.
+        cost = Decimal(str(getattr(settings, "THREAD_COST", 0)))
+        try:
+            with transaction.atomic():
+                BalanceTransaction.objects.transfer(cost,
+                    user_id=self.request.user.id, chamber_id=config["id"],
+                    reason="thread", minimum=chamber_min)
+                response = super(LinkCreate, self).form_valid(form)
+                if queue:
+                    ModerationTask.objects.create(link=self.object)
+        except InsufficientBalance as e:
+            msg = "Balance ({}) too low to create a thread in '{}'. Minimum: {}"
+            formed = msg.format(e.balance, chamber, chamber_min)
+            error(self.request, formed)
+            # todo: fix this url
+            return redirect('chamber_view', chamber=chamber)
+        if queue:
+            info(self.request, "Link submitted for moderation")
+            return redirect('chamber_view', chamber=chamber)
         info(self.request, "Link created")
-        return super(LinkCreate, self).form_valid(form)
+        return response
 
 
 class LinkDetail(LinkView, DetailView):
@@ -227,11 +436,13 @@ class CommentList(ScoreOrderingView):
     """
 
     date_field = "submit_date"
-    score_fields = ["rating_sum"]
+    score_fields = CommentScore.score_fields
+    score_field = "hot_score__score"
 
     def get_queryset(self):
         qs = ThreadedComment.objects.filter(is_removed=False, is_public=True)
-        select = ["user", "user__%s" % (USER_PROFILE_RELATED_NAME)]
+        select = ["user", "user__%s" % (USER_PROFILE_RELATED_NAME),
+                  "hot_score"]
         prefetch = ["content_object"]
         return qs.select_related(*select).prefetch_related(*prefetch)
 
@@ -252,5 +463,76 @@ class CommentList(ScoreOrderingView):
         return context
 
 
+class SearchList(ListView):
+    """
+    Search results for links and comments, across every chamber, or
+    the one in the URL. Ranked in memory, so paged by page number.
+    """
+
+    template_name = "links/search_results.html"
+
+    def get_queryset(self):
+        query = self.request.GET.get("q", "")
+        chamber = self.kwargs.get("chamber")
+        return SearchDocument.objects.search(query, chamber=chamber)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["object_list"] = paginate(context["object_list"],
+                                          self.request.GET.get("page", 1),
+                                          settings.ITEMS_PER_PAGE,
+                                          settings.MAX_PAGING_LINKS)
+        context["chamber"] = self.kwargs.get("chamber", "")
+        context["query"] = self.request.GET.get("q", "")
+        context["title"] = "Search results for \"%s\"" % context["query"]
+        return context
+
+
+def rating(request):
+    """
+    Wraps Mezzanine's rating view, adding the current user's vote to
+    its JSON response for AJAX requests, so that the rated item can be
+    updated in place rather than reloading the whole page. Versions of
+    Mezzanine that only treat JSON posts as AJAX redirect instead, in
+    which case the JSON is built here from the reloaded object, using
+    the rating cookie to tell a saved vote from a redirect to log in.
+    """
+    response = mezzanine_rating(request)
+    if not request.is_ajax() or response.status_code not in (200, 302):
+        return response
+    if response.status_code == 302:
+        if "mezzanine-rating" not in response.cookies:
+            data = {"location": response["Location"]}
+            return HttpResponse(dumps(data), content_type="application/json")
+        data = {}
+    else:
+        data = loads(response.content.decode("utf-8"))
+        if "location" in data:
+            return response
+    data["rating_user"] = 0
+    try:
+        model = apps.get_model(*request.POST["content_type"].split(".", 1))
+        obj = model.objects.get(pk=int(request.POST["object_pk"]))
+    except (KeyError, LookupError, ValueError, ObjectDoesNotExist):
+        pass
+    else:
+        rating_name = obj.get_ratingfield_name()
+        for f in ("average", "count", "sum"):
+            data.setdefault("rating_" + f,
+                            getattr(obj, "%s_%s" % (rating_name, f)))
+        if request.user.is_authenticated:
+            votes = Rating.objects.filter(
+                user=request.user, object_pk=obj.pk,
+                content_type__app_label=model._meta.app_label,
+                content_type__model=model._meta.model_name)
+            votes = votes.values_list("value", flat=True)
+            data["rating_user"] = votes.first() or 0
+    data["object_pk"] = request.POST.get("object_pk")
+    json = HttpResponse(dumps(data), content_type="application/json")
+    # Carry over the rating cookie Mezzanine sets.
+    json.cookies = response.cookies
+    return json
+
+
 class TagList(TemplateView):
     template_name = "links/tag_list.html"